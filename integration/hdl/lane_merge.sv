@@ -0,0 +1,99 @@
+`default_nettype none // prevents system from inferring an undeclared logic (good practice)
+
+module lane_merge #(
+    parameter COMPUTE_LANES = 1, // a power of two
+    parameter DIMS = 2,
+    parameter MASK_DEPTH = 128 // tasks in flight through compute, more than its latency
+) (
+    input wire clk_in,
+    input wire rst,
+    // scheduler
+    input wire valid_task,
+    input wire [COMPUTE_LANES-1:0] lane_valid,
+    // compute lanes
+    input wire [COMPUTE_LANES-1:0] [16*DIMS-1:0] lane_data,
+    input wire [COMPUTE_LANES-1:0] lane_data_valid,
+    input wire [COMPUTE_LANES-1:0] lane_terms_in_flight,
+    // accumulator
+    output logic [16*DIMS-1:0] data_out,
+    output logic data_valid_out,
+    output logic terms_in_flight
+);
+
+    // Merges the terms of the compute lanes into one term per clock for
+    // accum_storage. The lanes get their tasks together and are in lockstep,
+    // so their results come out together too. Lanes without a task (the
+    // last group of a sweep, past particle_count) are added as +0, which the
+    // adder passes through unchanged. The sums go through an adder tree,
+    // lane 2n + 1 added to lane 2n at every level.
+
+    localparam LEVELS = $clog2(COMPUTE_LANES);
+
+    generate
+        if (COMPUTE_LANES == 1) begin
+            assign data_out = lane_data[0];
+            assign data_valid_out = lane_data_valid[0];
+            assign terms_in_flight = lane_terms_in_flight[0];
+        end else begin
+            // lane_valid of every task in compute, in order
+            logic [COMPUTE_LANES-1:0] masks [MASK_DEPTH-1:0];
+            logic [$clog2(MASK_DEPTH)-1:0] head, tail;
+            always_ff @( posedge clk_in ) begin
+                if (rst) begin
+                    head <= 0;
+                    tail <= 0;
+                end else begin
+                    if (valid_task) begin
+                        masks[tail] <= lane_valid;
+                        tail <= tail + 1;
+                    end
+                    if (lane_data_valid[0]) begin
+                        head <= head + 1;
+                    end
+                end
+            end
+
+            logic [LEVELS:0] [COMPUTE_LANES-1:0] [DIMS-1:0] [15:0] tree;
+            logic [LEVELS:0] tree_valid;
+            logic [LEVELS-1:0] [COMPUTE_LANES-1:0] [DIMS-1:0] adder_busy;
+            genvar l, k, n, d;
+            for (l=0; l<COMPUTE_LANES; l=l+1) begin
+                assign tree[0][l] = (masks[head][l]) ? lane_data[l] : '0;
+            end
+            assign tree_valid[0] = lane_data_valid[0];
+
+            for (k=0; k<LEVELS; k=k+1) begin : level
+                for (n=0; n<COMPUTE_LANES; n=n+1) begin : node
+                    if (n < (COMPUTE_LANES >> (k + 1))) begin
+                        for (d=0; d<DIMS; d=d+1) begin : dim
+                            logic valid;
+                            binary16_adder merge (
+                                .clk_in(clk_in),
+                                .rst(rst),
+                                .a(tree[k][2*n][d]),
+                                .b(tree[k][2*n+1][d]),
+                                .data_valid_in(tree_valid[k]),
+                                .result(tree[k+1][n][d]),
+                                .data_valid_out(valid),
+                                .busy(adder_busy[k][n][d])
+                            );
+                            if (n == 0 && d == 0) begin
+                                assign tree_valid[k+1] = valid;
+                            end
+                        end
+                    end else begin
+                        assign tree[k+1][n] = '0;
+                        assign adder_busy[k][n] = '0;
+                    end
+                end
+            end
+
+            assign data_out = tree[LEVELS][0];
+            assign data_valid_out = tree_valid[LEVELS];
+            assign terms_in_flight = (|lane_terms_in_flight) || (|adder_busy) || (head != tail);
+        end
+    endgenerate
+
+endmodule
+
+`default_nettype wire
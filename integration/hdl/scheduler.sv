@@ -1,5 +1,10 @@
 `default_nettype none // prevents system from inferring an undeclared logic (good practice)
 
+// Two optional modes, both off by default: GRID (pairs from the 3^DIMS
+// cells around a particle only) and COMPUTE_LANES > 1 (groups of tasks for
+// that many compute lanes). Without them the scheduler issues every pair,
+// test_scheduler checks it against grid_schedule.all_pairs_stream.
+
 module scheduler #(
     // parameter particle_count = 4,
     parameter DIMS = 2, // x, y, z
@@ -8,7 +13,20 @@ module scheduler #(
     parameter TASK_WIDTH = 16*5, 
     parameter COUNTER_SIZE = 16,
     parameter PREDICTION_FACTOR = 16'h1FF0, // 1 / 60.0
-    parameter RAM_PERFORMANCE = "HIGH_PERFORMANCE" // Select "HIGH_PERFORMANCE" or "LOW_LATENCY"
+    parameter RAM_PERFORMANCE = "HIGH_PERFORMANCE", // Select "HIGH_PERFORMANCE" or "LOW_LATENCY"
+    // Grid mode (GRID = 1): pair i only with the particles in the 3^DIMS
+    // cells around its own, see below. grid_schedule.py writes the tables
+    // and the cell sorted particle memory, and gives these parameters.
+    parameter GRID = 0,
+    parameter GRID_CELLS = 1, // cells of the grid, padded by one on every side
+    parameter GRID_ROW = 1, // cells along the last dimension
+    parameter GRID_PLANE = 1, // cells in the last two dimensions
+    parameter MAX_PARTICLES = 128,
+    parameter CELL_FILE = "", // {start, end} particle addresses of every cell
+    parameter PARTICLE_CELL_FILE = "", // cell of every particle address
+    // Lanes (COMPUTE_LANES > 1, a power of two, GRID = 0): tasks go to that
+    // many compute lanes at once, see below
+    parameter COMPUTE_LANES = 1
 
 ) (
     input wire clk_in,
@@ -35,7 +53,8 @@ module scheduler #(
     // dispatcher
     output logic valid_task,
     output logic [1:0] task_type,
-    output logic [TASK_WIDTH-1:0] task_data, // [x_i, x_j, P_i, P_j, rho_j]
+    output logic [COMPUTE_LANES-1:0] [TASK_WIDTH-1:0] task_data, // [x_i, x_j, P_i, P_j, rho_j] per lane
+    output logic [COMPUTE_LANES-1:0] lane_valid, // lanes with a task, the others' results are dropped
     input wire [15:0] particle_count
 );
 
@@ -60,14 +79,16 @@ module scheduler #(
     logic [COUNTER_SIZE:0] cycle_counter; // cycle counter
     // logic [4:0] cycle_counter; // cycle counter
 
-    enum {DONE, INIT, DENSITIES, FORCES, PART_DONE} state, last_state;
+    enum {DONE, INIT, READBACK, DENSITIES, FORCES, PART_DONE} state, last_state;
     typedef enum bit [1:0] {DENSITY, FORCE} task_type_t;
 
     assign mem_write_enable = 0;
     assign main_index = i;
     assign is_density_task = last_state == DENSITIES;
     assign done = state == DONE; //  done with everything 
-    assign reading_positions = state == DENSITIES && cycle_counter > 2 && cycle_counter < particle_count + 3;
+    // the walk of grid mode doesn't read the memory in order, it reads it
+    // for the renderer in READBACK first, with the same timing
+    assign reading_positions = ((GRID) ? state == READBACK : state == DENSITIES) && cycle_counter > 2 && cycle_counter < particle_count + 3;
 
     // We need to add position predictions
     logic [DIMS-1:0] [15:0] pos_change_result, pos_predict_result;
@@ -129,6 +150,71 @@ module scheduler #(
         end
     end
 
+    // Grid mode: the particle memory is sorted by cell, so every cell is a
+    // range of addresses. For particle i the walk below loads the ranges of
+    // the stencil cells around particle_cells[i] one after the other and
+    // reads their particles, one per cycle, instead of all N. A read turns
+    // into a task ISSUE_DELAY cycles later, like the all pairs read at
+    // cycle_counter == j turns into the task at j + ISSUE_DELAY, so the
+    // walk's reads are delayed by issue_pipe. Loading a range takes the
+    // cycle of the range's last read, an empty cell one cycle of its own.
+    // Those gaps are far shorter than compute's latency, so
+    // terms_in_flight never drops before the last task is issued.
+    localparam STENCIL = 3**DIMS;
+    localparam ISSUE_DELAY = 3 + ADDER_CYCLES + MULTI_CYCLES;
+
+    logic [2*COUNTER_SIZE-1:0] cell_bounds [GRID_CELLS-1:0];
+    logic [COUNTER_SIZE-1:0] particle_cells [MAX_PARTICLES-1:0];
+    generate
+        if (GRID) begin
+            initial begin
+                $readmemh(CELL_FILE, cell_bounds);
+                $readmemh(PARTICLE_CELL_FILE, particle_cells);
+            end
+        end
+    endgenerate
+
+    // cell offset of stencil entry s, the last dimension counting fastest
+    function automatic logic [COUNTER_SIZE-1:0] stencil_offset(input integer s);
+        integer d, offset, stride;
+        begin
+            offset = 0;
+            stride = 1;
+            for (d = 0; d < DIMS; d = d + 1) begin
+                offset = offset + ((s % 3) - 1) * stride;
+                s = s / 3;
+                stride = (d == 0) ? GRID_ROW : GRID_PLANE;
+            end
+            stencil_offset = offset;
+        end
+    endfunction
+
+    logic [$clog2(STENCIL+1)-1:0] stencil; // next stencil cell to load
+    logic [COUNTER_SIZE-1:0] walk_j, walk_end; // range being read
+    logic [COUNTER_SIZE-1:0] neighbor_cell;
+    logic walk_reading, walk_done;
+    logic [ISSUE_DELAY-1:0] issue_pipe, self_pipe; // a read of the walk, and of particle i itself
+    assign neighbor_cell = particle_cells[i] + stencil_offset(stencil);
+    assign walk_reading = walk_j < walk_end;
+    assign walk_done = stencil == STENCIL && !walk_reading && issue_pipe == 0;
+
+    // Lanes: the first sweep of a phase (i == 0) goes to lane 0 alone as
+    // usual, and keeps the x_j, P_j and rho_j of every task in the cache_
+    // arrays, j in lane j % COMPUTE_LANES. Every later sweep reads them back from
+    // the cache for COMPUTE_LANES j at a time, group g being
+    // j = g * COMPUTE_LANES + l, and takes ceil(N / COMPUTE_LANES) cycles
+    // instead of N. Only x_i and P_i come from the memory and accum_storage
+    // then. lane_merge adds the lanes' terms of a group into one term.
+    localparam CACHE_DEPTH = MAX_PARTICLES / COMPUTE_LANES;
+    logic [COMPUTE_LANES-1:0] [16*DIMS-1:0] cache_x [CACHE_DEPTH-1:0];
+    logic [COMPUTE_LANES-1:0] [15:0] cache_P [CACHE_DEPTH-1:0];
+    logic [COMPUTE_LANES-1:0] [15:0] cache_rho [CACHE_DEPTH-1:0];
+    logic lanes_cached;
+    logic [COUNTER_SIZE-1:0] issue_index, groups; // j, or the group, of the task issued this cycle
+    assign lanes_cached = COMPUTE_LANES > 1 && GRID == 0 && i != 0;
+    assign issue_index = cycle_counter - ISSUE_DELAY;
+    assign groups = (particle_count + COMPUTE_LANES - 1) / COMPUTE_LANES;
+
     // Memory is now 64 wide with [p_x, p_y, v_x, v_y]
     always_ff @( posedge clk_in ) begin 
         if (rst_in) begin
@@ -152,6 +238,7 @@ module scheduler #(
             valid_task <= 0;
             task_type <= 0;
             task_data <= 0;
+            lane_valid <= 0;
 
         end else begin
             case (state)
@@ -173,9 +260,29 @@ module scheduler #(
                     req_index <= 0;
                     
                     cycle_counter <= 0;
-                    state <= DENSITIES;
+                    stencil <= 0;
+                    walk_j <= 0;
+                    walk_end <= 0;
+                    issue_pipe <= 0;
+                    self_pipe <= 0;
+                    state <= (GRID) ? READBACK : DENSITIES;
 
                 end
+                READBACK: begin
+                    // grid mode only: every particle in address order, for
+                    // reading_positions, before the first walk. No tasks
+                    if (cycle_counter < particle_count) begin
+                        addr_out <= cycle_counter;
+                    end else begin
+                        addr_out <= 0;
+                    end
+                    if (cycle_counter == particle_count + 3) begin
+                        cycle_counter <= 0;
+                        state <= DENSITIES;
+                    end else begin
+                        cycle_counter <= cycle_counter + 1;
+                    end
+                end
                 FORCES, DENSITIES: begin
 
                     next_sum <= 0;
@@ -186,29 +293,65 @@ module scheduler #(
                         // predicted position
                         x_i <= pos_predict_result;
                         P_i <= pressure_pipe[PREDICT_STAGES-1];
+                    end else if (cycle_counter > 2 + ADDER_CYCLES + MULTI_CYCLES && lanes_cached) begin // a group from the cache
+                        for (int l = 0; l < COMPUTE_LANES; l = l + 1) begin
+                            if (state == DENSITIES) begin
+                                task_data[l] <= {x_i, cache_x[issue_index][l], 48'b0};
+                            end else if (issue_index * COMPUTE_LANES + l != i) begin
+                                task_data[l] <= {x_i, cache_x[issue_index][l], P_i, cache_P[issue_index][l], cache_rho[issue_index][l]};
+                            end else begin
+                                task_data[l] <= {x_i, cache_x[issue_index][l], 16'b0, 16'b0, cache_rho[issue_index][l]};
+                            end
+                            lane_valid[l] <= issue_index * COMPUTE_LANES + l < particle_count;
+                        end
+                        task_type <= (state == DENSITIES) ? DENSITY : FORCE;
+                        valid_task <= 1;
+                        if (cycle_counter == groups + 3 + ADDER_CYCLES + MULTI_CYCLES) begin
+                            state <= PART_DONE;
+                            valid_task <= 0;
+                        end
                     end else if (cycle_counter > 2 + ADDER_CYCLES + MULTI_CYCLES) begin // submit results as tasks
                         if (state == DENSITIES) begin
-                            task_data <= {x_i, pos_predict_result, 48'b0}; // x_i, x_j
+                            task_data[0] <= {x_i, pos_predict_result, 48'b0}; // x_i, x_j
                             task_type <= DENSITY;
                             // valid_task <= 1;
                         end else begin
-                            if (cycle_counter != i + 3 + ADDER_CYCLES + MULTI_CYCLES) begin
-                                task_data <= {x_i, pos_predict_result, P_i, pressure_pipe[PREDICT_STAGES-1], density_reciprocal_pipe[PREDICT_STAGES-1]}; // x_i, x_j
+                            if (GRID ? !self_pipe[ISSUE_DELAY-1] : cycle_counter != i + 3 + ADDER_CYCLES + MULTI_CYCLES) begin
+                                task_data[0] <= {x_i, pos_predict_result, P_i, pressure_pipe[PREDICT_STAGES-1], density_reciprocal_pipe[PREDICT_STAGES-1]}; // x_i, x_j
                             end else begin
-                                task_data <= {x_i, pos_predict_result, 16'b0, 16'b0, density_reciprocal_pipe[PREDICT_STAGES-1]}; // should set force to 0
+                                task_data[0] <= {x_i, pos_predict_result, 16'b0, 16'b0, density_reciprocal_pipe[PREDICT_STAGES-1]}; // should set force to 0
                                 // task_data <= 0;
                             end
                             task_type <= FORCE;
                             // valid_task <= cycle_counter != i + 3 + ADDER_CYCLES + MULTI_CYCLES; // don't compute force on self
                         end
-                            valid_task <= 1;
-                        if (cycle_counter == particle_count + 3 + ADDER_CYCLES + MULTI_CYCLES) begin
+                            valid_task <= GRID ? issue_pipe[ISSUE_DELAY-1] : 1;
+                            lane_valid <= 1;
+                        if (COMPUTE_LANES > 1 && issue_index < particle_count) begin
+                            cache_x[issue_index / COMPUTE_LANES][issue_index % COMPUTE_LANES] <= pos_predict_result;
+                            cache_P[issue_index / COMPUTE_LANES][issue_index % COMPUTE_LANES] <= pressure_pipe[PREDICT_STAGES-1];
+                            cache_rho[issue_index / COMPUTE_LANES][issue_index % COMPUTE_LANES] <= density_reciprocal_pipe[PREDICT_STAGES-1];
+                        end
+                        if (GRID ? walk_done : cycle_counter == particle_count + 3 + ADDER_CYCLES + MULTI_CYCLES) begin
                             state <= PART_DONE;
                             valid_task <= 0;
                         end
                     end 
 
-                    if (cycle_counter < particle_count) begin
+                    if (GRID) begin
+                        if (walk_reading) begin
+                            addr_out <= walk_j;
+                            req_index <= walk_j;
+                            walk_j <= walk_j + 1;
+                        end
+                        // the range is done after this cycle, load the next one
+                        if (walk_j + 1 >= walk_end && stencil < STENCIL) begin
+                            {walk_j, walk_end} <= cell_bounds[neighbor_cell];
+                            stencil <= stencil + 1;
+                        end
+                        issue_pipe <= {issue_pipe[ISSUE_DELAY-2:0], walk_reading};
+                        self_pipe <= {self_pipe[ISSUE_DELAY-2:0], walk_reading && walk_j == i};
+                    end else if (cycle_counter < particle_count) begin
                         addr_out <= j; // x_1, v_1, x_2, whether to make each dim a different entry
                         j <= j + 1;
                         req_index <= j;
@@ -227,6 +370,11 @@ module scheduler #(
                         next_sum <= 1;
                         cycle_counter <= 0;
                         j <= 0;
+                        stencil <= 0;
+                        walk_j <= 0;
+                        walk_end <= 0;
+                        issue_pipe <= 0;
+                        self_pipe <= 0;
 
                         if (i < particle_count - 1) begin
                             i <= i + 1;
@@ -20,7 +20,14 @@ module simulator #(
     
     parameter COUNTER_SIZE = 16,
     parameter DIMS = 2, // x, y, z
-    parameter BOUND = 32'h49004900 // [10.0f, 10.0f] haven't fully tested this yet
+    parameter BOUND = 32'h49004900, // [10.0f, 10.0f] haven't fully tested this yet
+    // scheduler grid mode, particle.mem has to be cell sorted (grid_schedule.py)
+    parameter GRID = 0,
+    parameter GRID_CELLS = 1,
+    parameter GRID_ROW = 1,
+    parameter GRID_PLANE = 1,
+    // compute pipelines fed at once, a power of two (scheduler.sv, lane_merge.sv)
+    parameter COMPUTE_LANES = 1
 ) (
     input wire clk_in, //100 MHz onboard clock,
     input wire sys_rst, //system reset button (active high)
@@ -149,7 +156,8 @@ module simulator #(
     localparam TASK_WIDTH = 16*7;
     logic [1:0] task_type;
     logic valid_task;
-    logic [TASK_WIDTH-1:0] task_data; // [x_i, x_j, P_i, P_j, rho_j] x_i are vectors
+    logic [COMPUTE_LANES-1:0] [TASK_WIDTH-1:0] task_data; // [x_i, x_j, P_i, P_j, rho_j] x_i are vectors
+    logic [COMPUTE_LANES-1:0] lane_valid;
 
 
     // Scheduler
@@ -161,7 +169,14 @@ module simulator #(
         .ADDR_WIDTH(ADDR_WIDTH),
         .RAM_WIDTH(RAM_WIDTH),
         .TASK_WIDTH(TASK_WIDTH),
-        .RAM_PERFORMANCE("HIGH_PERFORMANCE")
+        .RAM_PERFORMANCE("HIGH_PERFORMANCE"),
+        .GRID(GRID),
+        .GRID_CELLS(GRID_CELLS),
+        .GRID_ROW(GRID_ROW),
+        .GRID_PLANE(GRID_PLANE),
+        .CELL_FILE(`FPATH(cells.mem)),
+        .PARTICLE_CELL_FILE(`FPATH(particle_cells.mem)),
+        .COMPUTE_LANES(COMPUTE_LANES)
     ) mscheduler (
         .clk_in(clk_in),
         .rst_in(sys_rst | resetting_sim),
@@ -186,6 +201,7 @@ module simulator #(
         .valid_task(valid_task),
         .task_type(task_type), 
         .task_data(task_data),
+        .lane_valid(lane_valid),
         // Simulation Config
         .particle_count(particle_count)
     );
@@ -194,24 +210,69 @@ module simulator #(
     // Compute 
     logic [16*DIMS-1:0] receiver_data;
     logic receiver_valid, terms_in_flight;
-    compute #(
-        .TASK_WIDTH(TASK_WIDTH),
-        .DIMS(DIMS),
-        .H(H),
-        .KERNEL_COEFF(KERNEL_COEFF),
-        .DIV_KERNEL_COEFF(DIV_KERNEL_COEFF)
-    ) mcompute (
-        .clk_in(clk_in),
-        .rst(sys_rst | resetting_sim),
-        .valid_task(valid_task),
-        .task_type(task_type),
-        .data_in(task_data),
-        .data_out(receiver_data),
-        .terms_in_flight(terms_in_flight),
-        .data_valid_out(receiver_valid),
-        // Simulation Config
-        .gravitational_constant(gravitational_constant)
-    );
+    generate
+        if (COMPUTE_LANES == 1) begin : single
+            compute #(
+                .TASK_WIDTH(TASK_WIDTH),
+                .DIMS(DIMS),
+                .H(H),
+                .KERNEL_COEFF(KERNEL_COEFF),
+                .DIV_KERNEL_COEFF(DIV_KERNEL_COEFF)
+            ) mcompute (
+                .clk_in(clk_in),
+                .rst(sys_rst | resetting_sim),
+                .valid_task(valid_task),
+                .task_type(task_type),
+                .data_in(task_data),
+                .data_out(receiver_data),
+                .terms_in_flight(terms_in_flight),
+                .data_valid_out(receiver_valid),
+                // Simulation Config
+                .gravitational_constant(gravitational_constant)
+            );
+        end else begin : lanes
+            logic [COMPUTE_LANES-1:0] [16*DIMS-1:0] lane_data;
+            logic [COMPUTE_LANES-1:0] lane_data_valid, lane_terms_in_flight;
+            genvar lane;
+            for (lane=0; lane<COMPUTE_LANES; lane=lane+1) begin : lane_compute
+                compute #(
+                    .TASK_WIDTH(TASK_WIDTH),
+                    .DIMS(DIMS),
+                    .H(H),
+                    .KERNEL_COEFF(KERNEL_COEFF),
+                    .DIV_KERNEL_COEFF(DIV_KERNEL_COEFF)
+                ) mcompute (
+                    .clk_in(clk_in),
+                    .rst(sys_rst | resetting_sim),
+                    .valid_task(valid_task),
+                    .task_type(task_type),
+                    .data_in(task_data[lane]),
+                    .data_out(lane_data[lane]),
+                    .terms_in_flight(lane_terms_in_flight[lane]),
+                    .data_valid_out(lane_data_valid[lane]),
+                    // Simulation Config
+                    .gravitational_constant(gravitational_constant)
+                );
+            end
+
+            // one term per clock for the accumulator, the lanes' terms of a task group added
+            lane_merge #(
+                .COMPUTE_LANES(COMPUTE_LANES),
+                .DIMS(DIMS)
+            ) mlane_merge (
+                .clk_in(clk_in),
+                .rst(sys_rst | resetting_sim),
+                .valid_task(valid_task),
+                .lane_valid(lane_valid),
+                .lane_data(lane_data),
+                .lane_data_valid(lane_data_valid),
+                .lane_terms_in_flight(lane_terms_in_flight),
+                .data_out(receiver_data),
+                .data_valid_out(receiver_valid),
+                .terms_in_flight(terms_in_flight)
+            );
+        end
+    endgenerate
 
     // Accumulator
     logic [16*(DIMS+1)-1:0] accumulator_out;
@@ -0,0 +1,212 @@
+import numpy as np
+
+
+# Bit-exact, vectorized models of the binary16 arithmetic units in hdl/.
+# Every function takes uint16 bit patterns (scalars or arrays, broadcast
+# together) and returns the uint16 pattern the RTL produces, including its
+# truncation instead of rounding, the implicit leading 1 it assumes for
+# subnormals, its zero/infinity handling and its 5 bit exponent wraparound.
+
+ONE = 0x3C00
+SIGN = 0x8000
+
+
+def bits(a):
+    """uint16 bit patterns as int32, wide enough for every intermediate result."""
+    return np.asarray(a).astype(np.int32) & 0xFFFF
+
+
+def fields(a):
+    a = bits(a)
+    return a >> 15, (a >> 10) & 0x1F, a & 0x3FF
+
+
+# leading zeros of an 11 bit significand, 0 for 0 (the casez in binary16_adder)
+LEADING_ZEROS = np.array([0] + [10 - m.bit_length() + 1 for m in range(1, 1 << 11)], dtype=np.int32)
+
+
+# binary16_adder.sv, one function per pipeline stage. Each one takes the
+# registers the stage before it wrote and returns the ones it writes, named
+# as in the RTL. Registers are int32 arrays (or scalars).
+
+ADDER_LATENCY = 4 # ADDER_CYCLES in compute.sv
+
+
+def adder_stage1(a, b):
+    """align exponents"""
+    a, b = bits(a), bits(b)
+    sign_a, exp_a, frac_a = fields(a)
+    sign_b, exp_b, frac_b = fields(b)
+    mant_a, mant_b = frac_a | 0x400, frac_b | 0x400
+    exp_diff = np.abs(exp_a - exp_b)
+    return {
+        "exp_max": np.maximum(exp_a, exp_b),
+        "aligned_mant_a": np.where((a & 0x7FFF) == 0, 0, np.where(exp_a > exp_b, mant_a, mant_a >> exp_diff)),
+        "aligned_mant_b": np.where((b & 0x7FFF) == 0, 0, np.where(exp_b > exp_a, mant_b, mant_b >> exp_diff)),
+        "sign_a_store": sign_a,
+        "sign_b_store": sign_b,
+    }
+
+
+def adder_stage2(r):
+    """add/subtract significands"""
+    aligned_a, aligned_b = r["aligned_mant_a"], r["aligned_mant_b"]
+    sign_a, sign_b = r["sign_a_store"], r["sign_b_store"]
+    same_sign = sign_a == sign_b
+    equal = ~same_sign & (aligned_a == aligned_b)
+    sign_sum = np.where(same_sign | (aligned_a > aligned_b), sign_a, sign_b)
+    return {
+        "exp_max_store": np.where(equal, 0, r["exp_max"]),
+        "mant_sum_ext": np.where(same_sign, aligned_a + aligned_b, np.abs(aligned_a - aligned_b)),
+        "sign_sum": np.where(equal, 0, sign_sum),
+    }
+
+
+def adder_stage3(r):
+    """normalize a carry out"""
+    mant_sum = r["mant_sum_ext"]
+    carry = (mant_sum >> 11) & 1
+    return {
+        "sign_sum_store": r["sign_sum"],
+        "mant_sum_norm": np.where(carry == 1, (mant_sum >> 1) & 0x7FF, mant_sum & 0x7FF),
+        "exp_sum_adj": (r["exp_max_store"] + carry) & 0x1F,
+    }
+
+
+def adder_stage4(r):
+    """shift out leading zeros"""
+    mant_norm = r["mant_sum_norm"]
+    lz = LEADING_ZEROS[mant_norm]
+    return {
+        "sign_final": r["sign_sum_store"],
+        "exp_sum": (r["exp_sum_adj"] - lz) & 0x1F,
+        "mant_sum": (mant_norm << lz) & 0x7FF,
+    }
+
+
+def adder_result(r):
+    return ((r["sign_final"] << 15) | (r["exp_sum"] << 10) | (r["mant_sum"] & 0x3FF)).astype(np.uint16)
+
+
+ADDER_STAGES = (adder_stage2, adder_stage3, adder_stage4)
+
+
+def add(a, b):
+    """binary16_adder.sv"""
+    r = adder_stage1(a, b)
+    for stage in ADDER_STAGES:
+        r = stage(r)
+    return adder_result(r)
+
+
+class AdderPipeline:
+    """
+    Cycle model of binary16_adder.sv. clock() is one rising edge: every
+    stage register takes the value the stage before it computed, a and b
+    (scalars or arrays of lanes) are captured by stage 1, and the outputs
+    after the edge are returned. A sum comes out ADDER_LATENCY edges after
+    the one that captured it, result is 0 whenever data_valid_out is low.
+    """
+
+    def __init__(self):
+        self.registers = [None] * ADDER_LATENCY # stage 1..4, None until first written
+        self.valid_pipe = [False] * ADDER_LATENCY
+
+    def reset(self):
+        self.valid_pipe = [False] * ADDER_LATENCY
+
+    def clock(self, a=0, b=0, data_valid_in=False):
+        previous = self.registers[:-1]
+        self.registers = [adder_stage1(a, b)] + [stage(r) if r is not None else None
+                                                 for stage, r in zip(ADDER_STAGES, previous)]
+        self.valid_pipe = [data_valid_in] + self.valid_pipe[:-1]
+        return self.outputs()
+
+    def outputs(self):
+        """(result, data_valid_out, busy)"""
+        valid = self.valid_pipe[-1]
+        result = adder_result(self.registers[-1]) if valid else np.uint16(0)
+        return result, valid, any(self.valid_pipe)
+
+
+def sub(a, b):
+    """a - b the way the HDL does it, by flipping the sign bit of b."""
+    return add(a, bits(b) ^ SIGN)
+
+
+# clock edges from the one capturing an input to the one raising data_valid_out
+MULTI_LATENCY = 4 # MULTI_CYCLES in compute.sv
+DIV_LATENCY = 23 # binary16_div.sv takes an input every DIV_INTERVAL clocks
+DIV_INTERVAL = 24
+DIV_PIPELINED_LATENCY = 25
+SQRT_LATENCY = 13
+
+
+def mul(a, b):
+    """binary16_multi.sv"""
+    sign_a, exp_a, frac_a = fields(a)
+    sign_b, exp_b, frac_b = fields(b)
+    sign = sign_a ^ sign_b
+    exp_sum = np.where(exp_a + exp_b > 15, (exp_a + exp_b - 15) & 0x1F, 0)
+    product = (frac_a | 0x400) * (frac_b | 0x400)
+
+    carry = (product >> 21) & 1
+    mant = np.where(carry == 1, (product >> 11) & 0x3FF, (product >> 10) & 0x3FF)
+    exp_result = (exp_sum + carry) & 0x1F
+
+    result = (sign << 15) | (exp_result << 10) | mant
+    result = np.where((exp_a == 31) | (exp_b == 31), (sign << 15) | 0x7C00, result)
+    result = np.where((exp_a == 0) | (exp_b == 0), 0, result)
+    return result.astype(np.uint16)
+
+
+def div(a, b):
+    """binary16_div.sv (and binary16_div_pipelined.sv, which gives identical results)."""
+    sign_a, exp_a, frac_a = fields(a)
+    sign_b, exp_b, frac_b = fields(b)
+    # 22 steps of restoring division leave floor((mant_a << 11) / mant_b)
+    quotient = ((frac_a | 0x400) << 11) // (frac_b | 0x400)
+    exp_diff = exp_a - exp_b + 15
+
+    normalized = ((quotient >> 11) & 1) == 1
+    mant = np.where(normalized, (quotient >> 1) & 0x3FF, quotient & 0x3FF)
+    exp_result = np.where(normalized, exp_diff, exp_diff - 1) & 0x1F
+    return (((sign_a ^ sign_b) << 15) | (exp_result << 10) | mant).astype(np.uint16)
+
+
+div_pipelined = div
+
+
+def sqrt(n):
+    """binary16_sqrt.sv, 0 for negative inputs."""
+    n = bits(n)
+    sign, exp, frac = fields(n)
+    odd = (exp & 1) == 1
+    x = np.where(odd, (((frac | 0x400) + 1) << 10), (frac | 0x400) << 11) & 0x3FFFFF
+    exp_out = np.where(odd, ((exp + 1) >> 1) + 7, (exp >> 1) + 7) & 0x1F
+
+    zero = n == 0
+    x = np.where(zero, 0, x)
+    exp_out = np.where(zero, 0, exp_out)
+
+    # 11 pipeline stages of the digit by digit square root
+    c = np.zeros_like(x)
+    d = 1 << 20
+    for _ in range(11):
+        cd = (c + d) & 0x3FFFFF
+        take = (x > d) & (x >= cd)
+        x = np.where(take, x - cd, x)
+        c = np.where(take, (c >> 1) + d, c >> 1)
+        d >>= 2
+
+    result = (exp_out << 10) | (c & 0x3FF)
+    result = np.where(sign == 1, 0, result)
+    return result.astype(np.uint16)
+
+
+def abs_gt(a, b):
+    """abs_comp in particle_updater.sv, |a| > |b| on the raw exponent and mantissa."""
+    _, exp_a, frac_a = fields(a)
+    _, exp_b, frac_b = fields(b)
+    return (exp_a > exp_b) | ((exp_a == exp_b) & (frac_a > frac_b))
+
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+# Conversions between Python/NumPy floats and the binary16 bit patterns the
+# hardware stores, for whole arrays at once. Encoding rounds to nearest even
+# (np.float16); the testbenches and the golden models both use these, and
+# particle.mem words are packed and unpacked here too.
+
+# particle word fields, most significant first: {x, y, v_x, v_y}
+WORD_FIELDS = 4
+
+
+def encode(values):
+    """Floats to binary16 bit patterns. Arrays give uint16 arrays, scalars an int."""
+    bits = np.asarray(values, dtype=np.float16).view(np.uint16)
+    return int(bits) if bits.ndim == 0 else bits
+
+
+def decode(bits):
+    """binary16 bit patterns to floats. Arrays give float64 arrays, scalars a float."""
+    values = np.asarray(bits).astype(np.uint16).view(np.float16).astype(np.float64)
+    return float(values) if values.ndim == 0 else values
+
+
+def pack(fields):
+    """
+    (..., k) uint16 fields to (...) words, the first field most significant.
+    Words are uint64 up to 4 fields, Python ints (object arrays) above, e.g.
+    the 96 bit words of DIMS=3.
+    """
+    fields = np.asarray(fields, dtype=np.uint64)
+    k = fields.shape[-1]
+    if k > 4:
+        words = np.zeros(fields.shape[:-1], dtype=object)
+        for f in range(k):
+            words = (words << 16) | fields[..., f].astype(object)
+        return words
+    shifts = np.arange(k - 1, -1, -1, dtype=np.uint64) * np.uint64(16)
+    return np.bitwise_or.reduce(fields << shifts, axis=-1)
+
+
+def unpack(words, k=WORD_FIELDS):
+    """(...) words to (..., k) uint16 fields, the inverse of pack."""
+    if k > 4:
+        words = np.asarray(words, dtype=object)
+        return np.stack([(words >> (16 * (k - 1 - f))) & 0xFFFF for f in range(k)], axis=-1).astype(np.uint16)
+    words = np.asarray(words, dtype=np.uint64)
+    shifts = np.arange(k - 1, -1, -1, dtype=np.uint64) * np.uint64(16)
+    return ((words[..., None] >> shifts) & np.uint64(0xFFFF)).astype(np.uint16)
+
+
+def encode_particles(positions, velocities):
+    """(N, DIMS) float positions and velocities to (N,) particle words."""
+    return pack(encode(np.hstack([np.asarray(positions), np.asarray(velocities)])))
+
+
+def decode_particles(words, dims=2):
+    """(N,) particle words to (N, DIMS) float positions and velocities."""
+    values = decode(unpack(np.atleast_1d(words), 2 * dims))
+    return values[:, :dims], values[:, dims:]
+
+
+# the scalar helpers the testbenches have always used
+
+def rep(val):
+    """binary16 bit pattern of a float, as an int."""
+    return encode(float(val))
+
+float_to_binary16_int_rep = rep
+
+def float32_to_binary16(val):
+    return np.float16(val)
+
+def half(val):
+    """Float value of a binary16 bit pattern (an int or a cocotb value)."""
+    return decode(int(val))
@@ -0,0 +1,123 @@
+import os
+import random
+import numpy as np
+import cocotb
+from cocotb.clock import Clock
+from cocotb.triggers import ClockCycles
+from binary16_codec import half
+from binary16_sweep import UNITS, CLASSES, classify, exact_result
+from pipeline_stream import stream
+
+
+# Streams stratified vectors through the binary16 units of hdl/ with
+# pipeline_stream, a new one every unit.interval clocks. Every result has
+# to come out exactly unit.latency clocks after its input, in order, and
+# match the reference bit for bit.
+#
+# REFERENCE=model (the default) checks against the binary16.py models, so
+# every output bit of the RTL is pinned. REFERENCE=numpy checks against
+# NumPy float16 instead. The units truncate and don't do subnormals, so
+# there results only fail when they are outside every documented class of
+# deviation (the "other" class of binary16_sweep).
+#
+# VECTORS sets the number of vectors per test (divided by the interval of
+# units that can't take one every clock), the cocotb RANDOM_SEED seeds them.
+
+DEFAULT_VECTORS = 20000
+LOGGED_MISMATCHES = 10
+
+# (weight, exponents) of the strata each operand is drawn from, exponents
+# None for random bit patterns
+STRATA = {
+    "zero": (1, [0]),
+    "subnormal": (2, [0]),
+    "min_normal": (2, [1]),
+    "near_one": (3, [14, 15, 16]),
+    "max_normal": (2, [30]),
+    "special": (1, [31]),
+    "normal": (6, list(range(1, 31))),
+    "bits": (3, None),
+}
+
+
+def stratified(count, arity, rng):
+    """(count, arity) uint16 operands, each drawn from a random stratum."""
+    names = list(STRATA)
+    weights = np.array([STRATA[name][0] for name in names], dtype='float64')
+    strata = rng.choice(len(names), size=(count, arity), p=weights / weights.sum())
+
+    sign = rng.integers(0, 2, size=(count, arity))
+    # fractions at both ends of their range now and then
+    frac = rng.integers(0, 1 << 10, size=(count, arity))
+    frac = np.where(rng.random((count, arity)) < 0.125, 0, frac)
+    frac = np.where(rng.random((count, arity)) < 0.125, 0x3FF, frac)
+    exp = np.zeros((count, arity), dtype=np.int64)
+    for k, name in enumerate(names):
+        exponents = STRATA[name][1]
+        mask = strata == k
+        if exponents is not None:
+            exp[mask] = rng.choice(exponents, size=np.count_nonzero(mask))
+    frac = np.where(strata == names.index("zero"), 0, frac)
+    frac = np.where((strata == names.index("subnormal")) & (frac == 0), 1, frac)
+    vectors = (sign << 15) | (exp << 10) | frac
+    vectors = np.where(strata == names.index("bits"), rng.integers(0, 1 << 16, size=(count, arity)), vectors)
+
+    if arity == 2:
+        # an eighth of the pairs close in magnitude: cancellations, quotients near 1
+        close = rng.random(count) < 0.125
+        partner = (vectors[:, 0] & 0x7FFF) + rng.integers(-4, 5, size=count)
+        partner = np.clip(partner, 0, 0x7FFF) | (rng.integers(0, 2, size=count) << 15)
+        vectors[close, 1] = partner[close]
+    return vectors.astype(np.uint16)
+
+
+def reference_results(unit, vectors, reference):
+    if reference == "model":
+        return unit.model(*vectors.T).astype(np.uint16)
+    if reference == "numpy":
+        with np.errstate(all='ignore'):
+            return unit.exact(*vectors.T.view(np.float16)).astype(np.float16).view(np.uint16)
+    raise ValueError(f"unknown reference {reference!r}, model or numpy")
+
+
+async def reset(dut):
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.data_valid_in.value = 0
+    dut.rst.value = 1
+    await ClockCycles(dut.clk_in, 3)
+    dut.rst.value = 0
+
+
+def check(dut, unit, vectors, results, reference):
+    """Compares results with the reference, logs the first mismatches and asserts on the failing ones."""
+    expected = reference_results(unit, vectors, reference)
+    mismatch = results != expected
+    if reference == "numpy":
+        classes, _ = classify(unit, vectors.T, results, exact_result(unit, vectors.T))
+        counts = {name: int(np.count_nonzero(mismatch & (classes == k))) for k, name in enumerate(CLASSES)}
+        dut._log.info(f"differences from numpy by class: {counts}")
+        failing = mismatch & (classes == CLASSES.index("other"))
+    else:
+        failing = mismatch
+
+    for index in np.flatnonzero(failing)[:LOGGED_MISMATCHES]:
+        operands = ", ".join(f"{int(x):04x} ({half(x)})" for x in vectors[index])
+        dut._log.error(f"{unit.module}({operands}): got {int(results[index]):04x} ({half(results[index])}), "
+                       f"expected {int(expected[index]):04x} ({half(expected[index])})")
+    assert not failing.any(), f"{np.count_nonzero(failing)} of {len(vectors)} results differ from the {reference} reference"
+
+
+async def run(dut, op):
+    """Resets dut, streams VECTORS stratified vectors through it and checks every result against REFERENCE."""
+    unit = UNITS[op]
+    reference = os.getenv("REFERENCE", "model")
+    count = max(int(os.getenv("VECTORS", DEFAULT_VECTORS)) // unit.interval, 1)
+    vectors = stratified(count, len(unit.inputs), np.random.default_rng(random.getrandbits(32)))
+
+    dut._log.info(f"Streaming {count} vectors through {unit.module}, checked against the {reference} reference")
+    await reset(dut)
+    results, report = await stream(dut, unit.inputs, vectors.tolist(), interval=unit.interval,
+                                   latency=unit.latency, name=unit.module)
+    check(dut, unit, vectors, results[:, 0].astype(np.uint16), reference)
+    dut._log.info(f"{count} results of {unit.module} match the {reference} reference")
+    return report
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import Callable, Tuple
+import numpy as np
+import binary16
+from mem_image import ulp_distance
+
+
+# Exhaustive sweeps of the binary16.py models over every input pattern,
+# 2^32 (a, b) pairs for a binary unit, chunked across processes. Every
+# result is compared with the exact result of the same inputs, rounded to
+# binary16 both to nearest even and toward zero, and put into one class:
+#
+#   special     an input is inf or NaN (exponent 31), or the result is NaN
+#   subnormal   an input is subnormal, the RTL gives it an implicit 1
+#   overflow    the exact result is too large for binary16
+#   underflow   the exact result is nonzero and below the smallest normal
+#   exact       the result is the correctly rounded one
+#   truncated   the result is the exact one rounded toward zero
+#   dropped     the result is the larger operand, the smaller one was
+#               shifted out without a borrow (no guard or sticky bits)
+#   zero        an input is zero and the result is wrong, binary16_div
+#               has no zero handling
+#   other       anything else, binned by its ULP error from toward zero
+#
+# +0 and -0 count as equal, the units don't keep the sign of zeros. The
+# testbenches show that the RTL matches the model, the sweep what the
+# model does for every input.
+
+MAX_HALF = 65504.0
+MIN_NORMAL = 2.0**-14
+CLASSES = ("special", "subnormal", "overflow", "underflow", "exact", "truncated", "dropped", "zero", "other")
+HISTOGRAM_BINS = 17 # ULP errors binned by bit length, 0, 1, 2-3, 4-7, ...
+EXAMPLES = 8 # kept per class
+
+
+@dataclass(frozen=True)
+class Unit:
+    """An arithmetic unit in hdl/, its model and its timing."""
+    module: str
+    model: Callable # binary16.py function of the input bit patterns
+    exact: Callable # the same operation on float64, exact or correctly rounded
+    inputs: Tuple[str, ...] # input ports, in the order model takes them
+    latency: int
+    interval: int = 1 # clocks between inputs
+    drops: bool = False # an adder, results can be the "dropped" class
+
+
+# float64 holds every sum and product of two binary16 values exactly, and
+# rounds quotients and square roots far enough from a binary16 boundary
+# that rounding them again to binary16 is still correct
+UNITS = {
+    "add": Unit("binary16_adder", binary16.add, np.add, ("a", "b"), binary16.ADDER_LATENCY, drops=True),
+    "mul": Unit("binary16_multi", binary16.mul, np.multiply, ("a", "b"), binary16.MULTI_LATENCY),
+    "div": Unit("binary16_div", binary16.div, np.divide, ("a", "b"), binary16.DIV_LATENCY, binary16.DIV_INTERVAL),
+    "div_pipelined": Unit("binary16_div_pipelined", binary16.div_pipelined, np.divide, ("a", "b"),
+                          binary16.DIV_PIPELINED_LATENCY),
+    "sqrt": Unit("binary16_sqrt", binary16.sqrt, np.sqrt, ("n",), binary16.SQRT_LATENCY),
+}
+
+
+def as_half(bits):
+    return np.asarray(bits, dtype=np.uint16).view(np.float16)
+
+
+def toward_zero(exact):
+    """exact (float64) rounded to binary16 toward zero, as bit patterns."""
+    nearest = exact.astype(np.float16)
+    away = np.abs(nearest.astype(np.float64)) > np.abs(exact)
+    nearest[away] = np.nextafter(nearest[away], np.float16(0))
+    return nearest.view(np.uint16)
+
+
+def same(x, y):
+    """Equal bit patterns, +0 and -0 equal."""
+    return (x == y) | (((x | y) & 0x7FFF) == 0)
+
+
+def exact_result(unit, inputs):
+    """The exact (float64) result of unit for the input bit patterns."""
+    with np.errstate(all='ignore'):
+        return unit.exact(*(as_half(x).astype(np.float64) for x in inputs))
+
+
+def classify(unit, inputs, result, exact):
+    """Class index (into CLASSES) of every result, and its ULP error from the toward zero result."""
+    inputs = [np.asarray(x).astype(np.int32) for x in inputs]
+    result = np.asarray(result).astype(np.int32)
+    exponents = [(x >> 10) & 0x1F for x in inputs]
+    fracs = [x & 0x3FF for x in inputs]
+    special = np.any([e == 31 for e in exponents], axis=0) | np.isnan(exact)
+    subnormal = np.any([(e == 0) & (f != 0) for e, f in zip(exponents, fracs)], axis=0)
+    with np.errstate(all='ignore'):
+        nearest = exact.astype(np.float16).view(np.uint16).astype(np.int32)
+        truncated = toward_zero(exact).astype(np.int32)
+    magnitude = np.abs(exact)
+
+    masks = [
+        ("special", special),
+        ("subnormal", subnormal),
+        ("overflow", magnitude > MAX_HALF),
+        ("underflow", (magnitude > 0) & (magnitude < MIN_NORMAL)),
+        ("exact", same(result, nearest)),
+        ("truncated", same(result, truncated)),
+    ]
+    if unit.drops:
+        a, b = inputs
+        larger = np.where((a & 0x7FFF) >= (b & 0x7FFF), a, b)
+        masks.append(("dropped", result == larger))
+    masks.append(("zero", np.any([(x & 0x7FFF) == 0 for x in inputs], axis=0)))
+
+    classes = np.full(result.shape, CLASSES.index("other"), dtype=np.int8)
+    for name, mask in reversed(masks):
+        classes[mask] = CLASSES.index(name)
+    return classes, ulp_distance(result.astype(np.uint16), truncated.astype(np.uint16))
+
+
+def operands(unit, lo, hi):
+    """Every input of unit with a first operand in [lo, hi)."""
+    a = np.arange(lo, hi, dtype=np.uint16)
+    if len(unit.inputs) == 1:
+        return [a]
+    b = np.arange(1 << 16, dtype=np.uint16)
+    return [np.repeat(a, len(b)), np.tile(b, len(a))]
+
+
+def sweep_chunk(args):
+    """Sweeps a in [lo, hi) against every b, returns the per class counts, examples and worst errors."""
+    op, lo, hi = args
+    unit = UNITS[op]
+    counts = np.zeros(len(CLASSES), dtype=np.int64)
+    examples = {name: [] for name in CLASSES}
+    histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    worst = {"ulp": 0, "inputs": None}
+    for start in range(lo, hi, 32):
+        inputs = operands(unit, start, min(start + 32, hi))
+        result = unit.model(*inputs)
+        classes, ulps = classify(unit, inputs, result, exact_result(unit, inputs))
+        counts += np.bincount(classes, minlength=len(CLASSES))
+        for k, name in enumerate(CLASSES):
+            room = EXAMPLES - len(examples[name])
+            if room > 0 and name not in ("exact", "truncated", "dropped"):
+                for m in np.flatnonzero(classes == k)[:room]:
+                    examples[name].append([int(x[m]) for x in inputs] + [int(result[m])])
+        other = np.flatnonzero(classes == CLASSES.index("other"))
+        if len(other):
+            bins = np.ceil(np.log2(ulps[other] + 1.0)).astype(np.intp)
+            histogram += np.bincount(np.minimum(bins, HISTOGRAM_BINS - 1), minlength=HISTOGRAM_BINS)
+            m = other[np.argmax(ulps[other])]
+            if ulps[m] > worst["ulp"]:
+                worst = {"ulp": int(ulps[m]), "inputs": [int(x[m]) for x in inputs]}
+    return counts, examples, histogram, worst
+
+
+def sweep(op="add", workers=None, a_range=(0, 1 << 16), chunk=256, log=None):
+    """
+    Runs op over a_range x every b on workers processes. Returns a summary
+    dict: per class counts and examples (input and result bit patterns),
+    the ULP errors of the "other" class (a histogram by bit length and the
+    worst one), the input count and the run time.
+    """
+    start = time.perf_counter()
+    lo, hi = a_range
+    chunks = [(op, c, min(c + chunk, hi)) for c in range(lo, hi, chunk)]
+    counts = np.zeros(len(CLASSES), dtype=np.int64)
+    examples = {name: [] for name in CLASSES}
+    histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    worst = {"ulp": 0, "inputs": None}
+    with Pool(workers or os.cpu_count()) as pool:
+        for done, (c, e, hist, w) in enumerate(pool.imap_unordered(sweep_chunk, chunks), 1):
+            counts += c
+            histogram += hist
+            for name in CLASSES:
+                examples[name] = (examples[name] + e[name])[:EXAMPLES]
+            if w["ulp"] > worst["ulp"]:
+                worst = w
+            if log is not None:
+                log(f"{done}/{len(chunks)} chunks")
+    return {
+        "op": op,
+        "inputs": int(counts.sum()),
+        "counts": {name: int(n) for name, n in zip(CLASSES, counts)},
+        "examples": {name: e for name, e in examples.items() if e},
+        "other_ulp_histogram": [int(n) for n in histogram],
+        "worst_other": worst,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exhaustively sweep a binary16 model against exact arithmetic.")
+    parser.add_argument("op", nargs="?", default="add", choices=sorted(UNITS))
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--a-range", type=lambda s: tuple(int(x, 0) for x in s.split(":")), default=(0, 1 << 16),
+                        help="lo:hi patterns of the first operand, all by default")
+    parser.add_argument("--out", help="write the summary JSON here")
+    args = parser.parse_args()
+
+    summary = sweep(args.op, args.workers, args.a_range, log=lambda m: print(m, file=sys.stderr))
+    text = json.dumps(summary, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
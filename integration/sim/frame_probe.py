@@ -0,0 +1,167 @@
+import json
+import os
+from dataclasses import dataclass, asdict, field
+import numpy as np
+import cocotb
+from cocotb.triggers import RisingEdge, ReadOnly
+from cocotb.utils import get_sim_time as gst
+import sph_perf
+
+
+# Frame timing of simulator.sv from a cocotb run. A FrameProbe samples the
+# handshakes of the frame at every rising edge of clk_in and timestamps
+# their rising edges with gst(), then report() cuts the last frame into
+# its phases:
+#
+#   density   new_frame to is_density_task falling (the scheduler's first
+#             FORCES cycle after it)
+#   force     to scheduler_done, the last force sum is in
+#   update    to update_finished & scheduler_done, particle_updater done
+#             with the last particle
+#   readout   to frame_complete, update_buffer swapped into the particle RAM
+#
+# For the density and force phases it counts the tasks issued (valid_task)
+# and results out of compute (its data_valid_out, receiver_valid), the
+# tasks in flight every cycle (occupancy), the cycles no task was issued
+# (bubbles), those the compute pipeline was empty too (idle), and the
+# cycles from each particle's last result to done_accumulating (the
+# accumulator drain the scheduler waits for in PART_DONE).
+#
+# Every report is logged against the sph_perf prediction, and with
+# FRAME_REPORT set appended to that file as a line of JSON, which
+# sph_perf.calibrate takes as measurements.
+
+# report name -> simulator.sv signal
+SIGNALS = {
+    "new_frame": "new_frame",
+    "frame_complete": "frame_complete",
+    "valid_task": "valid_task",
+    "data_valid_out": "receiver_valid",
+    "done_accumulating": "done_accumulating",
+    "update_finished": "update_finished",
+    "is_density_task": "is_density_task",
+    "scheduler_done": "scheduler_done",
+}
+PHASES = ("density", "force", "update", "readout")
+
+
+@dataclass
+class FrameReport:
+    particles: int
+    dims: int
+    frame_cycles: int
+    frame_ns: float
+    phases: dict # phase -> {cycles, and for density and force the pipeline counts}
+    edges: dict = field(default_factory=dict) # signal -> gst() ns of its rising edges in the frame
+    predicted: dict = field(default_factory=dict) # phase -> sph_perf cycles
+    lanes: int = 1 # COMPUTE_LANES of the simulator
+
+    def log(self, log):
+        log.info(f"frame of {self.particles} particles on {self.lanes} lane(s): {self.frame_cycles} clocks ({self.frame_ns / 1e3:.1f} us, "
+                 f"{1e9 / self.frame_ns:.0f} FPS), predicted {self.predicted.get('total', 0):.0f}")
+        for name in PHASES:
+            phase = self.phases[name]
+            line = f"  {name}: {phase['cycles']} clocks (predicted {self.predicted.get(name, 0):.0f})"
+            if "tasks" in phase:
+                line += (f", {phase['tasks']} tasks, occupancy {phase['occupancy']:.2f}, "
+                         f"{phase['bubbles']} bubbles, {phase['idle']} idle, "
+                         f"accumulator drain {phase['drain_mean']:.1f} (max {phase['drain_max']})")
+            log.info(line)
+
+    def save(self, path):
+        with open(path, "a") as f:
+            f.write(json.dumps(asdict(self)) + "\n")
+
+
+class FrameProbe:
+    """Samples SIGNALS of a simulator dut every clock from start() on."""
+
+    def __init__(self, dut, signals=SIGNALS):
+        self.dut = dut
+        self.names = list(signals)
+        self.handles = [getattr(dut, signal) for signal in signals.values()]
+        self.samples = []
+        self.times = []
+        self.task = None
+
+    def start(self):
+        self.task = cocotb.start_soon(self.run())
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.kill()
+            self.task = None
+
+    async def run(self):
+        while True:
+            await RisingEdge(self.dut.clk_in)
+            await ReadOnly()
+            self.samples.append(tuple(int(h.value) for h in self.handles))
+            self.times.append(gst(units="ns"))
+
+    def report(self, particles, dims=2, params=sph_perf.DEFAULT_PARAMS):
+        """The FrameReport of the last complete frame (new_frame to frame_complete) sampled, params.lanes the simulator's."""
+        values = np.array(self.samples, dtype=np.int64).reshape(-1, len(self.names))
+        times = np.array(self.times)
+        sig = {name: values[:, k] for k, name in enumerate(self.names)}
+        rises = {name: np.flatnonzero(np.diff(v, prepend=0) == 1) for name, v in sig.items()}
+        falls = {name: np.flatnonzero(np.diff(v, prepend=0) == -1) for name, v in sig.items()}
+
+        def after(cycles, start, what):
+            later = cycles[cycles > start]
+            assert len(later), f"no {what} after clock {start} of the probe, the frame didn't finish"
+            return int(later[0])
+
+        starts = np.flatnonzero(sig["new_frame"])
+        assert len(starts), "no new_frame sampled"
+        ends = rises["frame_complete"]
+        complete = [s for s in starts if np.any(ends > s)]
+        assert complete, "no frame_complete after new_frame"
+        start = int(complete[-1])
+        force = after(falls["is_density_task"], start, "is_density_task falling")
+        update = after(np.flatnonzero(sig["scheduler_done"]), force, "scheduler_done")
+        readout = after(np.flatnonzero(sig["scheduler_done"] & sig["update_finished"]), update - 1, "update_finished")
+        end = after(ends, readout, "frame_complete")
+        bounds = dict(zip(PHASES, zip((start, force, update, readout), (force, update, readout, end))))
+
+        # tasks in compute after every clock
+        in_flight = np.cumsum(sig["valid_task"]) - np.cumsum(sig["data_valid_out"])
+        phases = {}
+        for name, (lo, hi) in bounds.items():
+            phase = {"cycles": hi - lo}
+            if name in ("density", "force"):
+                valid, out = sig["valid_task"][lo:hi], sig["data_valid_out"][lo:hi]
+                occupancy = in_flight[lo:hi]
+                outputs = np.flatnonzero(out) + lo
+                drains = [d - outputs[outputs < d][-1] for d in rises["done_accumulating"]
+                          if lo <= d < hi and np.any(outputs < d)]
+                phase.update(
+                    tasks=int(valid.sum()),
+                    results=int(out.sum()),
+                    occupancy=float(occupancy.mean()) if hi > lo else 0.0,
+                    occupancy_max=int(occupancy.max()) if hi > lo else 0,
+                    bubbles=int(np.count_nonzero(valid == 0)),
+                    idle=int(np.count_nonzero((valid == 0) & (occupancy == 0))),
+                    drain_mean=float(np.mean(drains)) if drains else 0.0,
+                    drain_max=int(np.max(drains)) if drains else 0)
+            phases[name] = phase
+
+        predicted = sph_perf.phase_cycles(particles, dims, params)
+        return FrameReport(
+            particles=particles,
+            dims=dims,
+            frame_cycles=end - start,
+            frame_ns=float(times[end] - times[start]),
+            phases=phases,
+            edges={name: [float(t) for t in times[r[(r >= start) & (r <= end)]]]
+                   for name, r in rises.items()},
+            predicted={name: float(c) for name, c in predicted.items()},
+            lanes=int(params.lanes))
+
+
+def record(dut, report):
+    """Logs report and appends it to FRAME_REPORT if that is set."""
+    report.log(dut._log)
+    if os.getenv("FRAME_REPORT"):
+        report.save(os.environ["FRAME_REPORT"])
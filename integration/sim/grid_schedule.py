@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Tuple
+import numpy as np
+import mem_image
+from neighbor_search import CellList
+from sph_binary16 import CANDIDATE_MARGIN
+
+
+# Host side and reference of scheduler.sv's grid mode (GRID = 1). The
+# particles are binned into cells of CANDIDATE_MARGIN * h and sorted by
+# cell, so every cell is a range of particle addresses, and the scheduler
+# pairs each particle only with the ranges of the 3^DIMS cells around its
+# own instead of all N:
+#
+#   particle.mem        the particles, cell sorted
+#   cells.mem           {start, end} addresses of every cell, 16 bits each
+#   particle_cells.mem  the cell of every address
+#
+# The grid has one empty cell of padding on every side, so stencil offsets
+# never leave it. The tables only hold while the particles stay in their
+# cells, the margin lets them drift by (CANDIDATE_MARGIN - 1) / 2 h first;
+# the host re-bins with layout() and reloads.
+#
+# task_stream() gives the (phase, i, j) of every task the scheduler issues
+# in issue order, for checking it in cocotb.
+
+CELLS_FILE = "cells.mem"
+PARTICLE_CELLS_FILE = "particle_cells.mem"
+PARTICLE_FILE = "particle.mem"
+MAX_PARTICLES = 128 # particle BRAMs of simulator.sv
+MAX_CELLS = 1 << 16 # 16 bit cell ids
+PHASES = ("density", "force")
+
+
+@dataclass(frozen=True)
+class GridLayout:
+    order: np.ndarray # address -> index of the particle in the unsorted input
+    cell_size: float
+    shape: Tuple[int, ...]
+    particle_cells: np.ndarray # address -> cell
+    cell_bounds: np.ndarray # (cells, 2) [start, end) addresses
+    stencil: np.ndarray # cell offsets in the scheduler's order
+
+    @property
+    def parameters(self):
+        """scheduler.sv (and simulator.sv) parameters of the layout."""
+        return {
+            "GRID": 1,
+            "GRID_CELLS": len(self.cell_bounds),
+            "GRID_ROW": self.shape[-1],
+            "GRID_PLANE": int(np.prod(self.shape[-2:])) if len(self.shape) > 2 else 1,
+        }
+
+    def write_tables(self, directory):
+        directory = Path(directory)
+        mem_image.write(directory / CELLS_FILE, self.cell_bounds.astype(np.uint16))
+        mem_image.write(directory / PARTICLE_CELLS_FILE, self.particle_cells.astype(np.uint16)[:, None])
+
+    def write(self, directory, positions, velocities):
+        """Writes the cell sorted particle.mem and both tables to directory."""
+        mem_image.write_particles(Path(directory) / PARTICLE_FILE,
+                                  np.asarray(positions)[self.order], np.asarray(velocities)[self.order])
+        self.write_tables(directory)
+
+
+def layout(positions, h, margin=CANDIDATE_MARGIN):
+    """The GridLayout of (N, DIMS) positions for smoothing radius h."""
+    positions = np.asarray(positions, dtype='float64')
+    if len(positions) > MAX_PARTICLES:
+        raise ValueError(f"{len(positions)} particles, the particle memory holds {MAX_PARTICLES}")
+    cells = CellList(h * margin, padding=1)
+    cells.build(positions)
+    order = cells.order.copy()
+    # binned again in address order, the same grid with order the identity
+    cells.build(positions[order])
+    if cells.cell_end.size > MAX_CELLS:
+        raise ValueError(f"{cells.cell_end.size} cells, cell ids are 16 bits")
+    return GridLayout(
+        order=order,
+        cell_size=cells.cell_size,
+        shape=tuple(int(s) for s in cells.shape),
+        particle_cells=cells.cell_ids.copy(),
+        cell_bounds=np.stack([cells.cell_start, cells.cell_end], axis=1),
+        stencil=cells.stencil.copy())
+
+
+def pairs(grid):
+    """(i, j) addresses of the tasks of one phase, in issue order: the stencil cells of i in order, each in address order."""
+    neighbor_cells = grid.particle_cells[:, None] + grid.stencil[None, :]
+    starts, ends = grid.cell_bounds[neighbor_cells, 0], grid.cell_bounds[neighbor_cells, 1]
+    counts = (ends - starts).ravel()
+    first = np.cumsum(counts) - counts
+    i = np.repeat(np.arange(len(grid.particle_cells)), (ends - starts).sum(axis=1))
+    j = np.repeat(starts.ravel() - first, counts) + np.arange(counts.sum())
+    return i, j
+
+
+def task_stream(grid):
+    """(phase, i, j) of every task of a frame in issue order, phase indexing PHASES."""
+    i, j = pairs(grid)
+    phase = np.repeat(np.arange(len(PHASES)), len(i))
+    return phase, np.tile(i, len(PHASES)), np.tile(j, len(PHASES))
+
+
+def all_pairs_stream(n):
+    """The same for the all pairs scheduler (GRID = 0)."""
+    i, j = np.divmod(np.arange(n * n), n)
+    return np.repeat(np.arange(len(PHASES)), n * n), np.tile(i, len(PHASES)), np.tile(j, len(PHASES))
@@ -0,0 +1,192 @@
+import sys
+from pathlib import Path
+import numpy as np
+from binary16_codec import encode, decode
+
+
+# $readmemh images of particle memory (particle.mem, RTL dumps). An image is
+# handled as an (N, k) uint16 array, one row per line and k binary16 fields
+# per row, most significant first, so {x, y, v_x, v_y} words are (N, 4).
+# Images are written and parsed as whole byte arrays, never line by line.
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# ASCII byte -> hex digit value, -1 for anything else
+HEX_VALUES = np.full(256, -1, dtype=np.int16)
+for digit, char in enumerate(b"0123456789abcdef"):
+    HEX_VALUES[char] = digit
+    HEX_VALUES[ord(chr(char).upper())] = digit
+
+NEWLINE = ord("\n")
+
+
+def field_names(k):
+    """Names of the fields of a particle word with k fields, positions then velocities."""
+    if k % 2 or k > 6:
+        return [f"field_{f}" for f in range(k)]
+    axes = "xyz"[:k // 2]
+    return list(axes) + [f"v_{a}" for a in axes]
+
+
+def format_fields(fields):
+    """(N, k) uint16 fields to the bytes of an image, one 4k digit hex line per row."""
+    fields = np.atleast_2d(np.asarray(fields, dtype=np.uint16))
+    N, k = fields.shape
+    nibbles = (fields[..., None] >> np.array([12, 8, 4, 0], dtype=np.uint16)) & 0xF
+    lines = np.empty((N, 4 * k + 1), dtype=np.uint8)
+    lines[:, :-1] = HEX_DIGITS[nibbles.reshape(N, 4 * k)]
+    lines[:, -1] = NEWLINE
+    return lines.tobytes()
+
+
+def write(path, fields):
+    """Writes (N, k) uint16 fields as a $readmemh image, creating parent directories."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(format_fields(fields))
+
+
+def write_particles(path, positions, velocities):
+    """Writes (N, DIMS) float positions and velocities as {position, velocity} words."""
+    write(path, encode(np.hstack([np.asarray(positions), np.asarray(velocities)])))
+
+
+def fixed_width(data):
+    """(N, line length) view of an image whose lines all have the same length, else None."""
+    if len(data) == 0 or data[-1] != NEWLINE:
+        return None
+    stride = int(np.argmax(data == NEWLINE)) + 1
+    if stride < 5 or len(data) % stride or not np.all(data[stride - 1::stride] == NEWLINE):
+        return None
+    return data.reshape(-1, stride)
+
+
+def decode_lines(lines):
+    """(N, 4k + 1) image bytes, or (N, 4k + 2) with \\r\\n endings, to (N, k) fields. None if not plain hex."""
+    digits = lines[:, :-1]
+    if digits.shape[1] % 4 and digits.shape[1] > 0 and np.all(digits[:, -1] == ord("\r")):
+        digits = digits[:, :-1]
+    if digits.shape[1] % 4:
+        return None
+    values = HEX_VALUES[digits]
+    if np.any(values < 0):
+        return None
+    nibbles = values.astype(np.uint16).reshape(len(lines), -1, 4)
+    return (nibbles[..., 0] << 12) | (nibbles[..., 1] << 8) | (nibbles[..., 2] << 4) | nibbles[..., 3]
+
+
+def parse(text, k=None):
+    """
+    Any $readmemh image (comments, @address directives, several words per
+    line) to (N, k) fields. k is taken from the first word if not given;
+    addresses never written are 0.
+    """
+    if isinstance(text, (bytes, bytearray)):
+        text = text.decode()
+    words, address = {}, 0
+    for line in text.splitlines():
+        for token in line.split("//")[0].split():
+            if token.startswith("@"):
+                address = int(token[1:], 16)
+                continue
+            token = token.replace("_", "")
+            if k is None:
+                k = -(-len(token) // 4)
+            words[address] = int(token, 16)
+            address += 1
+    k = k or 1
+    fields = np.zeros((max(words, default=-1) + 1, k), dtype=np.uint16)
+    for address, word in words.items():
+        fields[address] = [(word >> (16 * (k - 1 - f))) & 0xFFFF for f in range(k)]
+    return fields
+
+
+def read(path):
+    """Parses a $readmemh image to (N, k) uint16 fields."""
+    data = np.fromfile(path, dtype=np.uint8)
+    lines = fixed_width(data)
+    fields = decode_lines(lines) if lines is not None else None
+    return fields if fields is not None else parse(data.tobytes())
+
+
+def read_particles(path, dims=2):
+    """(N, DIMS) float positions and velocities from a particle image."""
+    values = decode(read(path))
+    return values[:, :dims], values[:, dims:]
+
+
+class MemImage:
+    """
+    A large image memory-mapped instead of read. Rows are decoded on
+    indexing, so only the slices looked at are ever parsed. Only fixed
+    width images (what write() produces, and $writememh dumps) are supported.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lines = fixed_width(np.memmap(self.path, dtype=np.uint8, mode="r"))
+        if self.lines is None:
+            raise ValueError(f"{self.path} isn't a fixed width image, use read() instead")
+        self.fields = len(self[:1][0]) if len(self.lines) else 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, index):
+        lines = self.lines[index]
+        fields = decode_lines(np.atleast_2d(np.asarray(lines)))
+        if fields is None:
+            raise ValueError(f"{self.path} has non hex lines, use read() instead")
+        return fields[0] if lines.ndim == 1 else fields
+
+    def chunks(self, rows=1 << 20):
+        """(start, fields) for consecutive blocks of at most rows rows."""
+        for start in range(0, len(self), rows):
+            yield start, self[start:start + rows]
+
+
+def ulp_distance(a, b):
+    """Number of binary16 values between two bit patterns (0 for +0 vs -0)."""
+    def ordered(bits):
+        bits = np.asarray(bits, dtype=np.int32)
+        return np.where(bits & 0x8000, -(bits & 0x7FFF), bits)
+    return np.abs(ordered(a) - ordered(b))
+
+
+def diff(golden, actual, names=None):
+    """
+    Per field ULP error statistics between two images, given as paths or
+    (N, k) fields. Returns {field name: {mismatches, max_ulp, mean_ulp,
+    worst_row}}, plus "rows" and "rows_mismatched".
+    """
+    golden = read(golden) if isinstance(golden, (str, Path)) else np.atleast_2d(golden)
+    actual = read(actual) if isinstance(actual, (str, Path)) else np.atleast_2d(actual)
+    if golden.shape != actual.shape:
+        raise ValueError(f"images differ in shape: {golden.shape} vs {actual.shape}")
+    names = names or field_names(golden.shape[1])
+    ulps = ulp_distance(golden, actual)
+
+    stats = {"rows": len(golden), "rows_mismatched": int(np.count_nonzero(np.any(ulps, axis=1)))}
+    for f, name in enumerate(names):
+        column = ulps[:, f]
+        stats[name] = {
+            "mismatches": int(np.count_nonzero(column)),
+            "max_ulp": int(column.max()) if len(column) else 0,
+            "mean_ulp": float(column.mean()) if len(column) else 0.0,
+            "worst_row": int(column.argmax()) if len(column) else -1,
+        }
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python mem_image.py <golden.mem> <actual.mem>")
+        sys.exit(1)
+
+    stats = diff(sys.argv[1], sys.argv[2])
+    print(f"{stats['rows_mismatched']}/{stats['rows']} rows differ")
+    for name, field in stats.items():
+        if isinstance(field, dict):
+            print(f"{name:>4}: {field['mismatches']} mismatches, max {field['max_ulp']} ulp "
+                  f"(row {field['worst_row']}), mean {field['mean_ulp']:.3f} ulp")
+    sys.exit(1 if stats["rows_mismatched"] else 0)
@@ -0,0 +1,153 @@
+from itertools import product
+import numpy as np
+
+
+class CellList:
+    """
+    Spatial hash of particles into square (cubic) cells of width cell_size.
+
+    Particles are counting-sorted by flat cell id, so the members of a cell
+    are the contiguous slice order[cell_start[c]:cell_end[c]]. Neighbor
+    candidates of a particle are the 3^DIMS cells around its own cell, handed
+    out as arrays of (start, end) ranges into order.
+
+    update() maintains the list across frames: only particles whose cell
+    changed are moved, and it falls back to a full build() when more than
+    rebuild_fraction of them did or one left the grid.
+    """
+
+    def __init__(self, cell_size, rebuild_fraction=0.1, padding=2):
+        self.cell_size = cell_size
+        self.rebuild_fraction = rebuild_fraction
+        # empty cells kept around the occupied ones, so particles can drift
+        # a little before the grid has to grow (at least 1, for the stencil)
+        self.padding = padding
+        self.built_cell_size = None
+        # particles that changed cell in the last update(), and whether it rebuilt
+        self.migrations = 0
+        self.rebuilt = False
+        self.dims = 0
+        self.order = np.zeros(0, dtype=np.intp)
+        self.cell_ids = np.zeros(0, dtype=np.intp)
+        self.cell_start = np.zeros(0, dtype=np.intp)
+        self.cell_end = np.zeros(0, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.order)
+
+    def cell_coords(self, positions):
+        return np.floor(np.asarray(positions) / self.cell_size).astype(np.int64)
+
+    def build(self, positions):
+        positions = np.asarray(positions, dtype='float64')
+        N, self.dims = positions.shape
+        cells = self.cell_coords(positions)
+        self.built_cell_size = self.cell_size
+        self.migrations, self.rebuilt = N, True
+
+        # padding on every side keeps the whole stencil of an occupied cell
+        # inside the grid, so stencil offsets never wrap
+        if N > 0:
+            self.origin = cells.min(axis=0) - self.padding
+            self.shape = tuple(cells.max(axis=0) - self.origin + self.padding + 1)
+        else:
+            self.origin = np.zeros(self.dims, dtype=np.int64)
+            self.shape = (1,) * self.dims
+        self.strides = np.array([int(np.prod(self.shape[d + 1:])) for d in range(self.dims)], dtype=np.int64)
+        self.stencil = np.array([np.dot(offset, self.strides) for offset in product((-1, 0, 1), repeat=self.dims)], dtype=np.intp)
+
+        self.cell_ids = ((cells - self.origin) @ self.strides).astype(np.intp)
+        self.sort()
+
+    def sort(self):
+        """Counting sort of the particles by cell_ids."""
+        counts = np.bincount(self.cell_ids, minlength=int(np.prod(self.shape)))
+        self.cell_end = np.cumsum(counts)
+        self.cell_start = self.cell_end - counts
+        self.order = np.argsort(self.cell_ids, kind='stable')
+
+    def update(self, positions):
+        """Re-buckets particles that moved to another cell since the last build() or update()."""
+        positions = np.asarray(positions, dtype='float64')
+        if (self.built_cell_size != self.cell_size or positions.shape != (len(self.order), self.dims)
+                or len(self.order) == 0):
+            self.build(positions)
+            return
+        cells = self.cell_coords(positions) - self.origin
+        # a particle in the outermost cells would have part of its stencil outside the grid
+        if np.any(cells < 1) or np.any(cells > np.array(self.shape) - 2):
+            self.build(positions)
+            return
+
+        cell_ids = (cells @ self.strides).astype(np.intp)
+        moved = np.flatnonzero(cell_ids != self.cell_ids)
+        if len(moved) > self.rebuild_fraction * len(cell_ids):
+            migrations = len(moved)
+            self.build(positions)
+            self.migrations = migrations
+            return
+        self.migrations, self.rebuilt = len(moved), False
+        if len(moved) == 0:
+            return
+
+        counts = self.cell_end - self.cell_start
+        np.subtract.at(counts, self.cell_ids[moved], 1)
+        np.add.at(counts, cell_ids[moved], 1)
+        self.cell_ids = cell_ids
+        self.cell_end = np.cumsum(counts)
+        self.cell_start = self.cell_end - counts
+
+        # merge the movers back into order by (cell, index), exactly the
+        # order the stable sort of a full build() gives
+        N = len(cell_ids)
+        stayed = self.order[np.isin(self.order, moved, assume_unique=True, invert=True)]
+        moved = moved[np.argsort(cell_ids[moved], kind='stable')]
+        stayed_keys = cell_ids[stayed].astype(np.int64) * N + stayed
+        moved_keys = cell_ids[moved].astype(np.int64) * N + moved
+        self.order = np.insert(stayed, np.searchsorted(stayed_keys, moved_keys), moved)
+
+    def candidate_ranges(self, indices=None):
+        """(start, end) into order for every stencil cell of each particle, shape (len(indices), 3^DIMS)."""
+        cells = self.cell_ids if indices is None else self.cell_ids[indices]
+        neighbor_cells = cells[:, None] + self.stencil[None, :]
+        return self.cell_start[neighbor_cells], self.cell_end[neighbor_cells]
+
+    def neighbors(self, i):
+        """Indices of every particle in the cells around particle i (i included)."""
+        starts, ends = self.candidate_ranges(np.array([i]))
+        return np.concatenate([self.order[s:e] for s, e in zip(starts[0], ends[0])])
+
+    def candidate_counts(self, indices=None):
+        starts, ends = self.candidate_ranges(indices)
+        return (ends - starts).sum(axis=1)
+
+    def pairs(self, indices=None):
+        """
+        Every candidate pair (i, j) with j in the stencil of i, as two flat
+        arrays. i == j is included. indices restricts the i side.
+        """
+        if indices is None:
+            indices = np.arange(len(self.order))
+        indices = np.asarray(indices, dtype=np.intp)
+        starts, ends = self.candidate_ranges(indices)
+        counts = (ends - starts).ravel()
+        total = counts.sum()
+        first = np.cumsum(counts) - counts
+        i = np.repeat(indices, (ends - starts).sum(axis=1))
+        j = self.order[np.repeat(starts.ravel() - first, counts) + np.arange(total)]
+        return i, j
+
+    def blocks(self, max_pairs, indices=None):
+        """
+        Splits the particles (or just indices), in cell order, into groups of
+        at most ~max_pairs candidate pairs.
+        """
+        if indices is None:
+            indices = self.order
+        else:
+            indices = np.asarray(indices, dtype=np.intp)
+            indices = indices[np.argsort(self.cell_ids[indices], kind='stable')]
+        counts = self.candidate_counts(indices)
+        group = np.cumsum(counts) // max(max_pairs, 1)
+        splits = np.flatnonzero(np.diff(group)) + 1
+        return np.split(indices, splits)
@@ -0,0 +1,194 @@
+import json
+import os
+from collections import deque
+from dataclasses import dataclass, asdict
+import numpy as np
+import cocotb
+from cocotb.triggers import RisingEdge, FallingEdge, ReadOnly
+
+
+# Streaming testbench pieces for the units of hdl/, which all share one
+# handshake: the inputs are captured with data_valid_in at a rising edge,
+# and results come out in input order while data_valid_out is high.
+#
+# A Driver offers one transaction per clock, holding back while the DUT
+# isn't ready, a Monitor coroutine records every valid output, and a
+# Scoreboard pairs outputs with inputs in order and measures the latency
+# of each. stream() runs all three until every result is out and returns a
+# StreamReport with the results, latency, initiation interval and
+# throughput. With STREAM_REPORT set, every report is also appended to that
+# file as a line of JSON.
+
+CLOCK_MHZ = 100 # clk_in of the FPGA design
+DRAIN_CLOCKS = 256 # waited for results after the last input when the latency is unknown
+
+
+class EdgeCounter:
+    """Counts rising edges of clk. Read edge after ReadOnly, it is updated by then."""
+
+    def __init__(self, clk):
+        self.clk = clk
+        self.edge = 0
+        self.task = cocotb.start_soon(self.run())
+
+    async def run(self):
+        while True:
+            await RisingEdge(self.clk)
+            self.edge += 1
+
+
+class Driver:
+    """
+    Drives rows of input values (one value per port in inputs, None for an
+    idle clock) and data_valid_in, one row per clock. A row waits while
+    ready(dut) is false and until interval clocks after the row before it
+    was captured. on_capture(edge, index) is called for every captured row.
+    """
+
+    def __init__(self, dut, counter, inputs, valid="data_valid_in", interval=1, ready=None, on_capture=None):
+        self.dut = dut
+        self.counter = counter
+        self.ports = [getattr(dut, port) for port in inputs]
+        self.valid = getattr(dut, valid)
+        self.interval = interval
+        self.ready = ready
+        self.on_capture = on_capture
+        self.captured = 0
+
+    async def send(self, rows):
+        next_capture = 0
+        index = 0
+        rows = list(rows)
+        while index < len(rows):
+            await FallingEdge(self.counter.clk)
+            row = rows[index]
+            offer = (row is not None and self.counter.edge + 1 >= next_capture
+                     and (self.ready is None or self.ready(self.dut)))
+            if offer:
+                for port, value in zip(self.ports, row):
+                    port.value = int(value)
+            self.valid.value = int(offer)
+
+            await RisingEdge(self.counter.clk)
+            await ReadOnly()
+            if offer:
+                next_capture = self.counter.edge + self.interval
+                if self.on_capture is not None:
+                    self.on_capture(self.counter.edge, self.captured)
+                self.captured += 1
+            if offer or row is None:
+                index += 1
+        await FallingEdge(self.counter.clk)
+        self.valid.value = 0
+
+
+class Monitor:
+    """Records (edge, values) of outputs at every rising edge with valid high, calls on_output(edge, values)."""
+
+    def __init__(self, dut, counter, outputs=("result",), valid="data_valid_out", on_output=None):
+        self.counter = counter
+        self.outputs = [getattr(dut, port) for port in outputs]
+        self.valid = getattr(dut, valid)
+        self.on_output = on_output
+        self.observed = []
+        self.task = cocotb.start_soon(self.run())
+
+    async def run(self):
+        while True:
+            await RisingEdge(self.counter.clk)
+            await ReadOnly()
+            if self.valid.value == 1:
+                values = tuple(int(port.value) for port in self.outputs)
+                self.observed.append((self.counter.edge, values))
+                if self.on_output is not None:
+                    self.on_output(self.counter.edge, values)
+
+
+class Scoreboard:
+    """Pairs outputs with captured inputs in order, asserting a fixed latency if one is given."""
+
+    def __init__(self, latency=None):
+        self.latency = latency
+        self.in_flight = deque() # (edge, index)
+        self.captures = []
+        self.outputs = []
+        self.results = {}
+
+    def captured(self, edge, index):
+        self.in_flight.append((edge, index))
+        self.captures.append(edge)
+
+    def received(self, edge, values):
+        assert self.in_flight, f"output at clock {edge} with no input in flight"
+        captured, index = self.in_flight.popleft()
+        if self.latency is not None:
+            assert edge - captured == self.latency, \
+                f"input {index} came out after {edge - captured} clocks, expected {self.latency}"
+        self.outputs.append(edge)
+        self.results[index] = values
+
+    def latencies(self):
+        return np.array(self.outputs) - np.array(self.captures[:len(self.outputs)])
+
+
+@dataclass
+class StreamReport:
+    module: str
+    transactions: int
+    cycles: int # from the first capture to the last result
+    latency_min: int
+    latency_max: int
+    interval: float # mean clocks between captures
+    throughput: float # results per clock
+
+    def log(self, log, clock_mhz=CLOCK_MHZ):
+        log.info(f"{self.module}: {self.transactions} results in {self.cycles} clocks, "
+                 f"latency {self.latency_min}" + (f"-{self.latency_max}" if self.latency_max != self.latency_min else "") +
+                 f", interval {self.interval:.2f}, {self.throughput:.3f} results/clock "
+                 f"({self.throughput * clock_mhz:.1f} M/s at {clock_mhz} MHz)")
+
+    def save(self, path):
+        with open(path, "a") as f:
+            f.write(json.dumps(asdict(self)) + "\n")
+
+
+async def stream(dut, inputs, rows, outputs=("result",), interval=1, ready=None, latency=None, name=None,
+                 valid_in="data_valid_in", valid_out="data_valid_out"):
+    """
+    Streams rows through dut and waits for all of their results. Returns
+    (results, report), results as a (transactions, len(outputs)) int64
+    array in input order. Fails when a result is missing latency (or
+    DRAIN_CLOCKS) clocks after the last input.
+    """
+    counter = EdgeCounter(dut.clk_in)
+    scoreboard = Scoreboard(latency)
+    monitor = Monitor(dut, counter, outputs, valid=valid_out, on_output=scoreboard.received)
+    driver = Driver(dut, counter, inputs, valid=valid_in, interval=interval, ready=ready, on_capture=scoreboard.captured)
+    await driver.send(rows)
+
+    drain = (latency + 2) if latency is not None else DRAIN_CLOCKS
+    for _ in range(drain):
+        if not scoreboard.in_flight:
+            break
+        await RisingEdge(dut.clk_in)
+    await FallingEdge(dut.clk_in)
+    monitor.task.kill()
+    counter.task.kill()
+    assert not scoreboard.in_flight, f"{len(scoreboard.in_flight)} results missing {drain} clocks after the last input"
+
+    count = driver.captured
+    results = np.array([scoreboard.results[i] for i in range(count)], dtype=np.int64).reshape(count, len(outputs))
+    latencies = scoreboard.latencies()
+    cycles = scoreboard.outputs[-1] - scoreboard.captures[0] + 1 if count else 0
+    report = StreamReport(
+        module=name or dut._name,
+        transactions=count,
+        cycles=cycles,
+        latency_min=int(latencies.min()) if count else 0,
+        latency_max=int(latencies.max()) if count else 0,
+        interval=float(np.mean(np.diff(scoreboard.captures))) if count > 1 else float(interval),
+        throughput=count / cycles if cycles else 0.0)
+    report.log(dut._log)
+    if os.getenv("STREAM_REPORT"):
+        report.save(os.environ["STREAM_REPORT"])
+    return results, report
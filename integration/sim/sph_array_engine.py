@@ -0,0 +1,294 @@
+from functools import lru_cache
+from math import pi
+from typing import List, Tuple
+import numpy as np
+import sph_numba
+import sph_binary16
+import sph_integrators
+from binary16_codec import encode, decode
+from neighbor_search import CellList
+from sph_engine import Particle, ParticleView, particle_arrays, gravity_vector, smoothing_kernel, smoothing_kernel_gradient
+
+
+# Structure-of-arrays version of SPH_Engine. Every particle field lives in a
+# contiguous (N, DIMS) float64 array and every phase of update() is computed
+# as whole-array operations over the interacting pairs.
+
+def spiky_kernel(r, h):
+    """Vectorized smoothing_kernel, r can be any array of distances."""
+    volume = pi * (h**4) / 6
+    return np.where(r < h, ((r - h)**2) / volume, 0.0)
+
+def spiky_kernel_gradient(r, h):
+    """Vectorized smoothing_kernel_gradient."""
+    scale = 12 / (pi * h**4)
+    return np.where(r < h, scale * (h - r), 0.0)
+
+# scalar kernels from sph_engine that have a hand written array version
+VECTORIZED_KERNELS = {
+    smoothing_kernel: spiky_kernel,
+    smoothing_kernel_gradient: spiky_kernel_gradient,
+}
+
+@lru_cache(maxsize=None)
+def vectorize_kernel(kernel):
+    """Returns an array-in/array-out version of a scalar kernel(r, h)."""
+    if getattr(kernel, "vectorized", False): # the sph_kernels ones
+        return kernel
+    if kernel in VECTORIZED_KERNELS:
+        return VECTORIZED_KERNELS[kernel]
+    scalar = np.vectorize(kernel, otypes=['float64'])
+    return lambda r, h: scalar(r, h)
+
+def random_dirs(n, dims):
+    """n random unit vectors, same distribution as random_dir()."""
+    v = np.random.uniform(-1, 1, size=(n, dims))
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+class SPH_ArrayEngine:
+    def __init__(self,
+                particles: List[Particle],
+                mass: float,
+                time_step: float,
+                h: float,
+                kernel,
+                kernel_gradient,
+                target_density: float,
+                pressure_coeff: float,
+                gravitational_constant: float,
+                bounds: Tuple[float, float],
+                collision_damping: float,
+                pair_block: int = 1 << 22,
+                backend: str = "auto",
+                precision: str = "float64",
+                integrator: str = "symplectic_euler",
+                adaptive: bool = False):
+
+        self.load_particles(particles)
+
+        # time step and smoothing length
+        self.time_step = time_step
+        self.h = h
+
+        # pressure, and density kernel
+        self.kernel = kernel
+        self.kernel_gradient = kernel_gradient
+
+        # simulation constants
+        self.target_density = target_density
+        self.pressure_coeff = pressure_coeff
+        self.mass = mass
+
+        # gravity force
+        self.gravity_force = gravity_vector(gravitational_constant, len(bounds))
+        self.collision_damping = collision_damping
+
+        # bounds
+        self.bounds = bounds
+
+        # neighbor search, cells of width h
+        self.grid = CellList(h)
+
+        # max number of candidate (i, j) pairs held in memory at once by find_pairs
+        self.pair_block = pair_block
+
+        # "numba" runs the compiled loops of sph_numba, "numpy" the pair arrays,
+        # "auto" picks numba when it is installed
+        if backend not in ("auto", "numba", "numpy"):
+            raise ValueError(f"unknown backend {backend!r}")
+        if backend == "numba" and not sph_numba.AVAILABLE:
+            raise ImportError("backend='numba' needs numba installed")
+        self.backend = backend
+        self._kernel_h = None
+
+        # "binary16" runs every frame through the bit exact model of the
+        # hardware (sph_binary16), "float64" is the reference physics
+        if precision not in ("float64", "binary16"):
+            raise ValueError(f"unknown precision {precision!r}")
+        self.precision = precision
+
+        # time integration (sph_integrators), adaptive splits frames into substeps
+        self.integrator = sph_integrators.check_integrator(integrator)
+        self.adaptive = adaptive
+        self.substeps = 1
+
+    def load_particles(self, particles):
+        """(Re)allocates every per-particle array from a list of Particles (or a ParticleView)."""
+        self.positions, self.velocities = particle_arrays(particles)
+        N = len(self.positions)
+
+        self.predicted_positions = np.zeros_like(self.positions)
+        self.densities = np.zeros(N, dtype='float64')
+        self.pressures = np.zeros(N, dtype='float64')
+        self.pressure_forces = np.zeros_like(self.positions)
+        self.cached_accelerations = None
+
+    @property
+    def particles(self):
+        return self.get_particles()
+
+    @particles.setter
+    def particles(self, particles):
+        self.load_particles(particles)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def predict_positions(self, lookahead=None):
+        lookahead = self.time_step if lookahead is None else lookahead
+        np.multiply(self.velocities, lookahead, out=self.predicted_positions)
+        self.predicted_positions += self.positions
+
+    def build_grid(self):
+        self.grid.cell_size = self.h
+        self.grid.update(self.predicted_positions)
+
+    def find_pairs(self, indices=None):
+        """
+        All pairs (i, j) closer than h in predicted positions, including i == j.
+        Returns (i, j, r, distance) with r = x_j - x_i. Candidates come from the
+        cell list and are filtered in blocks of at most ~pair_block pairs.
+        indices restricts the i side of the pairs.
+        """
+        x = self.predicted_positions
+        pairs_i, pairs_j, pairs_r, pairs_d = [], [], [], []
+        for block in self.grid.blocks(self.pair_block, indices):
+            i, j = self.grid.pairs(block)
+            r = x[j] - x[i]
+            distance = np.sqrt(np.einsum('ij,ij->i', r, r))
+            close = distance < self.h
+            pairs_i.append(i[close])
+            pairs_j.append(j[close])
+            pairs_r.append(r[close])
+            pairs_d.append(distance[close])
+        if not pairs_i:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, np.zeros((0, x.shape[1])), np.zeros(0)
+        return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_r), np.concatenate(pairs_d)
+
+    # The phases below write their results in place, only for the particles
+    # in indices (all of them when None), so the arrays can be shared.
+
+    def calculate_densities(self, pairs, indices=None):
+        i, j, r, distance = pairs
+        indices = slice(None) if indices is None else indices
+        kernel = vectorize_kernel(self.kernel)
+        densities = np.bincount(i, weights=self.mass * kernel(distance, self.h), minlength=len(self))
+        self.densities[indices] = densities[indices]
+        self.pressures[indices] = self.pressure_coeff * (self.densities[indices] - self.target_density)
+
+    def calculate_pressure_forces(self, pairs, indices=None):
+        i, j, r, distance = pairs
+        indices = slice(None) if indices is None else indices
+        # don't compute the force of a particle on itself
+        others = i != j
+        i, j, r, distance = i[others], j[others], r[others], distance[others]
+
+        dir = np.empty_like(r)
+        apart = distance > 0
+        dir[apart] = r[apart] / distance[apart, None]
+        dir[~apart] = random_dirs(np.count_nonzero(~apart), r.shape[1])
+
+        kernel_gradient = vectorize_kernel(self.kernel_gradient)
+        magnitude = -self.mass * (self.pressures[i] + self.pressures[j]) / (2 * self.densities[j]) * kernel_gradient(distance, self.h)
+        f_p = magnitude[:, None] * dir
+
+        N, DIMS = self.positions.shape
+        for d in range(DIMS):
+            self.pressure_forces[indices, d] = np.bincount(i, weights=f_p[:, d], minlength=N)[indices]
+
+    def update_particles(self, indices=None):
+        indices = slice(None) if indices is None else indices
+        positions, velocities = self.positions[indices], self.velocities[indices]
+
+        accel = (self.pressure_forces[indices] + self.gravity_force) / self.densities[indices, None]
+        velocities += self.time_step * accel
+        next_positions = positions + self.time_step * velocities
+
+        bounds = np.asarray(self.bounds, dtype='float64')
+        colliding = (next_positions < -bounds) | (next_positions > bounds)
+        velocities[colliding] *= -self.collision_damping
+
+        positions += self.time_step * velocities
+
+        # particles which still escaped get clamped and stopped, like SPH_Engine
+        escaped = np.any((positions < -bounds) | (positions > bounds), axis=1)
+        positions[escaped] = np.clip(positions[escaped], 0, bounds)
+        velocities[escaped] = 0
+
+        self.positions[indices] = positions
+        self.velocities[indices] = velocities
+
+    def kernel_constants(self):
+        """Normalization of the spiky kernel and its gradient, only recomputed when h changes."""
+        if self._kernel_h != self.h:
+            self._kernel_h = self.h
+            self._kernel_constants = (6 / (pi * self.h**4), 12 / (pi * self.h**4))
+        return self._kernel_constants
+
+    def compiled(self):
+        """Whether update() can run the compiled loops (only the spiky kernel is compiled in)."""
+        return (self.backend != "numpy" and sph_numba.AVAILABLE
+                and self.kernel is smoothing_kernel and self.kernel_gradient is smoothing_kernel_gradient)
+
+    def compute_forces_compiled(self):
+        kernel_coeff, gradient_coeff = self.kernel_constants()
+        grid = self.grid
+        cells = (self.predicted_positions, grid.order, grid.cell_ids, grid.cell_start, grid.cell_end, grid.stencil, self.h, self.mass)
+        sph_numba.calculate_densities(*cells, kernel_coeff, self.pressure_coeff, self.target_density, self.densities, self.pressures)
+        sph_numba.calculate_pressure_forces(*cells, gradient_coeff, self.densities, self.pressures, self.pressure_forces)
+
+    def integrate_compiled(self):
+        sph_numba.update_particles(self.positions, self.velocities, self.pressure_forces, self.densities, self.gravity_force,
+                                   self.time_step, np.asarray(self.bounds, dtype='float64'), self.collision_damping)
+
+    def update_binary16(self):
+        frame = sph_binary16.frame(encode(self.positions), encode(self.velocities),
+                                   sph_binary16.HardwareConstants.from_engine(self), pair_block=self.pair_block)
+        for field in ("predicted_positions", "densities", "pressures", "pressure_forces", "positions", "velocities"):
+            getattr(self, field)[...] = decode(frame[field])
+
+    def update(self):
+        if self.precision == "binary16":
+            self.update_binary16()
+            return
+        sph_integrators.advance(self)
+
+    def compute_forces(self, lookahead):
+        """Densities, pressures and pressure forces at positions + lookahead * velocities."""
+        self.predict_positions(lookahead)
+        self.build_grid()
+        if self.compiled():
+            self.compute_forces_compiled()
+            return
+        pairs = self.find_pairs()
+        self.calculate_densities(pairs)
+        # densities must all be known before any force is computed
+        self.calculate_pressure_forces(pairs)
+
+    def integrate(self):
+        """One symplectic Euler step with the current pressure forces."""
+        if self.compiled():
+            self.integrate_compiled()
+        else:
+            self.update_particles()
+
+    def accelerations(self):
+        return (self.pressure_forces + self.gravity_force) / self.densities[:, None]
+
+    def get_particles(self):
+        """Read only view of the particles, overwritten by the next update(), copy it to keep it."""
+        return ParticleView(self.positions, self.velocities, writeable=False)
+
+    def add_particle(self, particle):
+        self.load_particles(ParticleView(np.vstack([self.positions, particle.position]),
+                                         np.vstack([self.velocities, particle.velocity])))
+
+    def remove_particle(self, particle):
+        match = np.all(self.positions == particle.position, axis=1) & np.all(self.velocities == particle.velocity, axis=1)
+        index = np.flatnonzero(match)
+        if len(index) == 0:
+            raise ValueError("SPH_ArrayEngine.remove_particle(x): x not in engine")
+        self.load_particles(ParticleView(np.delete(self.positions, index[0], axis=0),
+                                         np.delete(self.velocities, index[0], axis=0)))
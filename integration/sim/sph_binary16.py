@@ -0,0 +1,347 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from math import pi
+from typing import Tuple
+import numpy as np
+from binary16 import ONE, SIGN, add, mul, div, sqrt, abs_gt
+from binary16_codec import encode, decode
+from neighbor_search import CellList
+
+
+# Golden model of one simulator.sv frame, bit for bit. Every value is a
+# binary16 pattern in a uint16 array, every operation is the binary16.py
+# model of the unit the RTL uses, applied in the order the RTL applies it,
+# and each accumulator sum is reduced in the exact order elem_accumulator.sv
+# adds its terms in.
+
+PREDICTION_FACTOR = 0x1FF0 # scheduler.sv, ~0.00775
+
+# latency from the accumulator issuing an add to it seeing the result: one
+# cycle for the adder_valid_in register plus the 4 stages of binary16_adder
+ADDER_LATENCY = 5
+
+# pairs further apart than this many h are never fetched, their binary16
+# distance can't drop below H
+CANDIDATE_MARGIN = 1.25
+
+# with every coordinate below this no exponent in calc_distance can wrap, so
+# binary16 distances grow with the real ones and the cell list is exact
+SAFE_COORDINATE = 64.0
+
+
+@dataclass(frozen=True)
+class HardwareConstants:
+    """The simulator.sv parameters, as binary16 patterns."""
+    h: int
+    kernel_coeff: int
+    div_kernel_coeff: int
+    time_step: int
+    target_density: int
+    pressure_const: int
+    gravity: int
+    bounds: Tuple[int, ...]
+    collision_damping: int
+    prediction_factor: int = PREDICTION_FACTOR
+
+    @classmethod
+    def from_engine(cls, engine):
+        """Rounds the constants of an SPH_Engine (or SPH_ArrayEngine) to binary16."""
+        if engine.mass != 1.0:
+            raise ValueError("the hardware has no particle mass, binary16 precision needs mass=1.0")
+        h = engine.h
+        return cls(h=encode(h),
+                   kernel_coeff=encode(6 / (pi * h**4)),
+                   div_kernel_coeff=encode(12 / (pi * h**4)),
+                   time_step=encode(engine.time_step),
+                   target_density=encode(engine.target_density),
+                   pressure_const=encode(engine.pressure_coeff),
+                   gravity=encode(engine.gravity_force[-1]),
+                   bounds=tuple(encode(b) for b in engine.bounds),
+                   collision_damping=encode(engine.collision_damping))
+
+
+def replay_accumulator(n, latency=ADDER_LATENCY):
+    """
+    Replays elem_accumulator.sv for n back to back terms, its adder seeing
+    results latency cycles after issuing them. Returns (left, right, cycles),
+    the add tree it builds as child lists (see accumulation_tree) and the
+    cycles from the first term to the sum.
+    """
+    left, right = [], []
+    queue = []      # term_queue, newest first
+    in_flight = {}  # cycle the accumulator sees an adder result -> node
+    cycle, fed = 0, 0
+    while fed < n or in_flight or len(queue) > 1:
+        arrived = [fed] if fed < n else []
+        fed += len(arrived)
+        if cycle in in_flight:
+            arrived.append(in_flight.pop(cycle))
+        # the two oldest queue entries go to the adder whenever there are two
+        if len(queue) > 1:
+            left.append(queue[-1])
+            right.append(queue[-2])
+            in_flight[cycle + latency] = n + len(left) - 1
+            queue = queue[:-2]
+        queue = arrived + queue
+        assert len(queue) <= 3, "term_queue overflow"
+        cycle += 1
+    return left, right, cycle
+
+
+def accumulation_tree(n):
+    """
+    The add tree elem_accumulator.sv builds for n back to back terms, as
+    (left, right) child lists. Leaves are the terms 0..n-1 in arrival
+    order, the k-th add issued is node n + k, the last one the root.
+    """
+    left, right, _ = replay_accumulator(n)
+    return left, right
+
+
+class Accumulator:
+    """
+    Sums terms in elem_accumulator.sv's order, for many accumulations at once.
+
+    Most terms of a particle are exactly +0, and the adder returns x + 0 == x
+    bit for bit, so zero leaves are dropped and the tree induced on the rest
+    is evaluated instead. Its shape only depends on the in-order rank of the
+    leaves and the depth of their lowest common ancestors.
+    """
+
+    def __init__(self, n):
+        self.size = n
+        left, right = accumulation_tree(n)
+        self.rank = np.zeros(n, dtype=np.int64)
+        depth = []
+        # in-order walk, separators[k] is the add between leaf ranks k and k + 1
+        stack, node, d = [], (n + len(left) - 1) if n > 1 else (0 if n else None), 0
+        while stack or node is not None:
+            while node is not None:
+                stack.append((node, d))
+                node = left[node - n] if node >= n else None
+                d += 1
+            node, d = stack.pop()
+            if node < n:
+                self.rank[node] = len(depth)
+            else:
+                depth.append(d)
+            node = right[node - n] if node >= n else None
+            d += 1
+        # sparse table for range minimum queries over the separator depths
+        depth = np.array(depth + [0], dtype=np.int64)
+        self.table = [depth]
+        while 2 * (1 << (len(self.table) - 1)) <= len(depth):
+            half = 1 << (len(self.table) - 1)
+            prev = self.table[-1]
+            self.table.append(np.minimum(prev[:-half], prev[half:]))
+        self.table = np.array([np.pad(t, (0, len(depth) - len(t))) for t in self.table])
+
+    def lca_depth(self, a, b):
+        """Depth of the lowest common ancestor of the leaves with ranks a < b."""
+        k = np.floor(np.log2(b - a)).astype(np.int64)
+        return np.minimum(self.table[k, a], self.table[k, b - (1 << k)])
+
+    def sum(self, owner, leaf, values, size):
+        """
+        Accumulates values[m] as term leaf[m] of owner[m]'s sum, for owners
+        0..size-1. Returns the size sums, +0 where an owner had no terms.
+        """
+        values = np.asarray(values, dtype=np.uint16)
+        keep = values != 0
+        owner, values = np.asarray(owner)[keep], values[keep]
+        rank = self.rank[np.asarray(leaf)[keep]]
+        order = np.lexsort((rank, owner))
+        owner, rank, values = owner[order], rank[order], values[order]
+
+        separators = np.full(max(len(values) - 1, 0), -1, dtype=np.int64)
+        same = owner[1:] == owner[:-1]
+        separators[same] = self.lca_depth(rank[:-1][same], rank[1:][same])
+        # adds deeper than both their neighbors have two leaves as operands
+        while np.any(separators >= 0):
+            before = np.concatenate(([-1], separators[:-1]))
+            after = np.concatenate((separators[1:], [-1]))
+            merge = (separators >= 0) & (separators > before) & (separators > after)
+            k = np.flatnonzero(merge)
+            values[k] = add(values[k], values[k + 1])
+            kept = np.ones(len(values), dtype=bool)
+            kept[k + 1] = False
+            owner, values = owner[kept], values[kept]
+            separators = separators[~merge]
+
+        sums = np.zeros(size, dtype=np.uint16)
+        sums[owner] = values
+        return sums
+
+
+@lru_cache(maxsize=8)
+def accumulator(n):
+    return Accumulator(n)
+
+
+def merge_lanes(owner, j, values, lanes):
+    """
+    lane_merge.sv for sweeps through lanes compute lanes, j in lane
+    j % lanes of group j // lanes. The terms of a group are added by its
+    adder tree, lane 2n + 1 to lane 2n at every level, lanes without a term
+    as +0. Returns (owner, group, value) of the merged terms.
+    """
+    values = np.asarray(values, dtype=np.uint16)
+    keep = values != 0
+    owner, j, values = np.asarray(owner)[keep], np.asarray(j)[keep], values[keep]
+    group, lane = j // lanes, j % lanes
+    order = np.lexsort((lane, group, owner))
+    owner, group, lane, values = owner[order], group[order], lane[order], values[order]
+    for _ in range(int(np.log2(lanes))):
+        pair = (owner[1:] == owner[:-1]) & (group[1:] == group[:-1]) & ((lane[1:] >> 1) == (lane[:-1] >> 1))
+        k = np.flatnonzero(pair)
+        values[k] = add(values[k], values[k + 1])
+        kept = np.ones(len(values), dtype=bool)
+        kept[k + 1] = False
+        owner, group, lane, values = owner[kept], group[kept], lane[kept] >> 1, values[kept]
+    return owner, group, values
+
+
+def lane_sum(owner, j, values, size, lanes=1):
+    """
+    Accumulator.sum of the terms of a phase with scheduler.sv's
+    COMPUTE_LANES: the sweep of particle 0 goes through lane 0 alone, one
+    term per j, every later one through all lanes, one merged term per group.
+    """
+    if lanes == 1:
+        return accumulator(size).sum(owner, j, values, size)
+    owner, j, values = np.asarray(owner), np.asarray(j), np.asarray(values, dtype=np.uint16)
+    first = owner == 0
+    sums = accumulator(size).sum(owner[first], j[first], values[first], size)
+    merged = merge_lanes(owner[~first], j[~first], values[~first], lanes)
+    sums[1:] = accumulator(-(-size // lanes)).sum(*merged, size)[1:]
+    return sums
+
+
+def candidate_pairs(x, cell_size, dense=False, pair_block=1 << 22):
+    """
+    Yields blocks of (i, j) pairs that may interact, i == j included. Pairs
+    of particles inside SAFE_COORDINATE come from a cell list, the others
+    (every particle when dense) are paired with everyone.
+
+    Only the last two dimensions are looked at, the ones distance() sums.
+    """
+    x = x[:, -2:]
+    N = len(x)
+    unsafe = np.ones(N, dtype=bool) if dense else ~np.all(np.abs(x) < SAFE_COORDINATE, axis=1)
+    safe, unsafe = np.flatnonzero(~unsafe), np.flatnonzero(unsafe)
+
+    grid = CellList(cell_size)
+    grid.build(x[safe])
+    for block in grid.blocks(pair_block):
+        i, j = grid.pairs(block)
+        yield safe[i], safe[j]
+
+    everyone = np.arange(N)
+    for chunk in np.array_split(unsafe, -(-len(unsafe) * N // pair_block)) if len(unsafe) else []:
+        yield np.repeat(chunk, N), np.tile(everyone, len(chunk))
+        yield np.tile(safe, len(chunk)), np.repeat(chunk, len(safe))
+
+
+def predict(positions, velocities, c):
+    """scheduler.sv, x + v * PREDICTION_FACTOR."""
+    return add(positions, mul(velocities, c.prediction_factor))
+
+
+def distance(x_i, x_j):
+    """
+    calc_distance.sv, which only ever sums elements 0 and 1 of its packed
+    vectors, the last two dimensions. With DIMS=3 x is ignored.
+    """
+    diff = add(x_i, x_j ^ SIGN)
+    square = mul(diff, diff)
+    return sqrt(add(square[..., -1], square[..., -2]))
+
+
+def kernel_difference(r, c):
+    """r - H, flushed to 0 outside the kernel (calc_spiky_kernel.sv)."""
+    diff = add(c.h | SIGN, r)
+    return np.where(diff & SIGN, diff, 0).astype(np.uint16)
+
+
+def density_terms(r, c):
+    diff = kernel_difference(r, c)
+    return mul(mul(diff, diff), c.kernel_coeff)
+
+
+def force_terms(x_i, x_j, pressure_i, pressure_j, density_recip_j, r, c):
+    """compute.sv force path, (M, DIMS) terms of f_i."""
+    pressure_sum = add(pressure_i, pressure_j)
+    half_rho = mul(density_recip_j, 0xB800) # * -0.5
+    terms = mul(mul(add(x_i ^ SIGN, x_j), pressure_sum[:, None]), half_rho[:, None])
+    terms = mul(div(ONE, r)[:, None], terms)
+    # -0 outside the kernel, which the multiplier flushes to +0
+    gradient = mul(kernel_difference(r, c) ^ SIGN, c.div_kernel_coeff)
+    return add(0, mul(terms, gradient[:, None]))
+
+
+def update_particles(positions, velocities, forces, density_recips, c):
+    """particle_updater.sv"""
+    gravity = np.zeros(positions.shape[1], dtype=np.uint16)
+    gravity[-1] = c.gravity # element 0 of the packed vector is the last dimension
+    accel = mul(add(forces, gravity), density_recips[:, None])
+    velocities = add(velocities, mul(accel, c.time_step))
+    positions = add(positions, mul(velocities, c.time_step))
+
+    bounds = np.array(c.bounds, dtype=np.uint16)
+    colliding = abs_gt(positions, bounds)
+    positions = np.where(colliding, bounds ^ (positions & SIGN), positions).astype(np.uint16)
+    velocities = np.where(colliding, mul(velocities ^ SIGN, c.collision_damping), mul(velocities, ONE)).astype(np.uint16)
+    return positions, velocities
+
+
+def frame(positions, velocities, c, dense=False, pair_block=1 << 22, lanes=1):
+    """
+    One simulator.sv frame. positions and velocities are (N, DIMS) uint16,
+    the result is a dict of every intermediate, as uint16 arrays.
+
+    Pairs come from a cell list with cells CANDIDATE_MARGIN * h wide; dense
+    evaluates all N^2 pairs instead, like the scheduler does. lanes is the
+    simulator's COMPUTE_LANES, which changes the order of the sums.
+    """
+    positions = np.asarray(positions, dtype=np.uint16)
+    velocities = np.asarray(velocities, dtype=np.uint16)
+    N, DIMS = positions.shape
+    if DIMS < 2:
+        raise ValueError("calc_distance.sv sums two dimensions, DIMS must be at least 2")
+
+    predicted = predict(positions, velocities, c)
+    pairs = candidate_pairs(decode(predicted), CANDIDATE_MARGIN * decode(c.h), dense, pair_block)
+    def sum_terms(owner, j, values, size):
+        return lane_sum(owner, j, values, size, lanes)
+
+    # density phase, the self term included. Only pairs inside H are kept,
+    # the kernel gradient is 0 for all the others
+    i, j, r, terms = [np.zeros(0, np.intp)], [np.zeros(0, np.intp)], [np.zeros(0, np.uint16)], [np.zeros(0, np.uint16)]
+    for i_block, j_block in pairs:
+        r_block = distance(predicted[i_block], predicted[j_block])
+        near = kernel_difference(r_block, c) != 0
+        i_block, j_block, r_block = i_block[near], j_block[near], r_block[near]
+        i.append(i_block), j.append(j_block), r.append(r_block), terms.append(density_terms(r_block, c))
+    i, j, r = np.concatenate(i), np.concatenate(j), np.concatenate(r)
+    densities = sum_terms(i, j, np.concatenate(terms), N)
+    density_recips = div(ONE, densities)
+    pressures = mul(add(densities, c.target_density | SIGN), c.pressure_const)
+
+    # force phase, the scheduler zeroes the pressures of the self term
+    others = i != j
+    i, j, r = i[others], j[others], r[others]
+    terms = force_terms(predicted[i], predicted[j], pressures[i], pressures[j], density_recips[j], r, c)
+    forces = np.zeros((N, DIMS), dtype=np.uint16)
+    for d in range(DIMS):
+        forces[:, d] = sum_terms(i, j, terms[:, d], N)
+
+    new_positions, new_velocities = update_particles(positions, velocities, forces, density_recips, c)
+    return {
+        "predicted_positions": predicted,
+        "densities": densities,
+        "density_recips": density_recips,
+        "pressures": pressures,
+        "pressure_forces": forces,
+        "positions": new_positions,
+        "velocities": new_velocities,
+    }
@@ -0,0 +1,264 @@
+import json
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import mem_image
+from sph_engine import ParticleView, gravity_vector, smoothing_kernel, smoothing_kernel_gradient
+
+
+# Checkpoints of a whole engine: a directory with one .npy per particle
+# array and meta.json holding the parameters, the engine class and the
+# frame number. Arrays are loaded memory-mapped, so opening a checkpoint
+# reads nothing until the arrays are used. Checkpoints are written to a
+# temporary directory and renamed into place, a crash never leaves half of
+# one behind.
+
+FORMAT_VERSION = 1
+
+# particle state, then the fields derived from it in the last frame
+FIELDS = ("positions", "velocities", "predicted_positions", "densities", "pressures", "pressure_forces")
+
+PARAMETERS = ("mass", "time_step", "h", "target_density", "pressure_coeff", "collision_damping",
+              "precision", "integrator", "adaptive")
+
+
+def engine_arrays(engine):
+    """Every FIELDS array of an engine as (N, ...) float64, SPH_Engine's lists and dicts included."""
+    N, DIMS = engine.positions.shape
+    arrays = {}
+    for field in FIELDS:
+        value = getattr(engine, field)
+        if isinstance(value, dict):
+            value = [value.get(i, 0.0) for i in range(N)]
+        shape = (N, DIMS) if field in ("positions", "velocities", "predicted_positions", "pressure_forces") else (N,)
+        arrays[field] = np.array(value, dtype='float64').reshape(shape)
+    return arrays
+
+
+def kernel_spec(engine):
+    """The kernels as something meta.json can hold, None for the default smoothing_kernel."""
+    if engine.kernel is smoothing_kernel and engine.kernel_gradient is smoothing_kernel_gradient:
+        return None
+    spec = getattr(engine.kernel, "kernel", None)
+    if spec is None or getattr(engine.kernel_gradient, "kernel", None) != spec:
+        return "custom"
+    name, dims, table_size = spec
+    return {"name": name, "dims": dims, "table_size": table_size}
+
+
+def engine_meta(engine, frame):
+    meta = {
+        "version": FORMAT_VERSION,
+        "engine": type(engine).__name__,
+        "frame": frame,
+        "particles": len(engine.positions),
+        "dims": engine.positions.shape[1],
+        "gravity_force": [float(g) for g in engine.gravity_force],
+        "bounds": [float(b) for b in engine.bounds],
+        "kernel": kernel_spec(engine),
+    }
+    meta.update({name: getattr(engine, name) for name in PARAMETERS if hasattr(engine, name)})
+    return meta
+
+
+def scenario_meta(scenario):
+    """The meta of an engine made from an sph_runner scenario, before any frame."""
+    bounds = [float(b) for b in scenario["bounds"]]
+    kernel = scenario.get("kernel")
+    meta = {
+        "version": FORMAT_VERSION,
+        "engine": scenario["engine"],
+        "frame": 0,
+        "dims": len(bounds),
+        "gravity_force": [float(g) for g in gravity_vector(scenario["gravitational_constant"], len(bounds))],
+        "bounds": bounds,
+        "kernel": None if kernel is None else
+                  {"name": kernel, "dims": len(bounds), "table_size": scenario.get("kernel_table")},
+    }
+    meta.update({name: scenario[name] for name in PARAMETERS if name in scenario})
+    return meta
+
+
+def write(path, meta, arrays):
+    """Writes a checkpoint directory from meta and a dict of arrays, replacing any old one."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    for field, array in arrays.items():
+        np.save(tmp / f"{field}.npy", array)
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    if path.exists():
+        shutil.rmtree(path)
+    tmp.rename(path)
+    return path
+
+
+def save(engine, path, frame=0):
+    """Checkpoints engine to the directory path."""
+    return write(path, engine_meta(engine, frame), engine_arrays(engine))
+
+
+class CheckpointWriter:
+    """
+    Saves checkpoints from a background thread. save() copies the engine's
+    arrays (a memcpy, the engine can go on right away) and returns a Future
+    of the checkpoint path, checkpoints are written in order.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def save(self, engine, path, frame=0):
+        return self.executor.submit(write, path, engine_meta(engine, frame), engine_arrays(engine))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Checkpoint:
+    """A checkpoint directory opened read only, arrays memory-mapped on first use."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text())
+        if self.meta.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"{self.path} was written by a newer version (format {self.meta['version']})")
+        self.arrays = {}
+
+    def __getitem__(self, field):
+        if field not in self.arrays:
+            self.arrays[field] = np.load(self.path / f"{field}.npy", mmap_mode='r')
+        return self.arrays[field]
+
+    def __contains__(self, field):
+        return (self.path / f"{field}.npy").exists()
+
+    @property
+    def frame(self):
+        return self.meta["frame"]
+
+    def particles(self):
+        """The particles as a read only ParticleView of the mapped arrays."""
+        return ParticleView(self["positions"], self["velocities"], writeable=False)
+
+
+def load(path):
+    return Checkpoint(path)
+
+
+def kernels(meta):
+    """The kernel and kernel_gradient a checkpoint was taken with, when they can be recreated."""
+    spec = meta.get("kernel")
+    if spec is None:
+        return smoothing_kernel, smoothing_kernel_gradient
+    if spec == "custom":
+        raise ValueError("the checkpoint was taken with custom kernels, pass kernel and kernel_gradient")
+    from sph_kernels import get_kernel
+    kernel = get_kernel(spec["name"], spec["dims"], spec["table_size"])
+    return kernel.value, kernel.gradient
+
+
+def load_into(engine, path, parameters=True):
+    """
+    Replaces the particles of an existing engine (and, with parameters,
+    its simulation constants) by a checkpoint's. The engine keeps its
+    kernels. Returns the checkpoint's frame number.
+    """
+    checkpoint = path if isinstance(path, Checkpoint) else load(path)
+    engine.particles = checkpoint.particles()
+    if parameters:
+        meta = checkpoint.meta
+        for name in PARAMETERS:
+            if name in meta and hasattr(engine, name):
+                setattr(engine, name, meta[name])
+        if "gravity_force" in meta:
+            engine.gravity_force = np.array(meta["gravity_force"], dtype='float64')
+            engine.bounds = tuple(meta["bounds"])
+
+    # the fields of the last frame, for anything reading them before the next update()
+    derived = [field for field in FIELDS[2:] if field in checkpoint]
+    for field in derived:
+        values = checkpoint[field]
+        current = getattr(engine, field)
+        if isinstance(current, np.ndarray):
+            current[...] = values
+        elif isinstance(current, dict):
+            setattr(engine, field, dict(enumerate(values.tolist())))
+        else:
+            setattr(engine, field, list(np.array(values)))
+    return checkpoint.frame
+
+
+def restore(path, engine_class=None, kernel=None, kernel_gradient=None, **kwargs):
+    """
+    A new engine in the state of a checkpoint. engine_class defaults to the
+    class the checkpoint was taken from, kwargs go to its constructor.
+    """
+    from sph_runner import engine_class as named_engine
+    checkpoint = load(path)
+    meta = checkpoint.meta
+    if kernel is None or kernel_gradient is None:
+        kernel, kernel_gradient = kernels(meta)
+    engine_class = engine_class or named_engine(meta["engine"])
+    options = {name: meta[name] for name in ("precision", "integrator", "adaptive") if name in meta}
+    options.update(kwargs)
+    engine = engine_class(
+        checkpoint.particles(),
+        mass=meta["mass"],
+        time_step=meta["time_step"],
+        h=meta["h"],
+        kernel=kernel,
+        kernel_gradient=kernel_gradient,
+        target_density=meta["target_density"],
+        pressure_coeff=meta["pressure_coeff"],
+        gravitational_constant=meta["gravity_force"][-1],
+        bounds=tuple(meta["bounds"]),
+        collision_damping=meta["collision_damping"],
+        **options)
+    load_into(engine, checkpoint, parameters=False)
+    return engine
+
+
+def to_mem(path, mem_path):
+    """Writes a checkpoint's particles as a particle.mem image (binary16, rounded)."""
+    checkpoint = load(path)
+    mem_image.write_particles(mem_path, checkpoint["positions"], checkpoint["velocities"])
+
+
+def from_mem(mem_path, path, template=None, frame=0):
+    """
+    A checkpoint of the particles of a particle.mem image. The parameters
+    are copied from the checkpoint template, if given, else they are
+    sph_runner.DEFAULT_SCENARIO's, so the checkpoint can always be
+    restored. Derived fields are left out, there is no frame they came from.
+    """
+    if template is not None:
+        meta = dict(load(template).meta)
+    else:
+        from sph_runner import DEFAULT_SCENARIO
+        meta = scenario_meta(DEFAULT_SCENARIO)
+    positions, velocities = mem_image.read_particles(mem_path, len(meta["bounds"]))
+    meta.update(frame=frame, particles=len(positions), dims=positions.shape[1])
+    return write(path, meta, {"positions": positions, "velocities": velocities})
+
+
+if __name__ == "__main__":
+    usage = "Usage: python sph_checkpoint.py to-mem <checkpoint> <particle.mem>\n" \
+            "       python sph_checkpoint.py from-mem <particle.mem> <checkpoint> [template checkpoint]"
+    if len(sys.argv) < 4 or sys.argv[1] not in ("to-mem", "from-mem"):
+        print(usage)
+        sys.exit(1)
+    if sys.argv[1] == "to-mem":
+        to_mem(sys.argv[2], sys.argv[3])
+    else:
+        from_mem(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None)
@@ -1,15 +1,28 @@
 import sys
 import os
+from collections.abc import Sequence
 from typing import Callable, List, Tuple
-import copy
 from functools import partial
+from itertools import product
 import numpy as np
-import pygame
+try:
+    import pygame
+except ImportError: # the engine itself runs headless, only SPH_Visualizer needs pygame
+    pygame = None
 import sys
-from dataclasses import dataclass
 from math import pi
 from multiprocessing import Pool
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from neighbor_search import CellList
+import sph_binary16
+import sph_integrators
+from binary16_codec import encode, decode
+
+
+def gravity_vector(gravitational_constant, dims):
+    gravity = np.zeros(dims, dtype='float64')
+    gravity[-1] = gravitational_constant
+    return gravity
 
 
 def curry(f):
@@ -20,8 +33,10 @@ def curry(f):
     return curried_function
 
 
-@dataclass
 class Particle:
+    # no per-instance __dict__, the engines hand out one of these per particle
+    __slots__ = ("position", "velocity")
+
     def __init__(self, position, velocity):
         self.position = position
         self.velocity = velocity
@@ -31,32 +46,81 @@ class Particle:
     
     def __repr__(self):
         return f"Particle({self.position}, {self.velocity})"
-    
-    
+
+
+def read_only(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class ParticleView(Sequence):
+    """
+    The particles of an engine as a sequence over its (N, DIMS) position and
+    velocity arrays, nothing is copied. Indexing gives a Particle whose
+    fields are row views, a slice gives another ParticleView. Assigning a
+    Particle to an index copies its fields into the arrays.
+    """
+    __slots__ = ("positions", "velocities")
+
+    def __init__(self, positions, velocities, writeable=True):
+        self.positions = positions if writeable else read_only(positions)
+        self.velocities = velocities if writeable else read_only(velocities)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ParticleView(self.positions[index], self.velocities[index])
+        return Particle(self.positions[index], self.velocities[index])
+
+    def __setitem__(self, index, particle):
+        self.positions[index] = particle.position
+        self.velocities[index] = particle.velocity
+
+    def __repr__(self):
+        return f"[{', '.join(map(repr, self))}]"
+
+
+def particle_arrays(particles):
+    """Fresh (N, DIMS) float64 position and velocity arrays of a list of Particles (or a ParticleView)."""
+    if isinstance(particles, ParticleView):
+        return np.array(particles.positions, dtype='float64'), np.array(particles.velocities, dtype='float64')
+    N = len(particles)
+    positions = np.array([p.position for p in particles], dtype='float64').reshape(N, -1)
+    velocities = np.array([p.velocity for p in particles], dtype='float64').reshape(N, -1)
+    return positions, velocities
+
+
 def generate_random_particles(num_particles, bounds):
+    """Particles at rest, uniformly placed in [0, bounds), one dimension per bound."""
     particles = []
     for _ in range(num_particles):
-        position = np.array([
-            np.random.uniform(0, bounds[0]),
-            np.random.uniform(0, bounds[1])
-        ], dtype='float64')
-        velocity = np.array([0, 0], dtype='float64')
+        position = np.array([np.random.uniform(0, b) for b in bounds], dtype='float64')
+        velocity = np.zeros(len(bounds), dtype='float64')
         particles.append(Particle(position, velocity))
     return particles
 
-def generate_grid_particles(rows, cols, spacing, bounds):
+def generate_lattice_particles(shape, spacing, bounds):
+    """A lattice of prod(shape) particles, spacing apart and wrapped into bounds."""
     particles = []
-    for i in range(rows):
-        for j in range(cols):
-            position = np.array([
-                i * spacing % bounds[0],
-                j * spacing % bounds[1]
-            ], dtype='float64')
-            velocity = np.array([0, 0], dtype='float64')
-            particles.append(Particle(position, velocity))
+    for index in product(*(range(n) for n in shape)):
+        position = np.array([k * spacing % b for k, b in zip(index, bounds)], dtype='float64')
+        velocity = np.zeros(len(shape), dtype='float64')
+        particles.append(Particle(position, velocity))
     return particles
 
+def generate_grid_particles(rows, cols, spacing, bounds):
+    return generate_lattice_particles((rows, cols), spacing, bounds)
+
 def generate_grid_particles_in_rectangle(num_particles, rect):
+    """
+    About num_particles particles evenly spread over rect, (x_min, y_min,
+    width, height) in 2D or (x_min, y_min, z_min, width, height, depth) in 3D.
+    """
+    if len(rect) != 4:
+        return generate_grid_particles_in_box(num_particles, rect)
     particles = []
     x_min, y_min, width, height = rect
     rows = int(np.sqrt(num_particles * height / width))
@@ -73,9 +137,18 @@ def generate_grid_particles_in_rectangle(num_particles, rect):
             particles.append(Particle(position, velocity))
     return particles
 
+def generate_grid_particles_in_box(num_particles, box):
+    DIMS = len(box) // 2
+    corner, size = np.array(box[:DIMS], dtype='float64'), np.array(box[DIMS:], dtype='float64')
+    spacing = (np.prod(size) / num_particles) ** (1 / DIMS)
+    counts = np.maximum((size / spacing).astype(int), 1)
+    spacings = size / counts
+    return [Particle(corner + np.array(index) * spacings, np.zeros(DIMS, dtype='float64'))
+            for index in product(*(range(n) for n in counts))]
+
 
-def random_dir():
-    v = np.array([np.random.uniform(-1, 1), np.random.uniform(-1, 1)], dtype='float64')
+def random_dir(dims=2):
+    v = np.array([np.random.uniform(-1, 1) for _ in range(dims)], dtype='float64')
     return v / np.linalg.norm(v)
 
 
@@ -91,15 +164,13 @@ class SPH_Engine:
                 pressure_coeff: float, 
                 gravitational_constant: float,
                 bounds: Tuple[float, float], 
-                collision_damping: float):
+                collision_damping: float,
+                cache_neighbors: bool = False,
+                precision: str = "float64",
+                integrator: str = "symplectic_euler",
+                adaptive: bool = False):
         
-        self.particles = list(copy.copy(p) for p in particles)
-        N = len(self.particles)
-        
-        self.predicted_positions = [np.array([0, 0], dtype='float64') for _ in range(N)]
-        self.densities = {}
-        self.pressures = {}
-        self.pressure_forces = [np.array([0, 0], dtype='float64') for _ in range(N)]
+        self.load_particles(particles)
         
         # time step and smoothing length
         self.time_step = time_step
@@ -114,17 +185,58 @@ class SPH_Engine:
         self.pressure_coeff = pressure_coeff
         self.mass = mass
         
-        # gravity force
-        self.gravity_force = np.array([0, gravitational_constant], dtype='float64')
+        # gravity force, along the last axis like particle_updater.sv (element
+        # 0 of its packed vectors), which is y in 2D
+        self.gravity_force = gravity_vector(gravitational_constant, len(bounds))
         self.collision_damping = collision_damping
         
         # bounds
         self.bounds = bounds
-        self.grid = {}
+        self.grid = CellList(h)
+        
+        # keep the density phase neighbor lists around for the force phase,
+        # valid because predicted positions don't move between the two
+        self.cache_neighbors = cache_neighbors
+        self.neighbor_cache = {}
+
+        # "binary16" runs every frame through the bit exact model of the
+        # hardware (sph_binary16), "float64" is the reference physics
+        if precision not in ("float64", "binary16"):
+            raise ValueError(f"unknown precision {precision!r}")
+        self.precision = precision
+
+        # time integration (sph_integrators), adaptive splits frames into substeps
+        self.integrator = sph_integrators.check_integrator(integrator)
+        self.adaptive = adaptive
+        self.substeps = 1
+
+    def load_particles(self, particles):
+        """(Re)allocates the particle arrays, self.particles is a view of them."""
+        self.positions, self.velocities = particle_arrays(particles)
+        N = len(self.positions)
+
+        DIMS = self.positions.shape[1]
+
+        self.predicted_positions = [np.zeros(DIMS, dtype='float64') for _ in range(N)]
+        self.densities = {}
+        self.pressures = {}
+        self.pressure_forces = [np.zeros(DIMS, dtype='float64') for _ in range(N)]
+        self.cached_accelerations = None
+
+    @property
+    def particles(self):
+        return ParticleView(self.positions, self.velocities)
+
+    @particles.setter
+    def particles(self, particles):
+        self.load_particles(particles)
 
     def calculate_density(self, i):
         density = 0
-        for j in self.get_neighboring_particles(i):
+        neighbors = self.get_neighboring_particles(i)
+        if self.cache_neighbors:
+            self.neighbor_cache[i] = neighbors
+        for j in neighbors:
         # for j in range(len(self.particles)):
             distance = np.linalg.norm(self.predicted_positions[j] - self.predicted_positions[i])
             # distance = np.linalg.norm(self.particles[j].position - self.particles[i].position)
@@ -134,10 +246,18 @@ class SPH_Engine:
                 
         return density
 
+    def density_and_neighbors(self, i):
+        """calculate_density for the process pool, with the neighbor list it cached (None without cache_neighbors)."""
+        return self.calculate_density(i), self.neighbor_cache.get(i)
+
     def pressure_force(self, i):
         p = self.particles[i]
-        pressure_force = np.zeros(2)
-        for j, q in enumerate(self.particles):
+        pressure_force = np.zeros(len(p.position))
+        # the kernel gradient is 0 beyond h, so only the neighboring cells contribute
+        neighbors = self.neighbor_cache.get(i)
+        if neighbors is None:
+            neighbors = self.get_neighboring_particles(i)
+        for j in neighbors:
             
             if i == j:
                 continue
@@ -148,12 +268,12 @@ class SPH_Engine:
             # dir = (q.position - p.position) / distance if distance > 0 else random_dir()
             distance = np.linalg.norm(r)
             # print(f"{distance=}")
-            dir = r / distance if distance > 0 else random_dir()
+            dir = r / distance if distance > 0 else random_dir(len(r))
             # print(f"{dir=}")
             W = self.kernel_gradient(distance, self.h)
             # print(f"{W=}")
             # print(f"without: {-self.mass * (self.pressures[i] + self.pressures[j]) / (2 * self.densities[j]) * dir}")
-            f_p = -self.mass * (self.pressures[i] + self.pressures[j]) / (2 * self.densities[j]) * self.kernel_gradient(distance, self.h) * dir
+            f_p = -self.mass * (self.pressures[i] + self.pressures[j]) / (2 * self.densities[j]) * W * dir
             pressure_force += f_p
             # print(f"{f_p=}")
             
@@ -168,43 +288,48 @@ class SPH_Engine:
         p.velocity += self.time_step * accel
         next_position = p.position + self.time_step * p.velocity
 
-        if next_position[0] < -self.bounds[0] or next_position[0] > self.bounds[0]:
-            p.velocity[0] = -p.velocity[0] * self.collision_damping
-        if next_position[1] < -self.bounds[1] or next_position[1] > self.bounds[1]:
-            p.velocity[1] = -p.velocity[1] * self.collision_damping
+        for d, bound in enumerate(self.bounds):
+            if next_position[d] < -bound or next_position[d] > bound:
+                p.velocity[d] = -p.velocity[d] * self.collision_damping
 
         p.position += self.time_step * p.velocity
 
-        if p.position[0] < -self.bounds[0] or p.position[0] > self.bounds[0] or p.position[1] < -self.bounds[1] or p.position[1] > self.bounds[1]:
-            p.position = np.clip(p.position, 0, self.bounds)
-            p.velocity = np.array([0, 0], dtype='float64')
+        if any(x < -bound or x > bound for x, bound in zip(p.position, self.bounds)):
+            p.position[:] = np.clip(p.position, 0, self.bounds)
+            p.velocity[:] = 0
         
         return p
     
     def get_neighboring_particles(self, i):
-        grid_x = int(self.predicted_positions[i][0] // self.h)
-        grid_y = int(self.predicted_positions[i][1] // self.h)
-        for dx in [-1, 0, 1]:
-            for dy in [-1, 0, 1]:
-                neighbor_cell = (grid_x + dx, grid_y + dy)
-                if neighbor_cell in self.grid:
-                    yield from self.grid[neighbor_cell]    
+        return self.grid.neighbors(i)
+
+    def update_binary16(self):
+        positions, velocities = encode(self.positions), encode(self.velocities)
+        frame = sph_binary16.frame(positions, velocities, sph_binary16.HardwareConstants.from_engine(self))
+
+        self.predicted_positions = list(decode(frame["predicted_positions"]))
+        self.densities = dict(enumerate(decode(frame["densities"])))
+        self.pressures = dict(enumerate(decode(frame["pressures"])))
+        self.pressure_forces = list(decode(frame["pressure_forces"]))
+        self.positions[...] = decode(frame["positions"])
+        self.velocities[...] = decode(frame["velocities"])
 
     def update(self):
-        
-        # calculate densities and pressures
+        if self.precision == "binary16":
+            self.update_binary16()
+            return
+        sph_integrators.advance(self)
+
+    def compute_forces(self, lookahead):
+        """Densities, pressures and pressure forces at positions + lookahead * velocities."""
         for i, p in enumerate(self.particles):
-            self.predicted_positions[i] = (p.position + (self.time_step * p.velocity))
+            self.predicted_positions[i] = (p.position + (lookahead * p.velocity))
         # print(self.predicted_positions[:3])
         # print(self.particles[:3])
         # Partition the bounds into squares of width h
-        self.grid = {}
-        for i in range(len(self.particles)):
-            grid_x = int(self.predicted_positions[i][0] // self.h)
-            grid_y = int(self.predicted_positions[i][1] // self.h)
-            if (grid_x, grid_y) not in self.grid:
-                self.grid[(grid_x, grid_y)] = []
-            self.grid[(grid_x, grid_y)].append(i)
+        self.grid.cell_size = self.h
+        self.grid.update(self.predicted_positions)
+        self.neighbor_cache = {}
 
         N = len(self.particles) 
         if N <= 100:
@@ -214,15 +339,10 @@ class SPH_Engine:
                 self.densities[i] = density
                 self.pressures[i] = self.pressure_coeff * (density - self.target_density)
 
-            # Then, calculate pressure forces and update particle positions
+            # Then, calculate pressure forces
             for i in range(len(self.particles)):
                 self.pressure_forces[i] = self.pressure_force(i)
                 
-            # These must be seperated, because you can't update the 
-            # position of a particle while calculating the pressure forces
-            for i in range(len(self.particles)):
-                self.particles[i] = self.update_particle(i)
-                
         else:          
             
             workers = os.cpu_count()
@@ -231,36 +351,62 @@ class SPH_Engine:
             # # overhead makes this too slow
             with ProcessPoolExecutor(max_workers=workers) as executor:
                 
-                # First, calculate densities and pressures
-                for i, density in enumerate(executor.map(self.calculate_density, range(len(self.particles)), chunksize=N//workers)):
+                # First, calculate densities and pressures. The workers fill
+                # their own copies of neighbor_cache, so it comes back here
+                # to be pickled along with self for the force phase
+                for i, (density, neighbors) in enumerate(executor.map(self.density_and_neighbors, range(len(self.particles)), chunksize=N//workers)):
                     self.densities[i] = density
                     self.pressures[i] = self.pressure_coeff * (density - self.target_density)
+                    if neighbors is not None:
+                        self.neighbor_cache[i] = neighbors
 
                 # Then, calculate pressure forces
                 for i, pressure_force in enumerate(executor.map(self.pressure_force, range(len(self.particles)), chunksize=N//workers)):
                     self.pressure_forces[i] = pressure_force
-                                          
-                for i, particle in enumerate(executor.map(self.update_particle, range(len(self.particles)), chunksize=N//workers)):
-                    self.particles[i] = particle
+
+    def integrate(self):
+        """One symplectic Euler step with the current pressure forces."""
+        # These must be seperated from compute_forces, because you can't update the 
+        # position of a particle while calculating the pressure forces. Too little
+        # work per particle to be worth sending to the process pool
+        for i in range(len(self.particles)):
+            self.particles[i] = self.update_particle(i)
+
+    def accelerations(self):
+        N = len(self.positions)
+        densities = np.array([self.densities.get(i, 0.0) for i in range(N)], dtype='float64')
+        forces = np.array(self.pressure_forces, dtype='float64').reshape(N, -1)
+        return (forces + self.gravity_force) / densities[:, None]
 
     def get_particles(self):
-        return list(copy.copy(p) for p in self.particles)
+        """Read only view of the particles, overwritten by the next update(), copy it to keep it."""
+        return ParticleView(self.positions, self.velocities, writeable=False)
 
     def add_particle(self, particle):
-        self.particles.append(particle)
+        self.load_particles(ParticleView(np.vstack([self.positions, particle.position]),
+                                         np.vstack([self.velocities, particle.velocity])))
 
     def remove_particle(self, particle):
-        self.particles.remove(particle)
+        match = np.all(self.positions == particle.position, axis=1) & np.all(self.velocities == particle.velocity, axis=1)
+        index = np.flatnonzero(match)
+        if len(index) == 0:
+            raise ValueError("SPH_Engine.remove_particle(x): x not in engine")
+        self.load_particles(ParticleView(np.delete(self.positions, index[0], axis=0),
+                                         np.delete(self.velocities, index[0], axis=0)))
 
 
 class SPH_Visualizer:
     
-    def __init__(self, engine: SPH_Engine, width: int = 800, height: int = 600, particle_radius: int = 5):
+    def __init__(self, engine: SPH_Engine, width: int = 800, height: int = 600, particle_radius: int = 5,
+                 checkpoint: str = "checkpoint"):
         
         self.engine = engine
         self.width = width
         self.height = height
         self.particle_radius = particle_radius
+        self.frame = 0
+        # S saves the engine here, L goes back to it (sph_checkpoint)
+        self.checkpoint = checkpoint
         
         pygame.init()
         self.screen = pygame.display.set_mode((self.width, self.height))
@@ -275,7 +421,7 @@ class SPH_Visualizer:
             'h': {'value': self.engine.h, 'min': 0.1, 'max': 8.0, 'pos': (10, 40)},
             'target_density': {'value': self.engine.target_density, 'min': 0.01, 'max': 20.0, 'pos': (10, 70)},
             'pressure_coeff': {'value': self.engine.pressure_coeff, 'min': 0.01, 'max': 100, 'pos': (10, 100)},
-            'gravitational_constant': {'value': self.engine.gravity_force[1], 'min': -40, 'max': 0, 'pos': (10, 130)},
+            'gravitational_constant': {'value': self.engine.gravity_force[-1], 'min': -40, 'max': 0, 'pos': (10, 130)},
             'collision_damping': {'value': self.engine.collision_damping, 'min': 0, 'max': 1, 'pos': (10, 160)}
         }
 
@@ -293,7 +439,7 @@ class SPH_Visualizer:
                 slider['value'] = slider['min'] + (pos[0] - slider['pos'][0]) / self.slider_width * (slider['max'] - slider['min'])
                 setattr(self.engine, name, slider['value'])
                 if name == 'gravitational_constant':
-                    self.engine.gravity_force[1] = slider['value']
+                    self.engine.gravity_force[-1] = slider['value']
 
     def draw_particles(self):
         self.screen.fill((255, 255, 255))
@@ -303,28 +449,39 @@ class SPH_Visualizer:
         work_field = (20, 200, int(height * (self.engine.bounds[0]/self.engine.bounds[1])), height)
         pygame.draw.rect(self.screen, (0, 0, 0), work_field, 1)
         
-        # draw particles
-        for particle in self.engine.get_particles():
-            x, y = particle.position
-            w, l = self.engine.bounds
-            # center = (int(particle.position[0]) + int(self.width/2), -int(particle.position[1]) + int(self.height/2))
-            center = ((work_field[0] + work_field[2] // 2)  + int(x/(2*w) * work_field[2]), (work_field[1] + work_field[3] // 2) - int(y/(2*l) * work_field[3]))
+        # draw particles, screen coordinates of all of them at once
+        positions = self.engine.get_particles().positions
+        w, l = self.engine.bounds
+        centers_x = (work_field[0] + work_field[2] // 2) + (positions[:, 0] / (2 * w) * work_field[2]).astype(int)
+        centers_y = (work_field[1] + work_field[3] // 2) - (positions[:, 1] / (2 * l) * work_field[3]).astype(int)
+        for center in zip(centers_x.tolist(), centers_y.tolist()):
             pygame.draw.circle(self.screen, (0, 0, 255), center, self.particle_radius)
         # draw sliders
         for name, slider in self.sliders.items():
             self.draw_slider(name, slider)
         pygame.display.flip()
 
+    def save_checkpoint(self):
+        import sph_checkpoint
+        sph_checkpoint.save(self.engine, self.checkpoint, self.frame)
+        print("Saved", self.checkpoint)
+
+    def load_checkpoint(self):
+        import sph_checkpoint
+        if os.path.exists(self.checkpoint):
+            self.frame = sph_checkpoint.load_into(self.engine, self.checkpoint)
+            print("Loaded", self.checkpoint, "at frame", self.frame)
+
     def reset(self):
         # particles = generate_grid_particles(10, 10, 0.75, self.engine.bounds)
         # particles = generate_random_particles(400, self.engine.bounds)
         # particles = generate_grid_particles_in_rectangle(400, (7, 3, 3, 3))
         self.engine.particles = generate_random_particles(len(self.engine.particles), self.engine.bounds)
+        self.frame = 0
         
     def run(self):
         running = True
         play = False
-        frame = 0
         while running:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -332,17 +489,21 @@ class SPH_Visualizer:
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_r:
                         self.reset()
+                    if event.key == pygame.K_s:
+                        self.save_checkpoint()
+                    if event.key == pygame.K_l:
+                        self.load_checkpoint()
                     if event.key == pygame.K_RETURN:
                         play = not play
                     if not play and event.key == pygame.K_SPACE:
-                        print("Frame:", frame)
+                        print("Frame:", self.frame)
                         self.engine.update()
-                        frame += 1
+                        self.frame += 1
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     self.update_slider(event.pos)
             if play:
                 self.engine.update()
-                frame += 1
+                self.frame += 1
             self.draw_particles()
             
             # Display FPS
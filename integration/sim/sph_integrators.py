@@ -0,0 +1,112 @@
+from math import ceil, sqrt
+import numpy as np
+
+
+# Time integration for SPH_Engine and SPH_ArrayEngine (and so the parallel
+# engine). An integrator advances an engine by engine.time_step using two
+# engine methods: compute_forces(lookahead) evaluates densities, pressures
+# and pressure forces at positions + lookahead * velocities, accelerations()
+# turns them into (N, DIMS) accelerations. Symplectic Euler is what the
+# engines (and the hardware) have always done, it is the default.
+#
+# With adaptive stepping each frame is split into as many equal substeps as
+# the CFL and force conditions ask for, from the current maximum speed and
+# the accelerations of the last step. Calm frames take one step.
+
+# substep dt <= CFL_NUMBER * h / (c + v_max), c = sqrt(pressure_coeff) the
+# sound speed of the linear equation of state
+CFL_NUMBER = 0.4
+# substep dt <= FORCE_NUMBER * sqrt(h / a_max)
+FORCE_NUMBER = 0.25
+MAX_SUBSTEPS = 32
+
+
+def drift(engine, dt):
+    """x += dt * v, reflecting and damping velocities that would leave the bounds, like update_particles."""
+    positions, velocities = engine.positions, engine.velocities
+    bounds = np.asarray(engine.bounds, dtype='float64')
+    next_positions = positions + dt * velocities
+    colliding = (next_positions < -bounds) | (next_positions > bounds)
+    velocities[colliding] *= -engine.collision_damping
+
+    positions += dt * velocities
+
+    escaped = np.any((positions < -bounds) | (positions > bounds), axis=1)
+    positions[escaped] = np.clip(positions[escaped], 0, bounds)
+    velocities[escaped] = 0
+
+
+def symplectic_euler(engine):
+    """v += dt * a(x + dt * v), then x += dt * v."""
+    engine.cached_accelerations = None
+    engine.compute_forces(engine.time_step)
+    engine.integrate()
+
+
+def leapfrog(engine):
+    """Drift-kick-drift: forces at the half step x + dt/2 * v."""
+    dt = engine.time_step
+    engine.cached_accelerations = None
+    engine.compute_forces(dt / 2)
+    engine.positions += dt / 2 * engine.velocities
+    engine.velocities += dt * engine.accelerations()
+    drift(engine, dt / 2)
+
+
+def velocity_verlet(engine):
+    """Kick-drift-kick, the accelerations at the end of a step are kept for the start of the next."""
+    dt = engine.time_step
+    if engine.cached_accelerations is None or engine.cached_accelerations.shape != engine.velocities.shape:
+        engine.compute_forces(0.0)
+        engine.cached_accelerations = engine.accelerations()
+    engine.velocities += dt / 2 * engine.cached_accelerations
+    drift(engine, dt)
+    engine.compute_forces(0.0)
+    engine.cached_accelerations = engine.accelerations()
+    engine.velocities += dt / 2 * engine.cached_accelerations
+
+
+INTEGRATORS = {
+    "symplectic_euler": symplectic_euler,
+    "leapfrog": leapfrog,
+    "velocity_verlet": velocity_verlet,
+}
+
+
+def check_integrator(name):
+    if name not in INTEGRATORS:
+        raise ValueError(f"unknown integrator {name!r}, one of {', '.join(INTEGRATORS)}")
+    return name
+
+
+def substeps(engine):
+    """Number of substeps the next frame needs, 1 unless engine.adaptive."""
+    if not engine.adaptive or len(engine.velocities) == 0:
+        return 1
+    h = engine.h
+    v_max = float(np.sqrt(np.max(np.sum(engine.velocities**2, axis=1))))
+    dt = CFL_NUMBER * h / (sqrt(max(engine.pressure_coeff, 0.0)) + v_max + 1e-12)
+
+    # accelerations of the last step, not known before the first one
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accel = np.sqrt(np.sum(engine.accelerations()**2, axis=1))
+    a_max = float(np.max(accel[np.isfinite(accel)], initial=0.0))
+    if a_max > 0:
+        dt = min(dt, FORCE_NUMBER * sqrt(h / a_max))
+    return min(max(ceil(engine.time_step / dt), 1), MAX_SUBSTEPS)
+
+
+def advance(engine):
+    """Advances engine by one frame of engine.time_step, in substeps if adaptive."""
+    step = INTEGRATORS[engine.integrator]
+    steps = substeps(engine)
+    frame_time = engine.time_step
+    # every phase reads the step size from time_step (the parallel engine
+    # sends it to its workers), so it holds the substep size meanwhile
+    try:
+        engine.time_step = frame_time / steps
+        for _ in range(steps):
+            step(engine)
+    finally:
+        engine.time_step = frame_time
+    engine.substeps = steps
@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+from math import pi
+from typing import Callable
+import numpy as np
+from binary16_codec import encode
+
+
+# SPH smoothing kernels with compact support h, for either engine: pass
+# kernel.value and kernel.gradient as the kernel and kernel_gradient
+# arguments. Both take arrays (or scalars) of distances r and follow the
+# engines' convention, value is W(r, h) and gradient is -dW/dr, which is
+# >= 0 and pushes apart. Every kernel is normalized over 2D or 3D.
+#
+# The tabulated form samples W and -dW/dr at q = r/h over [0, 1] for h = 1
+# and interpolates linearly between samples, scaling by powers of h. Its
+# evaluation is the same for any kernel, a table lookup like a ROM in
+# calc_spiky_kernel.sv would do.
+
+DEFAULT_TABLE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class Kernel:
+    name: str
+    dims: int
+    value: Callable
+    gradient: Callable
+    table_size: int = 0  # 0 for the analytic form
+
+    def tabulate(self, size=DEFAULT_TABLE_SIZE):
+        """The same kernel, looked up in size + 1 samples over q = r/h in [0, 1]."""
+        q = np.linspace(0.0, 1.0, size + 1)
+        return Kernel(self.name, self.dims,
+                      lookup(self.value(q, 1.0), size, self.dims),
+                      lookup(self.gradient(q, 1.0), size, self.dims + 1),
+                      size)
+
+    def rom_fields(self, size=DEFAULT_TABLE_SIZE):
+        """(size + 1, 2) binary16 {W, -dW/dr} samples at h = 1, for mem_image.write."""
+        q = np.linspace(0.0, 1.0, size + 1)
+        return encode(np.stack([self.value(q, 1.0), self.gradient(q, 1.0)], axis=1))
+
+
+def lookup(table, size, power):
+    """f(r, h) = table(r/h) / h^power, linearly interpolated, 0 from r = h on."""
+    table = np.asarray(table, dtype='float64')
+    slopes = np.diff(table)
+
+    def f(r, h):
+        x = np.minimum(np.asarray(r, dtype='float64') / h, 1.0) * size
+        i = np.minimum(x.astype(np.intp), size - 1)
+        return (table[i] + (x - i) * slopes[i]) / h**power
+    f.vectorized = True
+    return f
+
+
+def analytic(value, gradient):
+    value.vectorized = gradient.vectorized = True
+    return value, gradient
+
+
+def spiky(dims):
+    """(h - r)^2, the kernel of smoothing_kernel and the hardware."""
+    norm = {2: 6 / pi, 3: 15 / (2 * pi)}[dims]
+
+    def value(r, h):
+        return np.where(r < h, norm / h**(dims + 2) * (h - r)**2, 0.0)
+
+    def gradient(r, h):
+        return np.where(r < h, 2 * norm / h**(dims + 2) * (h - r), 0.0)
+    return analytic(value, gradient)
+
+
+def poly6(dims):
+    """(h^2 - r^2)^3"""
+    norm = {2: 4 / pi, 3: 315 / (64 * pi)}[dims]
+
+    def value(r, h):
+        return np.where(r < h, norm / h**(dims + 6) * (h**2 - r**2)**3, 0.0)
+
+    def gradient(r, h):
+        return np.where(r < h, 6 * norm / h**(dims + 6) * r * (h**2 - r**2)**2, 0.0)
+    return analytic(value, gradient)
+
+
+def cubic(dims):
+    """Monaghan's cubic spline, scaled to reach 0 at r = h."""
+    norm = {2: 40 / (7 * pi), 3: 8 / pi}[dims]
+
+    def value(r, h):
+        q = np.asarray(r) / h
+        inner = 6 * (q**3 - q**2) + 1
+        outer = 2 * (1 - q)**3
+        return np.where(q < 0.5, inner, np.where(q < 1, outer, 0.0)) * norm / h**dims
+
+    def gradient(r, h):
+        q = np.asarray(r) / h
+        inner = 6 * q * (2 - 3 * q)
+        outer = 6 * (1 - q)**2
+        return np.where(q < 0.5, inner, np.where(q < 1, outer, 0.0)) * norm / h**(dims + 1)
+    return analytic(value, gradient)
+
+
+def wendland(dims):
+    """Wendland C2, (1 - q)^4 (1 + 4q)"""
+    norm = {2: 7 / pi, 3: 21 / (2 * pi)}[dims]
+
+    def value(r, h):
+        q = np.minimum(np.asarray(r) / h, 1.0)
+        return norm / h**dims * (1 - q)**4 * (1 + 4 * q)
+
+    def gradient(r, h):
+        q = np.minimum(np.asarray(r) / h, 1.0)
+        return 20 * norm / h**(dims + 1) * q * (1 - q)**3
+    return analytic(value, gradient)
+
+
+KERNELS = {
+    "spiky": spiky,
+    "poly6": poly6,
+    "cubic": cubic,
+    "wendland": wendland,
+}
+
+
+def get_kernel(name, dims=2, table_size=None):
+    """A registered kernel, tabulated with table_size + 1 samples if table_size is given."""
+    if name not in KERNELS:
+        raise ValueError(f"unknown kernel {name!r}, one of {', '.join(KERNELS)}")
+    if dims not in (2, 3):
+        raise ValueError("kernels are normalized for 2 or 3 dimensions")
+    kernel = Kernel(name, dims, *KERNELS[name](dims))
+    kernel = kernel.tabulate(table_size) if table_size else kernel
+    # lets a checkpoint record which kernel an engine ran with
+    kernel.value.kernel = kernel.gradient.kernel = (name, dims, table_size or None)
+    return kernel
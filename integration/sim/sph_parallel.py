@@ -0,0 +1,187 @@
+import os
+import traceback
+import weakref
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from neighbor_search import CellList
+from sph_array_engine import SPH_ArrayEngine
+from sph_engine import particle_arrays
+
+
+# Parallel SPH_ArrayEngine. The particle arrays live in shared memory, and a
+# fixed set of worker processes is started once per engine. Every frame the
+# particles are split into slabs along x, worker k always owns slab k, and
+# each phase only sends a tiny command down a pipe; nothing but the
+# simulation constants is pickled per frame.
+
+# every per particle array, with its trailing shape (None -> DIMS)
+SHARED_FIELDS = {
+    "positions": ('float64', (None,)),
+    "velocities": ('float64', (None,)),
+    "predicted_positions": ('float64', (None,)),
+    "densities": ('float64', ()),
+    "pressures": ('float64', ()),
+    "pressure_forces": ('float64', (None,)),
+    "slab_order": ('int64', ()),
+}
+
+# constants a worker needs for a frame, copied over with every new frame
+FRAME_PARAMS = ("time_step", "h", "mass", "target_density", "pressure_coeff",
+                "gravity_force", "collision_damping", "bounds", "pair_block")
+
+
+def attach(specs):
+    """Maps {field: (shm_name, shape, dtype)} to numpy arrays backed by shared memory."""
+    blocks, arrays = [], {}
+    for field, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        arrays[field] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return blocks, arrays
+
+
+def worker_main(conn, specs, kernel, kernel_gradient):
+    """Serves phase commands for one slab until told to stop."""
+    blocks, arrays = attach(specs)
+    engine = SPH_ArrayEngine.__new__(SPH_ArrayEngine)
+    engine.__dict__.update(arrays)
+    engine.kernel, engine.kernel_gradient = kernel, kernel_gradient
+    engine.grid = CellList(1.0)
+
+    owned, pairs = None, None
+    while True:
+        command = conn.recv()
+        if command is None:
+            break
+        phase, args = command
+        try:
+            if phase == "frame":
+                params, lo, hi = args
+                engine.__dict__.update(params)
+                owned = np.array(engine.slab_order[lo:hi], dtype=np.intp)
+                engine.build_grid()
+                pairs = engine.find_pairs(owned)
+            elif phase == "density":
+                engine.calculate_densities(pairs, owned)
+            elif phase == "force":
+                engine.calculate_pressure_forces(pairs, owned)
+            elif phase == "integrate":
+                engine.update_particles(owned)
+            conn.send(None)
+        except Exception:
+            conn.send(traceback.format_exc())
+
+    del engine, arrays
+    for shm in blocks:
+        shm.close()
+
+
+def shutdown(processes, conns, blocks):
+    for conn in conns:
+        try:
+            conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+class SPH_ParallelEngine(SPH_ArrayEngine):
+    def __init__(self, *args, workers=None, **kwargs):
+        workers = workers if workers is not None else os.cpu_count()
+        self.workers = workers if workers is not None else 4
+        self.processes, self.conns, self.blocks = [], [], []
+        self._finalizer = None
+        super().__init__(*args, **kwargs)
+
+    def load_particles(self, particles):
+        """Moves the particle arrays into fresh shared memory, restarting the workers."""
+        self.close()
+        positions, velocities = particle_arrays(particles)
+        N, DIMS = positions.shape
+        for field, (dtype, trailing) in SHARED_FIELDS.items():
+            shape = (N,) + tuple(DIMS if d is None else d for d in trailing)
+            setattr(self, field, np.zeros(shape, dtype=dtype))
+        self.positions[...] = positions
+        self.velocities[...] = velocities
+        self.cached_accelerations = None
+        self.share()
+
+    def share(self):
+        """Copies the (private) particle arrays into fresh shared memory blocks, for a new set of workers."""
+        self.specs = {}
+        for field, (dtype, _) in SHARED_FIELDS.items():
+            private = np.asarray(getattr(self, field), dtype=dtype)
+            nbytes = max(private.nbytes, 1)
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.blocks.append(shm)
+            self.specs[field] = (shm.name, private.shape, dtype)
+            shared = np.ndarray(private.shape, dtype=dtype, buffer=shm.buf)
+            shared[...] = private
+            setattr(self, field, shared)
+        self._finalizer = weakref.finalize(self, shutdown, self.processes, self.conns, self.blocks)
+
+    def start(self):
+        """Starts one long lived worker process per slab."""
+        for _ in range(self.workers):
+            parent, child = mp.Pipe()
+            process = mp.Process(target=worker_main, args=(child, self.specs, self.kernel, self.kernel_gradient), daemon=True)
+            process.start()
+            self.processes.append(process)
+            self.conns.append(parent)
+
+    def close(self):
+        """
+        Stops the workers, the particle state is copied back into private
+        memory first. The engine stays usable, the next update() shares it
+        again and starts new workers.
+        """
+        if self._finalizer is not None and self._finalizer.alive:
+            for field in SHARED_FIELDS:
+                setattr(self, field, np.array(getattr(self, field)))
+            self._finalizer()
+        self.processes, self.conns, self.blocks = [], [], []
+        self._finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run_phase(self, phase, args=None):
+        """Sends a phase to every worker and waits for all of them (a barrier)."""
+        for k, conn in enumerate(self.conns):
+            conn.send((phase, args[k] if args is not None else None))
+        errors = [conn.recv() for conn in self.conns]
+        for error in errors:
+            if error is not None:
+                raise RuntimeError(f"SPH worker failed in {phase} phase:\n{error}")
+
+    def compute_forces(self, lookahead):
+        if not self.processes:
+            if self._finalizer is None:
+                # closed, the state is private again
+                self.share()
+            self.start()
+
+        self.predict_positions(lookahead)
+        # spatial slabs: equal particle counts, split along x
+        self.slab_order[...] = np.argsort(self.predicted_positions[:, 0], kind='stable')
+        N = len(self)
+        edges = np.linspace(0, N, self.workers + 1).astype(int)
+        params = {name: getattr(self, name) for name in FRAME_PARAMS}
+        self.run_phase("frame", [(params, edges[k], edges[k + 1]) for k in range(self.workers)])
+
+        self.run_phase("density")
+        # densities must all be known before any force is computed
+        self.run_phase("force")
+
+    def integrate(self):
+        self.run_phase("integrate")
@@ -0,0 +1,238 @@
+import argparse
+import json
+import sys
+import time
+from dataclasses import dataclass, fields, replace, asdict
+from functools import lru_cache
+import numpy as np
+from sph_binary16 import ADDER_LATENCY, replay_accumulator
+
+
+# Cycle-approximate model of one simulator.sv frame, for sizing the design
+# without running Icarus. It follows the RTL's control flow, not its data:
+#
+#   scheduler   per particle and phase, N + 12 cycles in DENSITIES/FORCES
+#               issuing the N pair tasks, then PART_DONE until the
+#               accumulator is done, so compute drains between particles
+#   compute     each task's latency through calc_distance and the density
+#               (calc_spiky_kernel) or force path
+#   accumulator elem_accumulator.sv's drain after the last term, replayed
+#               with sph_binary16.replay_accumulator (it stops growing once
+#               N is a few adder latencies long)
+#   accum       the density reciprocal (binary16_div) or force readout
+#   update      particle_updater for the last particle and the
+#               update_buffer swap of all N
+#   lanes       with COMPUTE_LANES, every sweep but the first of a phase
+#               issues ceil(N / lanes) groups of tasks and lane_merge.sv's
+#               adder tree adds log2(lanes) adders to the task latency
+#
+# The latencies default to the constants of compute.sv and the binary16
+# units, every field of PipelineParams may be a NumPy array to evaluate many
+# design points at once. What the structure misses is taken up by two
+# offsets, per particle and phase and per frame, fit by calibrate() to
+# frame_cycles measured in cocotb (test_simulator writes them with
+# FRAME_REPORT).
+
+CLOCK_HZ = 100e6 # clk_in of the FPGA design
+TARGET_FPS = 60
+RAM_DEPTH = 128 # particle BRAMs of simulator.sv, the particle count can't exceed it today
+MAX_PARTICLES = (1 << 16) - 1 # COUNTER_SIZE of the scheduler
+
+SCHEDULER_SLACK = 12 # cycles in DENSITIES/FORCES past the N tasks
+TRANSITIONS = 2 # DONE -> INIT -> DENSITIES per frame
+DENSITY_HANDSHAKE = 3 # done_accumulating after the reciprocal is stored
+FORCE_READOUT = 4 # accum_storage outputting both force components
+UPDATER_OVERHEAD = 3
+SWAP_OVERHEAD = 3
+
+
+@dataclass(frozen=True)
+class PipelineParams:
+    adder: int = 4 # ADDER_CYCLES
+    multi: int = 4 # MULTI_CYCLES
+    sqrt: int = 12 # SQRT_CYCLES
+    div: int = 25 # binary16_div_pipelined of the force path
+    recip_div: int = 23 # binary16_div of the density reciprocal
+    kernel: int = 12 # calc_spiky_kernel, density task
+    accum_adder: int = ADDER_LATENCY # elem_accumulator issuing an add to seeing its result
+    updater_steps: int = 8 # arithmetic states of particle_updater, each waits for its unit
+    lanes: int = 1 # COMPUTE_LANES, a power of two
+    particle_overhead: float = 0.0 # calibrated, cycles per particle and phase
+    frame_overhead: float = 0.0 # calibrated, cycles per frame
+
+    @classmethod
+    def grid(cls, **axes):
+        """Params over the cartesian product of axes (field -> values), every field an array of the grid's shape."""
+        names = list(axes)
+        values = np.meshgrid(*(np.asarray(axes[name]) for name in names), indexing='ij')
+        return cls(**dict(zip(names, values)))
+
+
+DEFAULT_PARAMS = PipelineParams()
+
+
+@lru_cache(maxsize=None)
+def drain_table(latency):
+    """Accumulator drain for 0, 1, ... terms until it stops changing, the last entry holds for any longer run."""
+    drains = [0]
+    n = 1
+    # a new add tree level every few latencies, a flat run of 8 latencies is the limit
+    while n < 8 * latency or len(set(drains[-8 * latency:])) > 1:
+        drains.append(replay_accumulator(n, latency)[2] - n)
+        n += 1
+    return np.array(drains, dtype=np.int64)
+
+
+def accumulator_drain(n, latency=ADDER_LATENCY):
+    """Cycles from the last term entering elem_accumulator to its sum, for n terms."""
+    n, latency = np.broadcast_arrays(np.asarray(n, dtype=np.int64), np.asarray(latency, dtype=np.int64))
+    drain = np.zeros(n.shape, dtype=np.int64)
+    for value in np.unique(latency):
+        table = drain_table(int(value))
+        mask = latency == value
+        drain[mask] = table[np.minimum(n[mask], len(table) - 1)]
+    return drain
+
+
+def distance_latency(dims, p=DEFAULT_PARAMS):
+    """calc_distance: subtract, square, an adder tree over dims, sqrt."""
+    levels = np.ceil(np.log2(np.asarray(dims)))
+    return p.adder + p.multi + levels * p.adder + p.sqrt
+
+
+def task_latency(dims, p=DEFAULT_PARAMS):
+    """(density, force) cycles from valid_task to the term at the accumulator."""
+    distance = distance_latency(dims, p)
+    density = distance + p.kernel + 1
+    force = distance + p.div + 2 * p.multi + p.adder + 1
+    return density, force
+
+
+def phase_cycles(particles, dims=2, p=DEFAULT_PARAMS):
+    """
+    Cycles of every phase of a frame, as a dict of arrays broadcast over
+    particles, dims and the fields of p: density, force, update (the last
+    particle_updater), readout (the update_buffer swap) and total.
+    """
+    n = np.asarray(particles, dtype=np.int64)
+    lanes = np.asarray(p.lanes, dtype=np.int64)
+    density_latency, force_latency = task_latency(dims, p)
+    merge = np.log2(lanes) * p.adder
+
+    def sweeps(latency, readout):
+        def sweep(terms):
+            # the state machine leaves DENSITIES/FORCES one cycle after the last task
+            drain = accumulator_drain(terms, p.accum_adder) + 1
+            return terms + SCHEDULER_SLACK + latency + merge - 1 + drain + readout + 1 + p.particle_overhead
+        # particle 0 goes through lane 0 alone, filling the scheduler's cache
+        return sweep(n) + (n - 1) * sweep(-(-n // lanes))
+
+    density = sweeps(density_latency, p.recip_div + DENSITY_HANDSHAKE)
+    force = sweeps(force_latency, FORCE_READOUT)
+    update = p.updater_steps * (np.maximum(p.adder, p.multi) + 1) + UPDATER_OVERHEAD
+    readout = n + SWAP_OVERHEAD
+    total = TRANSITIONS + density + force + update + readout + p.frame_overhead
+    return {name: np.broadcast_to(value, np.shape(total)) for name, value in
+            dict(density=density, force=force, update=update, readout=readout, total=total).items()}
+
+
+def frame_cycles(particles, dims=2, p=DEFAULT_PARAMS):
+    """Predicted clock cycles of one frame."""
+    return phase_cycles(particles, dims, p)["total"]
+
+
+def fps(particles, dims=2, p=DEFAULT_PARAMS, clock_hz=CLOCK_HZ):
+    return clock_hz / frame_cycles(particles, dims, p)
+
+
+def max_particles(target_fps=TARGET_FPS, clock_hz=CLOCK_HZ, dims=2, p=DEFAULT_PARAMS, limit=MAX_PARTICLES):
+    """
+    The largest particle count (up to limit) whose frames still meet
+    target_fps, broadcast over the fields of p. 0 where even one particle
+    is too slow.
+    """
+    budget = clock_hz / target_fps
+    # frame_cycles grows with the particle count, bisect for the last one in budget
+    lo = np.zeros(np.shape(frame_cycles(1, dims, p)), dtype=np.int64)
+    hi = np.full_like(lo, limit + 1)
+    while np.any(hi - lo > 1):
+        mid = (lo + hi) // 2
+        fits = frame_cycles(mid, dims, p) <= budget
+        lo = np.where(fits, mid, lo)
+        hi = np.where(fits, hi, mid)
+    return lo
+
+
+def calibrate(measurements, p=DEFAULT_PARAMS):
+    """
+    Fits particle_overhead and frame_overhead of p to measurements, dicts
+    with particles, dims, lanes and frame_cycles (the lines FRAME_REPORT gets from
+    test_simulator). Only frame_overhead is fit unless the measurements span
+    more than one particle count. Returns the calibrated params.
+    """
+    measurements = list(measurements)
+    if not measurements:
+        raise ValueError("calibrate needs at least one measurement")
+    n = np.array([m["particles"] for m in measurements], dtype=np.float64)
+    dims = np.array([m.get("dims", 2) for m in measurements])
+    lanes = np.array([m.get("lanes", p.lanes) for m in measurements])
+    measured = np.array([m["frame_cycles"] for m in measurements], dtype=np.float64)
+    base = replace(p, lanes=lanes, particle_overhead=0.0, frame_overhead=0.0)
+    residual = measured - frame_cycles(n.astype(np.int64), dims, base)
+    if len(np.unique(n)) > 1:
+        (per_particle, per_frame), *_ = np.linalg.lstsq(np.stack([2 * n, np.ones_like(n)], axis=1), residual, rcond=None)
+    else:
+        per_particle, per_frame = 0.0, residual.mean()
+    return replace(p, particle_overhead=float(per_particle), frame_overhead=float(per_frame))
+
+
+def load_measurements(path):
+    """Measurements from a JSON list or JSON lines file."""
+    with open(path) as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def benchmark(points, dims=2, seed=0):
+    """Design points per second of frame_cycles over points random latency combinations."""
+    rng = np.random.default_rng(seed)
+    p = PipelineParams(**{f.name: rng.integers(1, 2 * max(int(f.default), 1) + 1, size=points)
+                          for f in fields(PipelineParams) if not f.name.endswith("overhead") and f.name != "lanes"},
+                       lanes=1 << rng.integers(0, 4, size=points))
+    n = rng.integers(1, RAM_DEPTH + 1, size=points)
+    start = time.perf_counter()
+    frame_cycles(n, dims, p)
+    return points / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict simulator.sv cycles per frame without simulating it.")
+    parser.add_argument("--particles", type=int, nargs="+", default=[16, 32, 64, RAM_DEPTH])
+    parser.add_argument("--dims", type=int, default=2)
+    parser.add_argument("--clock-mhz", type=float, default=CLOCK_HZ / 1e6)
+    parser.add_argument("--fps", type=float, default=TARGET_FPS, help="target frame rate for the particle limit")
+    parser.add_argument("--calibrate", metavar="MEASUREMENTS", help="JSON (lines) of particles, dims, frame_cycles")
+    parser.add_argument("--set", nargs="*", default=[], metavar="FIELD=CYCLES", help="override latency parameters")
+    parser.add_argument("--benchmark", type=int, metavar="POINTS", help="time frame_cycles over random design points")
+    args = parser.parse_args()
+
+    p = replace(DEFAULT_PARAMS, **{name: float(value) if name.endswith("overhead") else int(value)
+                                   for name, value in (s.split("=") for s in args.set)})
+    if args.calibrate:
+        p = calibrate(load_measurements(args.calibrate), p)
+    if args.benchmark:
+        print(f"{benchmark(args.benchmark, args.dims):.0f} design points/s", file=sys.stderr)
+
+    clock_hz = args.clock_mhz * 1e6
+    limit = int(max_particles(args.fps, clock_hz, args.dims, p))
+    print(json.dumps({
+        "params": asdict(p),
+        "dims": args.dims,
+        "frames": [{"particles": n, "fps": float(fps(n, args.dims, p, clock_hz)),
+                    **{name: float(c) for name, c in phase_cycles(n, args.dims, p).items()}}
+                   for n in args.particles],
+        "max_particles": {"fps": args.fps, "clock_mhz": args.clock_mhz, "particles": limit,
+                          "fits_ram": limit <= RAM_DEPTH},
+    }, indent=2))
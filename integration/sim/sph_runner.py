@@ -0,0 +1,252 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from sph_engine import (SPH_Engine, Particle, generate_random_particles, generate_lattice_particles,
+                        generate_grid_particles_in_rectangle, smoothing_kernel, smoothing_kernel_gradient)
+
+
+# Headless runs of the SPH engines: build an engine from a scenario, advance
+# it as fast as it goes, and stream every frame to disk from a background
+# thread while the next one computes. No pygame and no frame rate cap.
+
+# the constants of the sph_engine.py / test_simulator.py demo
+DEFAULT_SCENARIO = {
+    "engine": "SPH_Engine",
+    "engine_args": {},
+    # the number of bounds sets the dimensions, 2 or 3
+    "particles": {"generator": "random", "count": 64, "bounds": [1.0, 1.0]},
+    "seed": 0,
+    "mass": 1.0,
+    "time_step": 1 / 30,
+    "h": 0.25,
+    "target_density": 2.0,
+    "pressure_coeff": 8.0,
+    "gravitational_constant": -12.0,
+    "bounds": [2.0, 2.0],
+    "collision_damping": 0.55,
+    # an sph_kernels name, None for the engines' own smoothing_kernel
+    "kernel": None,
+    "kernel_table": None,
+}
+
+
+def load_scenario(path=None, **overrides):
+    """A scenario dict: DEFAULT_SCENARIO, updated from a JSON file and then overrides."""
+    scenario = dict(DEFAULT_SCENARIO)
+    if path is not None:
+        scenario.update(json.loads(Path(path).read_text()))
+    scenario.update({k: v for k, v in overrides.items() if v is not None})
+    return scenario
+
+
+def make_particles(spec):
+    kind = spec["generator"]
+    if kind == "random":
+        return generate_random_particles(spec["count"], spec["bounds"])
+    if kind == "grid":
+        shape = spec["shape"] if "shape" in spec else (spec["rows"], spec["cols"])
+        return generate_lattice_particles(shape, spec["spacing"], spec["bounds"])
+    if kind == "rectangle":
+        return generate_grid_particles_in_rectangle(spec["count"], spec["rect"])
+    if kind == "mem":
+        # a particle image, e.g. a particle.mem or an RTL dump
+        import mem_image
+        positions, velocities = mem_image.read_particles(spec["path"], spec.get("dims", 2))
+        return [Particle(p, v) for p, v in zip(positions, velocities)]
+    raise ValueError(f"unknown particle generator {kind!r}")
+
+
+def engine_class(name):
+    if name == "SPH_Engine":
+        return SPH_Engine
+    if name == "SPH_ArrayEngine":
+        from sph_array_engine import SPH_ArrayEngine
+        return SPH_ArrayEngine
+    if name == "SPH_ParallelEngine":
+        from sph_parallel import SPH_ParallelEngine
+        return SPH_ParallelEngine
+    raise ValueError(f"unknown engine {name!r}")
+
+
+def make_engine(scenario):
+    np.random.seed(scenario["seed"])
+    particles = make_particles(scenario["particles"])
+    kernel, kernel_gradient = smoothing_kernel, smoothing_kernel_gradient
+    if scenario.get("kernel") is not None:
+        from sph_kernels import get_kernel
+        named = get_kernel(scenario["kernel"], table_size=scenario.get("kernel_table"))
+        kernel, kernel_gradient = named.value, named.gradient
+    return engine_class(scenario["engine"])(
+        particles,
+        mass=scenario["mass"],
+        time_step=scenario["time_step"],
+        h=scenario["h"],
+        kernel=kernel,
+        kernel_gradient=kernel_gradient,
+        target_density=scenario["target_density"],
+        pressure_coeff=scenario["pressure_coeff"],
+        gravitational_constant=scenario["gravitational_constant"],
+        bounds=tuple(scenario["bounds"]),
+        collision_damping=scenario["collision_damping"],
+        **scenario["engine_args"])
+
+
+def snapshot(engine):
+    """Copies of the (N, DIMS) positions and velocities of any of the engines."""
+    if hasattr(engine, "positions"):
+        return engine.positions.copy(), engine.velocities.copy()
+    positions = np.array([p.position for p in engine.particles], dtype='float64')
+    velocities = np.array([p.velocity for p in engine.particles], dtype='float64')
+    return positions, velocities
+
+
+class TrajectoryWriter:
+    """
+    Streams frames into out_dir/positions.npy and out_dir/velocities.npy,
+    each a (frames, N, DIMS) .npy memmap. write() only queues a frame, a
+    writer thread copies it into the files and flushes every chunk frames.
+    The queue is bounded, so a slow disk holds the simulation back instead
+    of buffering the whole run in memory.
+    """
+
+    def __init__(self, out_dir, frames, shape, dtype='float64', chunk=64, depth=8):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.files = {
+            field: np.lib.format.open_memmap(self.out_dir / f"{field}.npy", mode='w+', dtype=dtype, shape=(frames,) + tuple(shape))
+            for field in ("positions", "velocities")
+        }
+        self.chunk = chunk
+        self.frames = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=depth)
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, positions, velocities = item
+            try:
+                self.files["positions"][frame] = positions
+                self.files["velocities"][frame] = velocities
+                if (frame + 1) % self.chunk == 0:
+                    self.flush()
+            except Exception as e:
+                self.error = e
+
+    def flush(self):
+        for array in self.files.values():
+            array.flush()
+
+    def write(self, positions, velocities):
+        """Queues the next frame, positions and velocities must not be modified afterwards."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((self.frames, positions, velocities))
+        self.frames += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.flush()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run(engine, frames, out_dir=None, every=1, dtype='float64', log=None,
+        checkpoint_dir=None, checkpoint_every=0, start_frame=0):
+    """
+    Advances engine by frames frames. With out_dir, the initial state and
+    every every-th frame after it are streamed to disk. With checkpoint_dir,
+    the engine is checkpointed to checkpoint_dir/frame_<n> every
+    checkpoint_every frames and after the last one, frames counted from
+    start_frame. Returns the number of frames per second the engine ran at.
+    The engine stays open, closing it (SPH_ParallelEngine's workers) is up
+    to the caller.
+    """
+    writer, checkpoints = None, None
+    if checkpoint_dir is not None:
+        from sph_checkpoint import CheckpointWriter
+        checkpoints = CheckpointWriter()
+    if out_dir is not None:
+        positions, velocities = snapshot(engine)
+        writer = TrajectoryWriter(out_dir, frames // every + 1, positions.shape, dtype=dtype)
+        writer.write(positions, velocities)
+
+    start = time.perf_counter()
+    try:
+        for frame in range(1, frames + 1):
+            engine.update()
+            if writer is not None and frame % every == 0:
+                writer.write(*snapshot(engine))
+            if checkpoints is not None and (frame == frames or checkpoint_every and frame % checkpoint_every == 0):
+                checkpoints.save(engine, Path(checkpoint_dir) / f"frame_{start_frame + frame:06d}", start_frame + frame)
+            if log is not None and frame % 100 == 0:
+                log(f"frame {frame}/{frames}, {frame / (time.perf_counter() - start):.1f} frames/s")
+    finally:
+        elapsed = time.perf_counter() - start
+        if writer is not None:
+            writer.close()
+        if checkpoints is not None:
+            checkpoints.close()
+    return frames / elapsed if elapsed > 0 else float('inf')
+
+
+def load_trajectory(out_dir):
+    """(positions, velocities) of a run, memory-mapped read only."""
+    out_dir = Path(out_dir)
+    return (np.load(out_dir / "positions.npy", mmap_mode='r'),
+            np.load(out_dir / "velocities.npy", mmap_mode='r'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an SPH scenario headless and stream the frames to disk.")
+    parser.add_argument("scenario", nargs="?", help="JSON file of scenario settings, see DEFAULT_SCENARIO")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--out", help="directory for positions.npy and velocities.npy")
+    parser.add_argument("--every", type=int, default=1, help="keep every n-th frame")
+    parser.add_argument("--engine", help="SPH_Engine, SPH_ArrayEngine or SPH_ParallelEngine")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--kernel", help="spiky, poly6, cubic or wendland (sph_kernels)")
+    parser.add_argument("--kernel-table", type=int, help="tabulate the kernel with this many intervals")
+    parser.add_argument("--integrator", help="symplectic_euler, leapfrog or velocity_verlet (sph_integrators)")
+    parser.add_argument("--adaptive", action="store_true", help="CFL controlled substeps")
+    parser.add_argument("--dtype", default="float64", help="dtype of the stored frames")
+    parser.add_argument("--resume", help="start from this checkpoint (sph_checkpoint) instead of the scenario")
+    parser.add_argument("--checkpoint-dir", help="directory for frame_<n> checkpoints, the last frame is always saved")
+    parser.add_argument("--checkpoint-every", type=int, default=0)
+    args = parser.parse_args()
+
+    scenario = load_scenario(args.scenario, engine=args.engine, seed=args.seed,
+                             kernel=args.kernel, kernel_table=args.kernel_table)
+    if args.integrator is not None:
+        scenario["engine_args"] = dict(scenario["engine_args"], integrator=args.integrator)
+    if args.adaptive:
+        scenario["engine_args"] = dict(scenario["engine_args"], adaptive=True)
+    start_frame = 0
+    if args.resume:
+        import sph_checkpoint
+        engine = sph_checkpoint.restore(args.resume, engine_class(args.engine) if args.engine else None)
+        start_frame = sph_checkpoint.load(args.resume).frame
+    else:
+        engine = make_engine(scenario)
+    try:
+        fps = run(engine, args.frames, args.out, every=args.every, dtype=args.dtype, log=print,
+                  checkpoint_dir=args.checkpoint_dir, checkpoint_every=args.checkpoint_every, start_frame=start_frame)
+        print(f"{args.frames} frames of {len(snapshot(engine)[0])} particles, {fps:.1f} frames/s")
+    finally:
+        if hasattr(engine, "close"):
+            engine.close()
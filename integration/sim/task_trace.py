@@ -0,0 +1,155 @@
+import json
+import struct
+from pathlib import Path
+import numpy as np
+import cocotb
+from cocotb.triggers import RisingEdge, ReadOnly
+
+
+# Traces of the task stream scheduler.sv hands compute.sv in a simulator
+# run, to replay into compute alone (test_compute with TASK_TRACE set)
+# instead of simulating the whole top level again. test_compute records
+# and replays a short trace of its own on every run.
+#
+# A trace is one file: MAGIC, the length of a JSON header as a little
+# endian uint32, the header (compute's parameters, gravitational_constant,
+# DIMS, the task count), then one fixed size record per task in issue
+# order: task_type, the task_data words {x_i, x_j, P_i, P_j, rho_j_recip}
+# most significant first, and the data_out words compute gave for it in the
+# recorded run. 19 bytes a task in 2D. Records are loaded memory-mapped.
+#
+# compute's output mux follows the type of the last task in, so a replay
+# leaves PHASE_GAP idle clocks wherever the type changes, like the
+# scheduler's PART_DONE does.
+
+MAGIC = b"TASKTRC1"
+TASK_WIDTH = 16 * 7
+PHASE_GAP = 96 # longer than the force path of compute
+COMPUTE_PARAMETERS = ("H", "KERNEL_COEFF", "DIV_KERNEL_COEFF", "DIMS")
+LOGGED_MISMATCHES = 10
+
+
+def record_dtype(dims, task_width=TASK_WIDTH):
+    return np.dtype([("type", "u1"), ("data", "<u2", (task_width // 16,)), ("result", "<u2", (dims,))])
+
+
+def to_words(value, count):
+    """An int as count 16 bit words, most significant first."""
+    return [(value >> (16 * (count - 1 - w))) & 0xFFFF for w in range(count)]
+
+
+def from_words(words):
+    value = 0
+    for word in words:
+        value = (value << 16) | int(word)
+    return value
+
+
+def save(path, records, header):
+    """Writes records (of record_dtype) with a header dict, returns the path."""
+    path = Path(path)
+    header = dict(header, count=len(records))
+    text = json.dumps(header).encode()
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(text)))
+        f.write(text)
+        f.write(np.ascontiguousarray(records).tobytes())
+    return path
+
+
+def load(path):
+    """(header, records) of a trace, the records memory-mapped."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a task trace")
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length))
+    offset = len(MAGIC) + 4 + length
+    dtype = record_dtype(header["dims"], header.get("task_width", TASK_WIDTH))
+    if header["count"] == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(header["count"],))
+
+
+def parameters(path):
+    """The compute.sv parameters a trace was recorded with, for the replay build."""
+    return load(path)[0]["parameters"]
+
+
+class TaskRecorder:
+    """
+    Records every task into compute (valid_task, task_type, task_data) of a
+    simulator dut and compute's result for it (receiver_valid,
+    receiver_data), from start() on. The data and result signals are named
+    by task_data, result and result_valid, compute's own ports for a
+    compute dut.
+    """
+
+    def __init__(self, dut, dims=2, task_data="task_data", result="receiver_data", result_valid="receiver_valid"):
+        self.dut = dut
+        self.dims = dims
+        self.signals = task_data, result, result_valid
+        self.tasks = []
+        self.results = []
+        self.task = None
+
+    def start(self):
+        self.task = cocotb.start_soon(self.run())
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.kill()
+            self.task = None
+
+    async def run(self):
+        dut = self.dut
+        task_data, result, result_valid = (getattr(dut, name) for name in self.signals)
+        while True:
+            await RisingEdge(dut.clk_in)
+            await ReadOnly()
+            if dut.valid_task.value == 1:
+                self.tasks.append((int(dut.task_type.value), int(task_data.value)))
+            if result_valid.value == 1:
+                self.results.append(int(result.value))
+
+    def records(self):
+        """The tasks with a result so far, as record_dtype records."""
+        count = min(len(self.tasks), len(self.results))
+        records = np.zeros(count, dtype=record_dtype(self.dims))
+        for k, ((task_type, data), result) in enumerate(zip(self.tasks, self.results)):
+            records[k] = (task_type, to_words(data, TASK_WIDTH // 16), to_words(result, self.dims))
+        return records
+
+    def save(self, path, parameters):
+        """Saves the trace, parameters the simulator's (the COMPUTE_PARAMETERS of it are kept)."""
+        header = {
+            "parameters": {name: parameters[name] for name in COMPUTE_PARAMETERS if name in parameters},
+            "gravitational_constant": int(self.dut.gravitational_constant.value),
+            "dims": self.dims,
+            "task_width": TASK_WIDTH,
+            "pending": len(self.tasks) - len(self.results),
+        }
+        return save(path, self.records(), header)
+
+
+def rows(records):
+    """Driver rows [task_type, task_data] of the records, PHASE_GAP idle clocks between task types."""
+    last = None
+    for record in records:
+        if last is not None and record["type"] != last:
+            yield from [None] * PHASE_GAP
+        last = record["type"]
+        yield [int(record["type"]), from_words(record["data"])]
+
+
+def check(log, records, results):
+    """Compares replayed results (ints) with the recorded ones, logs the first mismatches and asserts."""
+    expected = np.array([from_words(r) for r in records["result"]], dtype=np.int64)
+    results = np.asarray(results, dtype=np.int64).reshape(len(expected))
+    mismatches = np.flatnonzero(results != expected)
+    for k in mismatches[:LOGGED_MISMATCHES]:
+        log.error(f"task {k} (type {records['type'][k]}, data {from_words(records['data'][k]):028x}): "
+                  f"got {results[k]:08x}, recorded {expected[k]:08x}")
+    assert not len(mismatches), f"{len(mismatches)} of {len(expected)} replayed results differ from the trace"
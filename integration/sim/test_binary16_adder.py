@@ -2,105 +2,69 @@ import cocotb
 import os
 import random
 import sys
-from math import log
-import logging
 from pathlib import Path
-from cocotb.clock import Clock
-from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
-from cocotb.utils import get_sim_time as gst
+from cocotb.triggers import RisingEdge, ReadOnly
 from cocotb.runner import get_runner
+from build_cache import cached_build, waves_enabled
 import numpy as np
-
-def rep(val):
-    return eval(f"0b{float32_to_binary16(val).view(np.uint16):016b}")
-
-def float32_to_binary16(val):
-    """Convert a 32-bit floating point number to a binary16 value."""
-    return np.float16(val)
-
-def half(val):
-    """Convert a binary16 number to a floating point number."""
-    sign = (val >> 15) & 0x1
-    exponent = (val >> 10) & 0x1F
-    fraction = val & 0x3FF
-
-    if exponent == 0:
-        if fraction == 0:
-            return 0.0
-        else:
-            return (-1)**sign * 2**(-14) * (fraction / 1024)
-    elif exponent == 0x1F:
-        if fraction == 0:
-            return float('inf') if sign == 0 else float('-inf')
-        else:
-            return float('nan')
-    else:
-        return (-1)**sign * 2**(exponent - 15) * (1 + fraction / 1024)
-    
-def float_to_binary16_int_rep(val):
-    return eval(f"0b{float32_to_binary16(val).view(np.uint16):016b}")
+from binary16_codec import half
+from binary16 import AdderPipeline, ADDER_LATENCY, add
+from binary16_harness import reset
+from pipeline_stream import stream
 
 MODULE = "binary16_adder"
 PARAMETERS = {}
 SOURCES = [f"{MODULE}.sv"]
 
+# corner operands: zeros, smallest and largest normals, ones, subnormals,
+# infinities and NaNs, each crossed with every other
+CORNERS = [0x0000, 0x8000, 0x0400, 0x8400, 0x7BFF, 0xFBFF, 0x3C00, 0xBC00, 0x3BFF, 0xBBFF,
+           0x3C01, 0xBC01, 0x0001, 0x83FF, 0x7C00, 0xFC00, 0x7E00, 0x4000, 0x5BFF, 0x1400]
+
+def stimuli(count=2000):
+    """(a, b, data_valid_in) every clock: the corners crossed, random bit patterns, near cancellations, some bubbles."""
+    pairs = [(a, b) for a in CORNERS for b in CORNERS]
+    pairs += [(random.getrandbits(16), random.getrandbits(16)) for _ in range(count)]
+    for _ in range(count // 4):
+        # b close to -a, the sum cancels most of the mantissa
+        a = random.getrandbits(15)
+        pairs.append((a, (a + random.randint(-4, 4)) & 0x7FFF | 0x8000))
+    return [(a, b, random.random() > 0.1) for a, b in pairs]
+
+async def lockstep(dut, model):
+    """Clocks model with what dut captures at every edge, checks data_valid_out, busy and result against it."""
+    while True:
+        await RisingEdge(dut.clk_in)
+        # inputs only change at falling edges, these are the values just captured
+        result, data_valid_out, busy = model.clock(int(dut.a.value), int(dut.b.value), dut.data_valid_in.value == 1)
+        await ReadOnly()
+        assert dut.data_valid_out.value == data_valid_out, f"data_valid_out {dut.data_valid_out.value}, expected {int(data_valid_out)}"
+        assert dut.busy.value == busy, f"busy {dut.busy.value}, expected {int(busy)}"
+        assert int(dut.result.value) == int(result), f"result {int(dut.result.value):04x}, expected {int(result):04x}"
+
 @cocotb.test
 async def test(dut):
-    """Test binary16_adder with some 16-bit floating point numbers"""
+    """Test binary16_adder against binary16.add, with binary16.AdderPipeline checked clock by clock"""
     dut._log.info("Starting binary16_adder test...")
-    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
-    
-    dut.rst.value = 1
-    await ClockCycles(dut.clk_in, 3)
-    dut.rst.value = 0
-    
-    test_vectors = []
+    dut.a.value = 0
+    dut.b.value = 0
+    await reset(dut)
+    checker = cocotb.start_soon(lockstep(dut, AdderPipeline()))
 
-    for _ in range(5):
-        a = float32_to_binary16(random.uniform(-10.0, 10.0))
-        b = float32_to_binary16(random.uniform(-10.0, 10.0))
-        # a = float32_to_binary16(3.1)
-        # b = float32_to_binary16(2.5)
-        a_rep = eval(f"0b{a.view(np.uint16):016b}")
-        b_rep = eval(f"0b{b.view(np.uint16):016b}")
-        expected_sum = a + b
-        dut._log.info(f"a={hex(a.view(np.uint16))}, b={hex(b.view(np.uint16))}, res={hex(expected_sum.view(np.uint16))}")
-        test_vectors.append((a_rep, b_rep, expected_sum))
+    vectors = stimuli()
+    rows = [(a, b) if valid else None for a, b, valid in vectors]
+    results, report = await stream(dut, ("a", "b"), rows, latency=ADDER_LATENCY, name=MODULE)
+    checker.kill()
 
-    # New input after every completion
-    # for a, b, expected_sum in test_vectors:
-    #     dut.a.value = int(a)
-    #     dut.b.value = int(b)
-    #     dut.data_valid_in.value = 1
-    #     await ClockCycles(dut.clk_in, 1)
-    #     dut.data_valid_in.value = 0
-    #     await RisingEdge(dut.data_valid_out)
-    #     value = dut.result.value
-    #     print(f"a={half(a)}, b={half(b)}: expected {expected_sum}, got {value,half(value)}")
-    # await ClockCycles(dut.clk_in, 3)
+    pairs = np.array([row for row in rows if row is not None], dtype=np.uint16)
+    expected = add(pairs[:, 0], pairs[:, 1])
+    mismatches = np.flatnonzero(results[:, 0] != expected)
+    for i in mismatches[:10]:
+        dut._log.error(f"{pairs[i, 0]:04x} + {pairs[i, 1]:04x}: got {results[i, 0]:04x} ({half(results[i, 0])}), "
+                       f"expected {expected[i]:04x} ({half(expected[i])})")
+    assert len(mismatches) == 0, f"{len(mismatches)} of {len(pairs)} sums differ from binary16.add"
+    dut._log.info(f"{len(pairs)} sums match binary16.add")
 
-    outputs = []
-    # New inputs every clock cycle
-    dut.data_valid_in.value = 1
-    for a, b, expected_sum in test_vectors:
-        dut.a.value = int(a)
-        dut.b.value = int(b)
-        await ClockCycles(dut.clk_in, 1)
-        if dut.data_valid_out.value == 1:
-            value = dut.result.value
-            outputs.append(value)
-        dut._log.info(f"a={half(a)}, b={half(b)}: expected {float32_to_binary16(expected_sum).view(np.uint16):016b}, {expected_sum}")
-    
-    dut.data_valid_in.value = 0
-    for _ in range(6):
-        await ClockCycles(dut.clk_in, 1)
-        if dut.data_valid_out.value == 1:
-            value = dut.result.value
-            outputs.append(value)
-            
-    await ClockCycles(dut.clk_in, len(test_vectors) + 6 + 3)
-    dut._log.info(f"Outputs: {[(half(o), o) for o in outputs]}")
-    
 def test_runner():
     hdl_toplevel_lang = os.getenv("HDL_TOPLEVEL_LANG", "verilog")
     sim = os.getenv("SIM", "icarus")
@@ -111,14 +75,16 @@ def test_runner():
     parameters = PARAMETERS #setting parameter to a short amount (for testing)
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel=f"{MODULE}",
-        always=True,
         build_args=build_test_args,
         parameters=parameters,
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
@@ -126,7 +92,7 @@ def test_runner():
         hdl_toplevel_lang=hdl_toplevel_lang, # check this
         test_module=f"test_{MODULE}",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":
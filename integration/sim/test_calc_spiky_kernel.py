@@ -2,62 +2,55 @@ import cocotb
 import os
 import random
 import sys
-from math import log
-import logging
 from pathlib import Path
-from cocotb.clock import Clock
-from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
-from cocotb.utils import get_sim_time as gst
+from types import SimpleNamespace
 from cocotb.runner import get_runner
-from test_funcs import *
-from numpy import pi
+from build_cache import cached_build, waves_enabled
+import numpy as np
+from binary16 import ADDER_LATENCY, MULTI_LATENCY, SIGN, mul
+from binary16_codec import float32_to_binary16, half
+from binary16_harness import reset
+from pipeline_stream import stream
+from sph_binary16 import density_terms, kernel_difference
 
 MODULE = "calc_spiky_kernel"
 PARAMETERS = {} # utilizing H = 0.35f
+H = 0.35
 SOURCES = [f"{MODULE}.sv", "binary16_adder.sv", "binary16_multi.sv"]
 
+CONSTANTS = SimpleNamespace(h=0x359A, kernel_coeff=0x57F4, div_kernel_coeff=0x5BF4) # the module defaults
+DENSITY_LATENCY = ADDER_LATENCY + 2 * MULTI_LATENCY # diff, diff_sq, coeff
+GRADIENT_LATENCY = ADDER_LATENCY + MULTI_LATENCY # diff, deriv_coeff
+
+def distances(count=2000):
+    """r across the kernel and past it, plus 0 and the patterns around H."""
+    r = [float32_to_binary16(random.uniform(0, 2 * H)).view(np.uint16) for _ in range(count)]
+    return np.array(r + [0, CONSTANTS.h - 1, CONSTANTS.h, CONSTANTS.h + 1], dtype=np.uint16)
+
+async def check_task(dut, is_density):
+    """Streams distances with is_density_task held, checks every result against sph_binary16."""
+    r = distances()
+    dut.is_density_task.value = int(is_density)
+    results, report = await stream(dut, ("r",), [(x,) for x in r.tolist()], name=MODULE,
+                                   latency=DENSITY_LATENCY if is_density else GRADIENT_LATENCY)
+    if is_density:
+        expected = density_terms(r, CONSTANTS)
+    else:
+        expected = mul(kernel_difference(r, CONSTANTS) ^ SIGN, CONSTANTS.div_kernel_coeff)
+    mismatches = np.flatnonzero(results[:, 0] != expected)
+    for i in mismatches[:10]:
+        dut._log.error(f"r={half(r[i])}: got {results[i, 0]:04x} ({half(results[i, 0])}), expected {expected[i]:04x} ({half(expected[i])})")
+    assert len(mismatches) == 0, f"{len(mismatches)} of {len(r)} {'density' if is_density else 'gradient'} terms differ from the model"
+
 @cocotb.test
 async def test_a(dut):
+    """Stream distances through calc_spiky_kernel, density then gradient tasks"""
     dut._log.info("Starting...")
-    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
-    dut._log.info("Holding reset...")
-    
-    dut.rst.value = 1
-    await ClockCycles(dut.clk_in, 3) #wait three clock cycles
-    dut.rst.value = 0
-    
-    test_vectors = []
-    H = 0.35
-
-    for i in range(5):
-        r = float32_to_binary16(random.uniform(0, 1.0))
-        r_rep = rep(r)
-        expected = (r - H)**2 * (6 / (pi * H**4)) if r <= H else 0
-        deriv_expected = -(2 * (r - H) * (6 / (pi * H**4))) if r <= H else 0
-        dut._log.info(f"r={r}, r_rep={r_rep}, {i%2} expected={(hex(rep(expected)), expected),} deriv_expected={(hex(rep(deriv_expected)), deriv_expected)}")
-        test_vectors.append((r_rep, i % 2, expected))
-    
-    outputs = []
-    # New inputs every clock cycle
-    dut.data_valid_in.value = 1
+    dut.r.value = 0
     dut.is_density_task.value = 1
-    for r, is_density, expected in test_vectors:
-        dut.r.value = int(r)
-        await ClockCycles(dut.clk_in, 1)
-        if dut.data_valid_out.value == 1:
-            value = dut.result.value
-            outputs.append(value)
-        # dut._log.info(f"r={half(r)} - {is_density=} - expected {(hex(rep(expected)),expected)}")
-    
-    dut.data_valid_in.value = 0
-    for _ in range(16):
-        await ClockCycles(dut.clk_in, 1)
-        if dut.data_valid_out.value == 1:
-            value = dut.result.value
-            outputs.append(value)
-            
-    await ClockCycles(dut.clk_in, len(test_vectors) + 12)
-    dut._log.info(f"Outputs: {[(half(o), o) for o in outputs]}")
+    await reset(dut)
+    await check_task(dut, is_density=True)
+    await check_task(dut, is_density=False)
 
     
 def test_runner():
@@ -70,14 +63,16 @@ def test_runner():
     parameters = PARAMETERS #setting parameter to a short amount (for testing)
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel=f"{MODULE}",
-        always=True,
         build_args=build_test_args,
         parameters=parameters,
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
@@ -85,7 +80,7 @@ def test_runner():
         hdl_toplevel_lang=hdl_toplevel_lang, # check this
         test_module=f"test_{MODULE}",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":
@@ -9,8 +9,11 @@ from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
 from cocotb.utils import get_sim_time as gst
 from cocotb.runner import get_runner
+from build_cache import cached_build, waves_enabled
+from pipeline_stream import stream
+import task_trace
 import numpy as np
-from test_binary16_adder import *
+from binary16_codec import rep, half
 from numpy import pi
 
 H = 2.0
@@ -24,21 +27,15 @@ DIV_KERNEL_COEFF = 12 / (pi * H**4)
 MODULE = "compute"
 H_rep, TARGET_DENSITY_rep, PRESSURE_CONST_rep, TIME_STEP_rep = rep(H), rep(TARGET_DENSITY), rep(PRESSURE_CONST), rep(TIME_STEP)
 KERNEL_COEFF_rep, DIV_KERNEL_COEFF_rep = rep(KERNEL_COEFF), rep(DIV_KERNEL_COEFF)
-PARAMETERS = {
+PARAMETERS = { # only compute.sv's, Verilator rejects the others
     "H": H_rep, 
-    "TIME_STEP": TIME_STEP_rep, 
-    # "PARTICLE_COUNT": N, 
     "DIMS": 2,
-    "BOUND": rep(BOUNDS[0]) << 16 | rep(BOUNDS[1]),
-    "TARGET_DENSITY": TARGET_DENSITY_rep,
-    "PRESSURE_CONST": PRESSURE_CONST_rep,
     "KERNEL_COEFF": KERNEL_COEFF_rep,
     "DIV_KERNEL_COEFF": DIV_KERNEL_COEFF_rep,
 }
 SOURCES = [f"{MODULE}.sv", 
            "binary16_adder.sv", 
            "binary16_multi.sv", 
-           "calc_kernel.sv", 
            "calc_distance.sv", 
            "binary16_sqrt.sv",
            "binary16_div.sv",
@@ -105,6 +102,62 @@ async def test(dut):
             
     await ClockCycles(dut.clk_in, 3)
     # dut._log.info(f"Outputs: {[half(o) for o in outputs]}")
+
+
+async def replay(dut, path):
+    """Replays the trace at path into compute (its clock running) and compares every result with the recorded one"""
+    header, records = task_trace.load(path)
+    dut._log.info(f"Replaying {len(records)} tasks of {path}")
+    dut.valid_task.value = 0
+    dut.gravitational_constant.value = header["gravitational_constant"]
+    dut.rst.value = 1
+    await ClockCycles(dut.clk_in, 3)
+    dut.rst.value = 0
+
+    results, report = await stream(dut, ("task_type", "data_in"), task_trace.rows(records), outputs=("data_out",),
+                                   name="compute replay", valid_in="valid_task")
+    task_trace.check(dut._log, records, results[:, 0])
+
+
+@cocotb.test
+async def test_record_replay(dut):
+    """Records compute's results for a few density and force tasks, then replays the saved trace into it"""
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.valid_task.value = 0
+    dut.gravitational_constant.value = rep(-12.0)
+    dut.rst.value = 1
+    await ClockCycles(dut.clk_in, 3)
+    dut.rst.value = 0
+
+    # every pair of a few particles within H of each other, both task types
+    rng = np.random.default_rng(6205)
+    positions = rng.uniform(0.0, H / 2, (4, 2))
+    pressures, recips = rng.uniform(0.5, 4.0, 4), rng.uniform(0.25, 1.0, 4)
+    tasks = np.zeros(2 * len(positions)**2, dtype=task_trace.record_dtype(PARAMETERS["DIMS"]))
+    for k, (task_type, i, j) in enumerate((t, i, j) for t in (0, 1) for i in range(len(positions)) for j in range(len(positions))):
+        words = [*map(rep, positions[i]), *map(rep, positions[j]), rep(pressures[i]), rep(pressures[j]), rep(recips[j])]
+        tasks[k] = (task_type, words, (0, 0))
+
+    recorder = task_trace.TaskRecorder(dut, PARAMETERS["DIMS"], task_data="data_in", result="data_out",
+                                       result_valid="data_valid_out").start()
+    await stream(dut, ("task_type", "data_in"), task_trace.rows(tasks), outputs=("data_out",),
+                 name="compute record", valid_in="valid_task")
+    recorder.stop()
+    assert len(recorder.tasks) == len(recorder.results) == len(tasks), \
+        f"{len(recorder.tasks)} tasks and {len(recorder.results)} results recorded, {len(tasks)} sent"
+    path = recorder.save("round_trip.trace", PARAMETERS)
+    dut._log.info(f"{len(recorder.tasks)} tasks traced to {path}")
+
+    await replay(dut, path)
+
+
+# TASK_TRACE=<file> replays a task trace recorded by test_simulator, one
+# task per clock, the build then takes the trace's parameters
+@cocotb.test(skip=not os.getenv("TASK_TRACE"))
+async def test_replay(dut):
+    """Replays a simulator run's tasks into compute and compares every result with the recorded one"""
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    await replay(dut, os.environ["TASK_TRACE"])
     
 def test_runner():
     hdl_toplevel_lang = os.getenv("HDL_TOPLEVEL_LANG", "verilog")
@@ -114,16 +167,20 @@ def test_runner():
     sources = [proj_path / "hdl" / s for s in SOURCES]
     build_test_args = ["-Wall"]
     parameters = PARAMETERS #setting parameter to a short amount (for testing)
+    if os.getenv("TASK_TRACE"):
+        parameters = task_trace.parameters(os.environ["TASK_TRACE"])
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel=f"{MODULE}",
-        always=True,
         build_args=build_test_args,
         parameters=parameters,
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
@@ -131,7 +188,7 @@ def test_runner():
         hdl_toplevel_lang=hdl_toplevel_lang, # check this
         test_module=f"test_{MODULE}",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":
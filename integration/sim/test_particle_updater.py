@@ -9,8 +9,9 @@ from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
 from cocotb.utils import get_sim_time as gst
 from cocotb.runner import get_runner
+from build_cache import cached_build, waves_enabled
 import numpy as np
-from test_binary16_adder import rep, half, float_to_binary16_int_rep
+from binary16_codec import rep, half, float_to_binary16_int_rep
 
 MODULE = "particle_updater"
 PARAMETERS = {"TIME_STEP": rep(1.0)}
@@ -78,14 +79,16 @@ def test_runner():
     parameters = PARAMETERS #setting parameter to a short amount (for testing)
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel=f"{MODULE}",
-        always=True,
         build_args=build_test_args,
         parameters=parameters,
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
@@ -93,7 +96,7 @@ def test_runner():
         hdl_toplevel_lang=hdl_toplevel_lang, # check this
         test_module=f"test_{MODULE}",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":
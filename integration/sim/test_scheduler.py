@@ -5,14 +5,114 @@ import sys
 from math import log
 import logging
 from pathlib import Path
+import numpy as np
 from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
 from cocotb.utils import get_sim_time as gst
 from cocotb.runner import get_runner
+from build_cache import cached_build, waves_enabled
+from binary16_codec import encode, decode
+import grid_schedule
 
 MODULE = "scheduler"
-PARAMETERS = {}
-SOURCES = [f"{MODULE}.sv"]
+
+# The scheduler against its task streams: a frame of N particles with
+# zero velocities, so the predicted x_j of every task is the stored
+# position and tells which address j it was read from. The particle memory
+# (2 cycles, HIGH_PERFORMANCE) and accum_storage's done_accumulating are
+# modeled here. scheduler.sv is checked against
+# grid_schedule.all_pairs_stream, and with GRID against
+# grid_schedule.task_stream.
+
+SEED = 6205 # the runner and the simulator both import this, they have to agree
+N = 48
+H = 0.25
+READ_LATENCY = 2
+ACCUMULATE_CYCLES = 32 # quiet cycles after the last task before done_accumulating
+
+rng = np.random.default_rng(SEED)
+positions = decode(encode(rng.uniform(0.0, 2.0, (N, 2))))
+GRID = grid_schedule.layout(positions, H)
+WORDS = encode(np.hstack([positions[GRID.order], np.zeros((N, 2))])).astype(np.int64)
+POSITION_WORDS = (WORDS[:, 0] << 16) | WORDS[:, 1]
+assert len(set(POSITION_WORDS.tolist())) == N, "positions have to be distinct to tell the tasks apart"
+
+TABLES = Path(__file__).resolve().parent.parent / "data" / MODULE # written by test_runner
+
+PARAMETERS = {
+    "DIMS": 2,
+    "ADDR_WIDTH": 16,
+    "RAM_WIDTH": 64,
+    "TASK_WIDTH": 16 * 7,
+}
+GRID_PARAMETERS = {
+    **PARAMETERS,
+    **GRID.parameters,
+    "CELL_FILE": f'"{(TABLES / grid_schedule.CELLS_FILE).as_posix()}"',
+    "PARTICLE_CELL_FILE": f'"{(TABLES / grid_schedule.PARTICLE_CELLS_FILE).as_posix()}"',
+}
+SOURCES = [f"{MODULE}.sv", "binary16_multi.sv", "binary16_adder.sv"]
+# parameters, tests run on that build
+BUILDS = [
+    (PARAMETERS, ["test_a", "test_all_pairs_task_stream"]),
+    (GRID_PARAMETERS, ["test_grid_task_stream"]),
+]
+STORED = [int((w[0] << 48) | (w[1] << 32) | (w[2] << 16) | w[3]) for w in WORDS]
+
+
+async def particle_memory(dut):
+    """Answers addr_out with its {x, y, v_x, v_y} word READ_LATENCY clocks later."""
+    addresses = [0] * (READ_LATENCY + 1)
+    while True:
+        await RisingEdge(dut.clk_in)
+        await ReadOnly()
+        addresses = addresses[1:] + [int(dut.addr_out.value)]
+        await FallingEdge(dut.clk_in)
+        address = addresses[0]
+        word = WORDS[address] if address < N else np.zeros(4, dtype=np.int64)
+        dut.mem_in.value = int((word[0] << 48) | (word[1] << 32) | (word[2] << 16) | word[3])
+
+
+async def accumulator(dut):
+    """Pulses done_accumulating once the tasks of a particle stopped for ACCUMULATE_CYCLES."""
+    quiet, tasks = 0, 0
+    while True:
+        await RisingEdge(dut.clk_in)
+        await ReadOnly()
+        tasks += int(dut.valid_task.value)
+        quiet = 0 if dut.valid_task.value == 1 else quiet + 1
+        await FallingEdge(dut.clk_in)
+        done = tasks > 0 and quiet == ACCUMULATE_CYCLES
+        dut.done_accumulating.value = int(done)
+        if done:
+            tasks = 0
+
+
+async def collect(dut, tasks):
+    """Appends (phase, i, j) of every issued task, checking its x_i on the way."""
+    while True:
+        await RisingEdge(dut.clk_in)
+        await ReadOnly()
+        if dut.valid_task.value == 1:
+            data = int(dut.task_data.value)
+            i = int(dut.main_index.value)
+            x_i, x_j = data >> 80, (data >> 48) & 0xFFFFFFFF
+            assert x_i == POSITION_WORDS[i], f"task of particle {i} carries x_i {x_i:08x}"
+            matches = np.flatnonzero(POSITION_WORDS == x_j)
+            assert len(matches) == 1, f"task of particle {i} carries an unknown x_j {x_j:08x}"
+            phase = grid_schedule.PHASES.index("density" if dut.is_density_task.value == 1 else "force")
+            tasks.append((phase, i, int(matches[0])))
+
+
+async def readback(dut, words):
+    """Appends the particle word of mem_in at every clock reading_positions is high."""
+    while True:
+        # after particle_memory's update, what the renderer takes at the next edge
+        await FallingEdge(dut.clk_in)
+        await ReadOnly()
+        if dut.reading_positions.value == 1:
+            words.append(int(dut.mem_in.value))
+
 
 @cocotb.test
 async def test_a(dut):
@@ -24,43 +124,100 @@ async def test_a(dut):
     dut.rst_in.value = 0
     await FallingEdge(dut.clk_in)
     
-    dut.new_frame = 1
+    dut.new_frame.value = 1
     await FallingEdge(dut.clk_in)
-    dut.new_frame = 0
+    dut.new_frame.value = 0
     
     await ClockCycles(dut.clk_in, 10)
     
     # await with_timeout(RisingEdge(dut.data_valid_out),5000,'ns')
     await ReadOnly()
 
-    
+
+async def run_frame(dut):
+    """Runs one frame, returns the (phase, i, j) of its tasks and the words read back for the renderer."""
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.new_frame.value = 0
+    dut.mem_in.value = 0
+    dut.density_reciprocal.value = 0
+    dut.pressure.value = 0
+    dut.done_accumulating.value = 0
+    dut.particle_count.value = N
+    dut.rst_in.value = 1
+    await ClockCycles(dut.clk_in, 3)
+    dut.rst_in.value = 0
+
+    tasks, words = [], []
+    cocotb.start_soon(particle_memory(dut))
+    cocotb.start_soon(accumulator(dut))
+    cocotb.start_soon(collect(dut, tasks))
+    cocotb.start_soon(readback(dut, words))
+
+    await FallingEdge(dut.clk_in)
+    dut.new_frame.value = 1
+    await FallingEdge(dut.clk_in)
+    dut.new_frame.value = 0
+    await RisingEdge(dut.clk_in)
+    await with_timeout(RisingEdge(dut.done), 2 * N * N * 100, 'ns')
+    return tasks, words
+
+
+def check_stream(dut, tasks, stream):
+    expected = list(zip(*(x.tolist() for x in stream)))
+    dut._log.info(f"{len(tasks)} tasks issued, {len(expected)} expected, {2 * N * N} for all pairs")
+    for k, (got, want) in enumerate(zip(tasks, expected)):
+        assert got == want, f"task {k} is (phase, i, j) {got}, expected {want}"
+    assert len(tasks) == len(expected), f"{len(tasks)} tasks issued, expected {len(expected)}"
+
+
+@cocotb.test()
+async def test_all_pairs_task_stream(dut):
+    """The all pairs scheduler issues every (i, j) of both phases, in order."""
+    tasks, words = await run_frame(dut)
+    check_stream(dut, tasks, grid_schedule.all_pairs_stream(N))
+    # every density sweep reads the particles in order for the renderer
+    assert words == STORED * N, f"reading_positions saw {len(words)} words, not the {N} particles {N} times in order"
+
+
+@cocotb.test()
+async def test_grid_task_stream(dut):
+    """The grid mode issues exactly the tasks of grid_schedule.task_stream, in its order."""
+    tasks, words = await run_frame(dut)
+    check_stream(dut, tasks, grid_schedule.task_stream(GRID))
+    # the renderer's read back of the particles, in address order
+    assert words == STORED, f"reading_positions saw {len(words)} words, not the {N} particles in order"
+
+
 def test_runner():
     hdl_toplevel_lang = os.getenv("HDL_TOPLEVEL_LANG", "verilog")
     sim = os.getenv("SIM", "icarus")
     proj_path = Path(__file__).resolve().parent.parent
     sys.path.append(str(proj_path / "sim" / "model"))
-    sources = [proj_path / "hdl" / s for s in SOURCES]
     build_test_args = ["-Wall"]
-    parameters = PARAMETERS #setting parameter to a short amount (for testing)
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
-        sources=sources,
-        hdl_toplevel=f"{MODULE}",
-        always=True,
-        build_args=build_test_args,
-        parameters=parameters,
-        timescale = ('1ns','1ps'),
-        waves=True
-    )
-    run_test_args = []
-    runner.test(
-        hdl_toplevel=f"{MODULE}",
-        hdl_toplevel_lang=hdl_toplevel_lang, # check this
-        test_module=f"test_{MODULE}",
-        test_args=run_test_args,
-        waves=True
-    )
+    waves = waves_enabled()
+    GRID.write_tables(TABLES)
+    sources = [proj_path / "hdl" / s for s in SOURCES]
+    for parameters, tests in BUILDS:
+        cached_build(
+            runner,
+            proj_path,
+            sources=sources,
+            hdl_toplevel=f"{MODULE}",
+            build_args=build_test_args,
+            parameters=parameters,
+            timescale = ('1ns','1ps'),
+            waves=waves
+        )
+        runner.test(
+            hdl_toplevel=f"{MODULE}",
+            hdl_toplevel_lang=hdl_toplevel_lang, # check this
+            test_module=f"test_{MODULE}",
+            testcase=tests,
+            test_args=[],
+            waves=waves
+        )
 
 if __name__ == "__main__":
-    test_runner()
\ No newline at end of file
+    test_runner()
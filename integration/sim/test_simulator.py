@@ -9,7 +9,11 @@ from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
 from cocotb.utils import get_sim_time as gst
 from cocotb.runner import get_runner
-from test_funcs import half, float32_to_binary16, float_to_binary16_int_rep, rep
+from build_cache import cached_build, waves_enabled
+from frame_probe import FrameProbe, record
+from task_trace import TaskRecorder
+from binary16_codec import half, rep, decode_particles
+import mem_image
 from sph_engine import *
 import pygame
 
@@ -34,6 +38,12 @@ TARGET_DENSITY = 2.0
 PRESSURE_CONST = 8.0
 
 positions = [(random.uniform(0, 1), random.uniform(0, 1)) for _ in range(64)]
+velocities = [(0.0, 0.0) for _ in range(len(positions))]
+# CHECKPOINT=<sph_checkpoint directory> starts from a saved (e.g. settled) state instead
+if os.getenv("CHECKPOINT"):
+    import sph_checkpoint
+    checkpoint = sph_checkpoint.load(os.getenv("CHECKPOINT"))
+    positions, velocities = checkpoint["positions"].tolist(), checkpoint["velocities"].tolist()
 # positions = [
 #     (0.0, 0.0),
 #     (1.0, 1.0),
@@ -42,16 +52,9 @@ positions = [(random.uniform(0, 1), random.uniform(0, 1)) for _ in range(64)]
 # ]
 N = len(positions)
 
-velocities = [(0.0, 0.0) for _ in range(len(positions))]
-
-# Convert positions and velocities to binary16 representations
-positions_binary16 = [(float_to_binary16_int_rep(pos[0]), float_to_binary16_int_rep(pos[1])) for pos in positions]
-velocities_binary16 = [(float_to_binary16_int_rep(vel[0]), float_to_binary16_int_rep(vel[1])) for vel in velocities]
-
-# Write the binary16 values to ../data/particle.mem
-with open("/mnt/c/Users/morvi/Documents/Classes/Fall24/6.205/project/simulator/data/particle.mem", "w") as mem_file:
-    for (x, y), (v_x, v_y) in zip(positions_binary16, velocities_binary16):
-        mem_file.write(f"{x:04x}{y:04x}{v_x:04x}{v_y:04x}\n")
+# Write the binary16 {x, y, v_x, v_y} words to ../data/particle.mem, where
+# the simulator's INIT_FILE finds it from sim_build
+mem_image.write_particles(Path(__file__).resolve().parent.parent / "data" / "particle.mem", positions, velocities)
         
 particles = [Particle(np.array(p), np.array(v)) for p, v in zip(positions, velocities)]
 engine = SPH_Engine(
@@ -105,6 +108,7 @@ SOURCES = [
     "debouncer.sv",
     
     "compute.sv",
+    "lane_merge.sv",
     "calc_density.sv",
     "calc_kernel.sv",
     "calc_distance.sv",
@@ -169,6 +173,9 @@ async def top_test(dut):
 
     if True:
         
+        probe = FrameProbe(dut).start()
+        # TASK_TRACE=<file> records compute's task stream for test_compute to replay
+        recorder = TaskRecorder(dut, PARAMETERS["DIMS"]).start() if os.getenv("TASK_TRACE") else None
         for _ in range(1): # frames
 
             # await flash_sig(clk, dut.btn[1])
@@ -180,7 +187,7 @@ async def top_test(dut):
             # await FallingEdge(dut.is_density_task)
             
             engine.update()
-            forces, velocities, positions = [], [], []
+            forces, words = [], []
             particles = []
             terms = []
             for _ in range(N):
@@ -202,13 +209,8 @@ async def top_test(dut):
                 
                 # Velocities and positions
                 await Timer(1, "ns")
-                val = dut.douta.value
-                position = val >> 32
-                velocity = val & 0xFFFFFFFF
-                # dut._log.info(f"position {hex(position)}")
-                # dut._log.info(f"velocity {hex(velocity)}")
-                positions.append([half((position & (0xFFFF << i * 16)) >> i * 16) for i in range(1, -1, -1)])
-                velocities.append([half((velocity & (0xFFFF << i * 16)) >> i * 16) for i in range(1, -1, -1)])
+                # decoded all at once after the frame
+                words.append(int(dut.douta.value))
                 await ClockCycles(clk, 1)
                 
                 # velocity = dut.mp_updater.mem_out.value & 0xFFFFFFFF
@@ -223,10 +225,15 @@ async def top_test(dut):
 
                 
             await with_timeout(RisingEdge(dut.frame_complete), 10*10000, "ns")
+            positions, velocities = decode_particles(words)
             dut._log.info(f"Particles: {list(zip(positions, velocities))[:3]}")
             # dut._log.info(f"Particles: {[(half(p[0]), half(p[1])) for p in particles[:3]]}")
             # dut._log.info(f"Terms: {terms}")
             dut._log.info(f"Engine particles: {engine.particles[:3]}")
+            record(dut, probe.report(N, PARAMETERS["DIMS"]))
+            if recorder is not None:
+                path = recorder.save(os.environ["TASK_TRACE"], PARAMETERS)
+                dut._log.info(f"{len(recorder.tasks)} tasks traced to {path}")
             # dut._log.info(f"Forces: {forces}")
             # dut._log.info(f"Engine force: {engine.pressure_forces[:3]}")
             # dut._log.info(f"Engine force: {[(hex(rep(f[1])), hex(rep(f[0]))) for f in engine.pressure_forces[:3]]}")
@@ -313,14 +320,16 @@ def test_runner():
     parameters = PARAMETERS #setting parameter to a short amount (for testing)
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel=f"{MODULE}",
-        always=True,
         build_args=build_test_args,
         parameters=parameters,
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
@@ -328,7 +337,7 @@ def test_runner():
         hdl_toplevel_lang=hdl_toplevel_lang, # check this
         test_module=f"test_{MODULE}",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":
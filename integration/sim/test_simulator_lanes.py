@@ -0,0 +1,185 @@
+import cocotb
+import json
+import os
+import sys
+from pathlib import Path
+from dataclasses import replace
+import numpy as np
+from cocotb.clock import Clock
+from cocotb.triggers import Timer, ClockCycles, RisingEdge, with_timeout
+from cocotb.runner import get_runner
+from build_cache import build_root, cached_build, waves_enabled
+from frame_probe import FrameProbe, record
+from binary16_codec import rep, encode, unpack
+import mem_image
+import sph_binary16
+import sph_perf
+
+MODULE = "simulator"
+
+# Frame cycles of simulator.sv against its COMPUTE_LANES. Every lane count
+# is its own build, run for one frame of the same N seeded particles; the
+# FrameProbe report of each is logged next to the sph_perf prediction for
+# that many lanes, appended to LANES_REPORT, and the runner prints the
+# table. The particles are checked against sph_binary16.frame with the
+# same lanes, whose sums are grouped like lane_merge.sv's.
+
+SEED = 6205
+N = 32
+LANES = (1, 2, 4, 8)
+DIMS = 2
+H = 0.25
+BOUNDS = (2.0, 2.0)
+TIME_STEP = 1/30
+TARGET_DENSITY = 2.0
+PRESSURE_CONST = 8.0
+DAMPING_FACTOR = 0.55
+GRAVITY = -12.0
+
+rng = np.random.default_rng(SEED)
+positions = rng.uniform(0.0, 1.0, (N, DIMS))
+velocities = np.zeros((N, DIMS))
+mem_image.write_particles(Path(__file__).resolve().parent.parent / "data" / "particle.mem", positions, velocities)
+
+CONSTANTS = sph_binary16.HardwareConstants(
+    h=rep(H),
+    kernel_coeff=rep(6 / (np.pi * H**4)),
+    div_kernel_coeff=rep(12 / (np.pi * H**4)),
+    time_step=rep(TIME_STEP),
+    target_density=rep(TARGET_DENSITY),
+    pressure_const=rep(PRESSURE_CONST),
+    gravity=rep(GRAVITY),
+    bounds=tuple(rep(b) for b in BOUNDS),
+    collision_damping=rep(DAMPING_FACTOR))
+
+PARAMETERS = {
+    "H": CONSTANTS.h,
+    "TIME_STEP": CONSTANTS.time_step,
+    "PARTICLE_COUNT": N,
+    "DIMS": DIMS,
+    "BOUND": CONSTANTS.bounds[0] << 16 | CONSTANTS.bounds[1],
+    "TARGET_DENSITY": CONSTANTS.target_density,
+    "PRESSURE_CONST": CONSTANTS.pressure_const,
+    "KERNEL_COEFF": CONSTANTS.kernel_coeff,
+    "DIV_KERNEL_COEFF": CONSTANTS.div_kernel_coeff,
+    "DAMPING_FACTOR": CONSTANTS.collision_damping,
+}
+
+SOURCES = [
+    f"{MODULE}.sv",
+    "binary16_adder.sv",
+    "binary16_multi.sv",
+    "binary16_sqrt.sv",
+    "binary16_div.sv",
+    "binary16_div_pipelined.sv",
+    "particle_buffer.v",
+    "scheduler.sv",
+    "accumulator.sv",
+    "accum_storage.sv",
+    "elem_accumulator.sv",
+    "particle_updater.sv",
+    "pulser.sv",
+    "debouncer.sv",
+    "compute.sv",
+    "lane_merge.sv",
+    "calc_density.sv",
+    "calc_kernel.sv",
+    "calc_distance.sv",
+    "xilinx_true_dual_port_read_first_2_clock_ram.v",
+    "update_buffer.sv",
+    "seven_segment_controller.sv",
+    "evt_counter.sv",
+    "resetter.sv",
+    "lfsr_16.sv",
+    "calc_spiky_kernel.sv",
+]
+
+
+async def flash_sig(clk, sig):
+    sig.value = 1
+    await RisingEdge(clk)
+    sig.value = 0
+    await RisingEdge(clk)
+
+
+@cocotb.test()
+async def test_frame_cycles(dut):
+    """One frame on COMPUTE_LANES lanes, timed against sph_perf and checked against sph_binary16."""
+    lanes = int(os.getenv("COMPUTE_LANES", "1"))
+    params = replace(sph_perf.DEFAULT_PARAMS, lanes=lanes)
+    clk = dut.clk_in
+    cocotb.start_soon(Clock(clk, 10, units="ns").start())
+    dut.particle_count.value = N
+    dut.pressure_const.value = CONSTANTS.pressure_const
+    dut.target_density.value = CONSTANTS.target_density
+    dut.gravitational_constant.value = CONSTANTS.gravity
+    await flash_sig(clk, dut.sys_rst)
+
+    probe = FrameProbe(dut).start()
+    await flash_sig(clk, dut.new_frame)
+    timeout = 2 * float(sph_perf.frame_cycles(N, DIMS, params)) * 10
+    await with_timeout(RisingEdge(dut.frame_complete), timeout, "ns")
+    await RisingEdge(dut.valid_particle)
+    words = []
+    for _ in range(N):
+        await Timer(1, "ns")
+        words.append(int(dut.douta.value))
+        await ClockCycles(clk, 1)
+    await with_timeout(RisingEdge(dut.frame_complete), timeout, "ns")
+
+    report = probe.report(N, DIMS, params)
+    record(dut, report)
+    if os.getenv("LANES_REPORT"):
+        report.save(os.environ["LANES_REPORT"])
+
+    expected = sph_binary16.frame(encode(positions), encode(velocities), CONSTANTS, lanes=lanes)
+    got = unpack(np.array(words), 2 * DIMS)
+    want = np.hstack([expected["positions"], expected["velocities"]])
+    mismatches = np.flatnonzero(np.any(got != want, axis=1))
+    for k in mismatches[:10]:
+        dut._log.error(f"particle {k}: {[f'{w:04x}' for w in got[k]]}, expected {[f'{w:04x}' for w in want[k]]}")
+    assert not len(mismatches), f"{len(mismatches)} of {N} particles differ from sph_binary16.frame(lanes={lanes})"
+
+
+def test_runner():
+    hdl_toplevel_lang = os.getenv("HDL_TOPLEVEL_LANG", "verilog")
+    sim = os.getenv("SIM", "icarus")
+    proj_path = Path(__file__).resolve().parent.parent
+    sys.path.append(str(proj_path / "sim" / "model"))
+    sources = [proj_path / "hdl" / s for s in SOURCES]
+    build_test_args = ["-Wall"]
+    sys.path.append(str(proj_path / "sim"))
+    runner = get_runner(sim)
+    waves = waves_enabled()
+    report_path = build_root(proj_path) / "lanes.jsonl"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text("")
+    for lanes in LANES:
+        cached_build(
+            runner,
+            proj_path,
+            sources=sources,
+            hdl_toplevel=f"{MODULE}",
+            build_args=build_test_args,
+            parameters={**PARAMETERS, "COMPUTE_LANES": lanes},
+            timescale = ('1ns','1ps'),
+            waves=waves
+        )
+        runner.test(
+            hdl_toplevel=f"{MODULE}",
+            hdl_toplevel_lang=hdl_toplevel_lang,
+            test_module=f"test_{MODULE}_lanes",
+            test_args=[],
+            extra_env={"COMPUTE_LANES": str(lanes), "LANES_REPORT": str(report_path)},
+            waves=waves
+        )
+
+    reports = [json.loads(line) for line in report_path.read_text().splitlines() if line.strip()]
+    base = next((r["frame_cycles"] for r in reports if r["lanes"] == 1), None)
+    print(f"{'lanes':>5} {'cycles':>8} {'predicted':>9} {'speedup':>7}")
+    for r in reports:
+        speedup = f"{base / r['frame_cycles']:.2f}" if base else "-"
+        print(f"{r['lanes']:>5} {r['frame_cycles']:>8} {r['predicted']['total']:>9.0f} {speedup:>7}")
+
+if __name__ == "__main__":
+    test_runner()
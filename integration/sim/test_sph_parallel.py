@@ -0,0 +1,44 @@
+import sys
+import numpy as np
+import pytest
+import sph_runner
+
+# SPH_ParallelEngine outside cocotb: python test_sph_parallel.py (or
+# pytest) writes results.xml like the cocotb testbenches do, for
+# regression.py.
+
+
+def engine(**overrides):
+    scenario = sph_runner.load_scenario(engine="SPH_ParallelEngine", **overrides)
+    scenario["engine_args"] = {"workers": 2}
+    return sph_runner.make_engine(scenario)
+
+
+def test_update_after_close():
+    """close() keeps the state, the next update() starts new workers on it and continues the run."""
+    with engine() as reference:
+        for _ in range(3):
+            reference.update()
+        expected = reference.positions.copy(), reference.velocities.copy()
+
+    closed = engine()
+    closed.update()
+    closed.close()
+    closed.update()
+    closed.close()
+    closed.update()
+    closed.close()
+    np.testing.assert_array_equal(closed.positions, expected[0])
+    np.testing.assert_array_equal(closed.velocities, expected[1])
+
+
+def test_run_twice():
+    """sph_runner.run leaves the engine open for its caller."""
+    with engine() as e:
+        sph_runner.run(e, 2)
+        sph_runner.run(e, 2)
+        assert e.processes, "run() closed an engine it doesn't own"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q", "--junitxml=results.xml"]))
@@ -0,0 +1,209 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+# Runs every cocotb testbench of the repo in parallel and collects their
+# results into one xUnit file.
+#
+# A testbench is a test_*.py under TREES/sim with a __main__ that runs its
+# test_runner(). Each one runs as its own Python process in a directory of
+# its project, <tree>/sim_build-<name>: the runner's default sim_build
+# lands in it, and every tree's build_cache uses it as SIM_BUILD_ROOT, so
+# no two testbenches share a build directory and the cache is never pruned
+# under a running build. The directory is kept, later regressions reuse the
+# cached builds. Either way the build sits two levels below the project,
+# where FPATH's ../../data finds the data directory.
+#
+# Several testbenches write their project's data directory (particle.mem
+# when imported, the scheduler's tables in test_runner), which the
+# simulation reads back. Those of a project run one after another in one job, the
+# others all in parallel.
+#
+# Every results.xml a testbench leaves in its directory goes into the
+# report, each test case tagged with its testbench and timed; a testbench
+# that ends without one (a build error, a timeout) is an error case with
+# the end of its output.
+
+ROOT = Path(__file__).resolve().parent
+TREES = ("integration", "simulator", "rendering")
+REPORT = "regression.xml"
+LOG = "regression.log"
+TIMEOUT = 3600 # seconds a testbench may take
+TAIL = 40 # output lines kept for a testbench without results
+WRITES_DATA = re.compile(r"""["/]data["/]""")
+
+
+@dataclass
+class Testbench:
+    path: Path
+
+    @property
+    def project(self):
+        return self.path.parent.parent
+
+    @property
+    def name(self):
+        return f"{self.project.name}/{self.path.stem}"
+
+    @property
+    def work_dir(self):
+        return self.project / f"sim_build-{self.path.stem}"
+
+    @property
+    def writes_data(self):
+        return bool(WRITES_DATA.search(self.path.read_text(errors="replace")))
+
+
+@dataclass
+class Result:
+    testbench: Testbench
+    seconds: float
+    returncode: int
+    cases: list = field(default_factory=list) # testcase elements of its results.xml files
+    output: str = ""
+
+    @property
+    def failures(self):
+        return sum(1 for case in self.cases if case.find("failure") is not None or case.find("error") is not None)
+
+    @property
+    def passed(self):
+        return bool(self.cases) and not self.failures and self.returncode == 0
+
+
+def discover(trees=TREES, patterns=()):
+    """Testbenches under trees whose name matches any of patterns (all without patterns)."""
+    found = []
+    for tree in trees:
+        for path in sorted((ROOT / tree / "sim").glob("test_*.py")):
+            testbench = Testbench(path)
+            if "__main__" not in path.read_text(errors="replace"):
+                continue
+            if patterns and not any(re.search(p, testbench.name) for p in patterns):
+                continue
+            found.append(testbench)
+    return found
+
+
+def jobs(testbenches):
+    """Lists of testbenches to run in order, those writing the same data directory together."""
+    shared, alone = {}, []
+    for testbench in testbenches:
+        if testbench.writes_data:
+            shared.setdefault(testbench.project, []).append(testbench)
+        else:
+            alone.append([testbench])
+    return list(shared.values()) + alone
+
+
+def results(work_dir, since):
+    """testcase elements of the results.xml files written under work_dir after since."""
+    cases = []
+    for path in work_dir.rglob("*results.xml"):
+        if path.stat().st_mtime < since:
+            continue
+        try:
+            cases.extend(ET.parse(path).getroot().iter("testcase"))
+        except ET.ParseError:
+            pass
+    return cases
+
+
+def run(testbench, timeout=TIMEOUT):
+    """Runs one testbench's test_runner() in its work_dir, returns its Result."""
+    work_dir = testbench.work_dir
+    work_dir.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ, SIM_BUILD_ROOT=str(work_dir))
+    start = time.time()
+    try:
+        process = subprocess.run([sys.executable, str(testbench.path)], cwd=work_dir, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=timeout)
+        returncode, output = process.returncode, process.stdout
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout.decode(errors="replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+        returncode, output = -1, output + f"\ntimed out after {timeout} s"
+    seconds = time.time() - start
+    (work_dir / LOG).write_text(output)
+    return Result(testbench, seconds, returncode, results(work_dir, start), output)
+
+
+def run_job(job, timeout=TIMEOUT):
+    return [run(testbench, timeout) for testbench in job]
+
+
+def report(results, seconds):
+    """The xUnit tree of all results, one testsuite per testbench."""
+    suites = ET.Element("testsuites", name="regression", time=f"{seconds:.3f}")
+    for result in results:
+        suite = ET.SubElement(suites, "testsuite", name=result.testbench.name, time=f"{result.seconds:.3f}",
+                              tests=str(max(len(result.cases), 1)), failures=str(result.failures),
+                              errors=str(0 if result.cases else 1))
+        for case in result.cases:
+            case.set("classname", f"{result.testbench.name}.{case.get('classname', '')}".rstrip("."))
+            suite.append(case)
+        if not result.cases:
+            case = ET.SubElement(suite, "testcase", name="test_runner", classname=result.testbench.name,
+                                 time=f"{result.seconds:.3f}")
+            error = ET.SubElement(case, "error", message=f"no results, exit code {result.returncode}")
+            error.text = "\n".join(result.output.splitlines()[-TAIL:])
+    return ET.ElementTree(suites)
+
+
+def summary(results):
+    lines = []
+    for result in sorted(results, key=lambda r: -r.seconds):
+        status = "PASS" if result.passed else "FAIL"
+        lines.append(f"{status} {result.seconds:8.1f} s  {result.testbench.name}: "
+                     f"{len(result.cases)} tests, {result.failures} failed")
+        for case in result.cases:
+            if case.find("failure") is not None or case.find("error") is not None:
+                lines.append(f"       {case.get('name')} ({float(case.get('time', 0)):.1f} s)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the cocotb testbenches of the repo in parallel.")
+    parser.add_argument("patterns", nargs="*", help="regular expressions, run only the testbenches matching one")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="testbenches run at once")
+    parser.add_argument("--trees", nargs="+", default=TREES, choices=TREES)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="seconds per testbench")
+    parser.add_argument("-o", "--output", default=str(ROOT / REPORT), help="xUnit report")
+    parser.add_argument("--list", action="store_true", help="list the testbenches and jobs without running them")
+    args = parser.parse_args(argv)
+
+    testbenches = discover(args.trees, args.patterns)
+    if args.list:
+        for job in jobs(testbenches):
+            print(" -> ".join(testbench.name for testbench in job))
+        return 0
+
+    start = time.time()
+    done = []
+    # the testbenches are subprocesses, threads are enough to keep them going
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        futures = [pool.submit(run_job, job, args.timeout) for job in jobs(testbenches)]
+        for future in as_completed(futures):
+            for result in future.result():
+                print(f"{'PASS' if result.passed else 'FAIL'} {result.testbench.name} ({result.seconds:.1f} s)", flush=True)
+                done.append(result)
+    seconds = time.time() - start
+
+    tree = report(done, seconds)
+    ET.indent(tree)
+    tree.write(args.output, encoding="utf-8", xml_declaration=True)
+    serial = sum(result.seconds for result in done)
+    print(summary(done))
+    print(f"{len(done)} testbenches in {seconds:.1f} s ({serial:.1f} s serial), report in {args.output}")
+    return 0 if done and all(result.passed for result in done) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
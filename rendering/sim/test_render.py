@@ -8,24 +8,14 @@ from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly,with_timeout
 from cocotb.utils import get_sim_time as gst
 from cocotb.runner import get_runner
+from build_cache import cached_build, waves_enabled
 from PIL import Image
 import random 
 import numpy as np
 
-def float_to_binary_float16(float_num):
-    # Convert the float to a 16-bit float (half precision)
-    float16_value = np.float16(float_num)
-    
-    # Convert the 16-bit float to its binary representation
-    # np.float16() returns a numpy scalar, so we need to convert it to a binary string
-    binary_rep = format(float16_value.view(np.uint16), '016b')
-    print(float_num, binary_rep)
-    return int(binary_rep, 2)
-
-# Example usage
-float_num = 12.625
-binary_rep = float_to_binary_float16(float_num)
-print(binary_rep)
+# binary16 conversions are shared with the simulator project
+sys.path.append(str(Path(__file__).resolve().parents[2] / "integration" / "sim"))
+from binary16_codec import rep as float_to_binary_float16
 
 
 async def reset(rst,clk):
@@ -106,21 +96,23 @@ def render_runner():
 
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel="render",
-        always=True,
         build_args=build_test_args,
         parameters = {},
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
         hdl_toplevel="render",
         test_module="test_render",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+import cocotb
+
+
+# Content addressed HDL builds for the test_runner()s. A build goes to
+# sim_build/<toplevel>-<key> under the project, the key hashing the source
+# contents, parameters, build arguments, timescale, waves, the simulator
+# and the cocotb version, so any change to them gets its own directory and
+# an unchanged design is never compiled twice. The directory is two levels
+# below the project like the default sim/sim_build, so the ../../data paths
+# of FPATH still resolve from it.
+#
+# Waves are off unless WAVES=1, the testbench's own default otherwise.
+# SIM_BUILD_ROOT moves the cache elsewhere (regression.py gives every
+# testbench its own); it has to be a directory of the project for FPATH.
+
+STAMP = "build.key"
+KEEP = 4 # builds kept per toplevel, the least recently used are removed
+
+
+def waves_enabled(default=False):
+    """WAVES=1 or WAVES=0 from the environment, default when unset."""
+    value = os.getenv("WAVES")
+    return default if value is None else value not in ("", "0")
+
+
+def build_root(proj_path):
+    """The cache directory, SIM_BUILD_ROOT or sim_build under the project."""
+    root = os.getenv("SIM_BUILD_ROOT")
+    return Path(root) if root else Path(proj_path) / "sim_build"
+
+
+def build_key(runner, sources, hdl_toplevel, parameters, build_args, timescale, waves, options):
+    key = hashlib.sha256()
+    key.update(json.dumps({
+        "simulator": type(runner).__name__,
+        "cocotb": cocotb.__version__,
+        "toplevel": hdl_toplevel,
+        "parameters": {name: str(value) for name, value in parameters.items()},
+        "build_args": [str(arg) for arg in build_args],
+        "timescale": timescale,
+        "waves": waves,
+        "options": {name: str(value) for name, value in options.items()},
+        "sources": [Path(s).name for s in sources],
+    }, sort_keys=True).encode())
+    for source in sources:
+        key.update(Path(source).read_bytes())
+    return key.hexdigest()
+
+
+def prune(build_root, hdl_toplevel, keep=KEEP):
+    builds = sorted(build_root.glob(f"{hdl_toplevel}-*/{STAMP}"), key=lambda stamp: stamp.stat().st_mtime, reverse=True)
+    for stamp in builds[keep:]:
+        shutil.rmtree(stamp.parent, ignore_errors=True)
+
+
+def cached_build(runner, proj_path, sources, hdl_toplevel, parameters={}, build_args=[], timescale=None, waves=False, **options):
+    """
+    runner.build() into the cache, compiling only if this exact design was
+    never built. Takes runner.build's arguments (but not build_dir or
+    always) and returns the build directory.
+    """
+    key = build_key(runner, sources, hdl_toplevel, parameters, build_args, timescale, waves, options)
+    root = build_root(proj_path)
+    build_dir = root / f"{hdl_toplevel}-{key[:16]}"
+    stamp = build_dir / STAMP
+    hit = stamp.is_file() and stamp.read_text() == key
+    if hit:
+        # the simulators compare mtimes with the sources, a checkout that
+        # touched them without changing them must not trigger a rebuild
+        for output in build_dir.iterdir():
+            os.utime(output)
+    runner.build(
+        sources=sources,
+        hdl_toplevel=hdl_toplevel,
+        always=not hit,
+        build_dir=build_dir,
+        build_args=build_args,
+        parameters=parameters,
+        timescale=timescale,
+        waves=waves,
+        **options
+    )
+    if not hit:
+        tmp = stamp.with_suffix(".tmp")
+        tmp.write_text(key)
+        tmp.replace(stamp)
+    stamp.touch()
+    prune(root, hdl_toplevel)
+    return build_dir
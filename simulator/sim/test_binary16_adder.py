@@ -9,36 +9,9 @@ from cocotb.clock import Clock
 from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
 from cocotb.utils import get_sim_time as gst
 from cocotb.runner import get_runner
+from build_cache import cached_build, waves_enabled
 import numpy as np
-
-def rep(val):
-    return eval(f"0b{float32_to_binary16(val).view(np.uint16):016b}")
-
-def float32_to_binary16(val):
-    """Convert a 32-bit floating point number to a binary16 value."""
-    return np.float16(val)
-
-def half(val):
-    """Convert a binary16 number to a floating point number."""
-    sign = (val >> 15) & 0x1
-    exponent = (val >> 10) & 0x1F
-    fraction = val & 0x3FF
-
-    if exponent == 0:
-        if fraction == 0:
-            return 0.0
-        else:
-            return (-1)**sign * 2**(-14) * (fraction / 1024)
-    elif exponent == 0x1F:
-        if fraction == 0:
-            return float('inf') if sign == 0 else float('-inf')
-        else:
-            return float('nan')
-    else:
-        return (-1)**sign * 2**(exponent - 15) * (1 + fraction / 1024)
-    
-def float_to_binary16_int_rep(val):
-    return eval(f"0b{float32_to_binary16(val).view(np.uint16):016b}")
+from test_funcs import float32_to_binary16, half, rep, float_to_binary16_int_rep
 
 MODULE = "binary16_adder"
 PARAMETERS = {}
@@ -61,8 +34,8 @@ async def test(dut):
         b = float32_to_binary16(random.uniform(-10.0, 10.0))
         # a = float32_to_binary16(3.1)
         # b = float32_to_binary16(2.5)
-        a_rep = eval(f"0b{a.view(np.uint16):016b}")
-        b_rep = eval(f"0b{b.view(np.uint16):016b}")
+        a_rep = rep(a)
+        b_rep = rep(b)
         expected_sum = a + b
         dut._log.info(f"a={hex(a.view(np.uint16))}, b={hex(b.view(np.uint16))}, res={hex(expected_sum.view(np.uint16))}")
         test_vectors.append((a_rep, b_rep, expected_sum))
@@ -111,14 +84,16 @@ def test_runner():
     parameters = PARAMETERS #setting parameter to a short amount (for testing)
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel=f"{MODULE}",
-        always=True,
         build_args=build_test_args,
         parameters=parameters,
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
@@ -126,7 +101,7 @@ def test_runner():
         hdl_toplevel_lang=hdl_toplevel_lang, # check this
         test_module=f"test_{MODULE}",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":
@@ -10,33 +10,12 @@ import cocotb.simulator
 from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge, ReadOnly, with_timeout
 from cocotb.utils import get_sim_time as gst
 from cocotb.runner import get_runner
+from build_cache import cached_build, waves_enabled
 from cocotb.types import LogicArray
 import cocotb
 import numpy as np
+from test_funcs import float32_to_binary16, half, rep
 
-def float32_to_binary16(val):
-    """Convert a 32-bit floating point number to a 32-bit binary number."""
-    return np.float16(val)
-
-def half(val):
-    """Convert a 16-bit binary number to a half-precision floating point number."""
-    sign = (val >> 15) & 0x1
-    exponent = (val >> 10) & 0x1F
-    fraction = val & 0x3FF
-
-    if exponent == 0:
-        if fraction == 0:
-            return 0.0
-        else:
-            return (-1)**sign * 2**(-14) * (fraction / 1024)
-    elif exponent == 0x1F:
-        if fraction == 0:
-            return float('inf') if sign == 0 else float('-inf')
-        else:
-            return float('nan')
-    else:
-        return (-1)**sign * 2**(exponent - 15) * (1 + fraction / 1024)
-    
 MODULE = "binary16_sqrt"
 PARAMETERS = {}
 SOURCES = [f"{MODULE}.sv"]
@@ -59,7 +38,7 @@ async def test(dut):
         # n = float32_to_binary16(random.uniform(0, 500.0))
         # n = float32_to_binary16(400.75)
         n = float32_to_binary16(n)
-        n_rep = eval(f"0b{n.view(np.uint16):016b}")
+        n_rep = rep(n)
 
         n_mantissa = n_rep & 0x3FF | 0x400
         if n_rep & 0x0400:
@@ -137,14 +116,16 @@ def test_runner():
     parameters = PARAMETERS #setting parameter to a short amount (for testing)
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
-    runner.build(
+    waves = waves_enabled()
+    cached_build(
+        runner,
+        proj_path,
         sources=sources,
         hdl_toplevel=f"{MODULE}",
-        always=True,
         build_args=build_test_args,
         parameters=parameters,
         timescale = ('1ns','1ps'),
-        waves=True
+        waves=waves
     )
     run_test_args = []
     runner.test(
@@ -152,7 +133,7 @@ def test_runner():
         hdl_toplevel_lang=hdl_toplevel_lang, # check this
         test_module=f"test_{MODULE}",
         test_args=run_test_args,
-        waves=True
+        waves=waves
     )
 
 if __name__ == "__main__":